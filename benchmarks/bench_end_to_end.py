@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# end-to-end benchmark against simulated devices (see tuya_simulator.py, Python 3.7+)
+#	each client toggles the dps 1 of its device in a loop: set request then confirmation
+#	(dps of the set answer when present, status request otherwise, like the plugin)
+#	reports the command-to-confirmation latency and the sustained command throughput
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tuya_async
+import tuya_simulator
+
+#######################################################################
+#
+# percentile: value at ratio (0..1) of sorted values
+#
+#######################################################################
+def percentile(values, ratio):
+	if(len(values) == 0):
+		return 0.0
+	return values[min(len(values) - 1, int(ratio * len(values)))]
+
+#######################################################################
+#
+# client: toggle the dps 1 of the device until deadline
+#
+#######################################################################
+async def client(host, port, device, deadline, latencies, errors):
+	connection = tuya_async.TuyaConnection(host, device.dev_id, device.local_key, device.version, port, timeout=2.0)
+	state      = False
+	while(time.perf_counter() < deadline):
+		state = not state
+		start = time.perf_counter()
+		try:
+			dps = await connection.set({"1": state})
+			if(dps.get("1") != state):
+				errors.append("mismatch")
+				continue
+			latencies.append(time.perf_counter() - start)
+		except (OSError, asyncio.TimeoutError, ValueError) as e:
+			errors.append(type(e).__name__)
+	await connection.close()
+
+async def main(args):
+	devices = tuya_simulator.create_devices(args.devices, port=args.port, port_step=True,
+											version=args.version, latency=args.latency, fragment=args.fragment,
+											drop_rate=args.drop_rate, reply_dps=args.reply_dps, push=args.push)
+	servers   = [await device.start(host, port) for (host, port, device) in devices]
+	latencies = []
+	errors    = []
+	start     = time.perf_counter()
+	await asyncio.gather(*[client(host, port, device, start + args.duration, latencies, errors) for (host, port, device) in devices])
+	elapsed   = time.perf_counter() - start
+	for server in servers:
+		server.close()
+
+	latencies.sort()
+	print("devices: %d, protocol %s, duration %.1f s" % (args.devices, args.version, elapsed))
+	print("commands confirmed: %d (%.1f/s), errors: %d" % (len(latencies), len(latencies) / elapsed, len(errors)))
+	print("latency ms: p50 %.2f p95 %.2f max %.2f" % (percentile(latencies, 0.5) * 1e3, percentile(latencies, 0.95) * 1e3, percentile(latencies, 1.0) * 1e3))
+	print("requests received by the devices: %d" % sum(device.requests for (host, port, device) in devices))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="End-to-end latency/throughput benchmark against simulated Tuya devices")
+	parser.add_argument("--devices",   type=int,   default=10)
+	parser.add_argument("--duration",  type=float, default=5.0,  help="seconds")
+	parser.add_argument("--port",      type=int,   default=16668, help="port of the first simulated device")
+	parser.add_argument("--version",   type=float, default=3.1,  choices=(3.1, 3.3))
+	parser.add_argument("--latency",   type=float, default=0.0,  help="answer latency of the devices (seconds)")
+	parser.add_argument("--fragment",  type=int,   default=0,    help="fragment size of the answers (bytes)")
+	parser.add_argument("--drop-rate", type=float, default=0.0,  help="probability of a connection drop per request")
+	parser.add_argument("--reply-dps", action="store_true",      help="set answers hold the new dps")
+	parser.add_argument("--push",      action="store_true",      help="devices push the new state after a set")
+	asyncio.run(main(parser.parse_args()))
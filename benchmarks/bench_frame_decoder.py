@@ -0,0 +1,80 @@
+#!/usr/bin/python3
+
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+# micro-benchmark of tuya_protocol.FrameDecoder (clear text 3.1 status frames)
+#	whole:      one frame per chunk (what the former substring scan supported)
+#	coalesced:  several frames per chunk
+#	fragmented: frames split in small chunks
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tuya_protocol
+
+
+parser = argparse.ArgumentParser(description="throughput of tuya_protocol.FrameDecoder")
+parser.add_argument("count", type=int, nargs="?", default=20000, help="number of frames (default 20000)")
+count  = parser.parse_args().count
+
+status = {"devId": "01234567890123456789", "dps": {"1": True, "2": False, "3": True, "4": False, "7": True, "9": 0}}
+frame  = tuya_protocol.encode_frame(tuya_protocol.DP_QUERY, json.dumps(status).encode(), retcode=0)
+stream = frame * count
+
+#######################################################################
+#
+# run: feed the chunks and returns (frames/s, MB/s)
+#
+#######################################################################
+def run(chunks):
+	decoder = tuya_protocol.FrameDecoder()
+	decoded = 0
+	start   = time.perf_counter()
+	for chunk in chunks:
+		decoded += len(decoder.feed(chunk))
+	elapsed = time.perf_counter() - start
+	if(decoded != count):
+		print("decoding error: " + str(decoded) + " frames instead of " + str(count))
+		exit(1)
+	return (decoded / elapsed, len(stream) / elapsed / 1e6)
+
+scenarios = (
+	("whole",      [frame] * count),
+	("coalesced",  [stream[i:i + len(frame) * 8] for i in range(0, len(stream), len(frame) * 8)]),
+	("fragmented", [stream[i:i + 17] for i in range(0, len(stream), 17)]),
+)
+
+print("frame size: " + str(len(frame)) + " bytes, frames: " + str(count))
+for (name, chunks) in scenarios:
+	(fps, mbps) = run(chunks)
+	print("%-11s %10.0f frames/s %8.2f MB/s" % (name, fps, mbps))
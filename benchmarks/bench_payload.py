@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# micro-benchmark of tuya_protocol.PayloadEncoder against pytuya.generate_payload
+#	cost per heartbeat (status frame) and per command (set frame)
+#	pytuya is optional: without it only the encoder is measured
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tuya_protocol
+
+try:
+	import pytuya
+except ImportError:
+	pytuya = None
+
+
+parser = argparse.ArgumentParser(description="cost of the frames built by tuya_protocol.PayloadEncoder")
+parser.add_argument("count", type=int, nargs="?", default=20000, help="number of iterations (default 20000)")
+count  = parser.parse_args().count
+
+DEV_ID    = "01234567890123456789"
+LOCAL_KEY = "0123456789abcdef"
+SETS      = ({"1": True}, {"1": False}, {"1": True, "2": True}, {"1": False, "2": False})
+
+#######################################################################
+#
+# measure: returns the time per call in microseconds
+#
+#######################################################################
+def measure(function):
+	start = time.perf_counter()
+	for i in range(count):
+		function(i)
+	return (time.perf_counter() - start) / count * 1e6
+
+for version in (3.1, 3.3):
+
+	encoder = tuya_protocol.PayloadEncoder(DEV_ID, LOCAL_KEY.encode('latin1'), version)
+	results = [("encoder status", measure(lambda i: encoder.status())),
+			   ("encoder set",    measure(lambda i: encoder.set(SETS[i % len(SETS)])))]
+
+	if(pytuya is not None):
+		device = pytuya.OutletDevice(DEV_ID, "127.0.0.1", LOCAL_KEY)
+		device.set_version(version)
+
+		#same bytes as pytuya (same second)
+		now = int(time.time())
+		if(device.generate_payload('set', SETS[0]) != encoder.set(SETS[0], now) or device.generate_payload('status') != encoder.status()):
+			print("warning: frames differ from pytuya (second boundary?)")
+
+		results += [("pytuya status", measure(lambda i: device.generate_payload('status'))),
+					("pytuya set",    measure(lambda i: device.generate_payload('set', SETS[i % len(SETS)])))]
+
+	print("protocol " + str(version) + " (" + ("PyCrypto" if tuya_protocol.AES is not None else "pyaes") + ")")
+	for (name, us) in results:
+		print("  %-15s %8.2f us/call" % (name, us))
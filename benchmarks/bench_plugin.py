@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# replay of plug activity through plugin.py with the fake Domoticz runtime (virtual clock)
+#	N simulated devices in multi device mode (single device mode with --devices 1)
+#	random commands and button presses, then reports the callbacks, the Devices[...].Update calls
+#	and the bytes exchanged per configuration
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_domoticz
+import tuya_simulator
+
+def main(args):
+	simulated = tuya_simulator.create_devices(args.devices, host="10.0.0.1", dps_ids=args.dps.split(","),
+											  version=args.version, latency=args.latency, fragment=args.fragment,
+											  drop_rate=args.drop_rate, reply_dps=args.reply_dps, push=args.push, idle=args.idle, loss_rate=args.loss_rate, meter=args.meter)
+	if(args.mixed):	#mixed firmware fleet: every other device uses the other protocol version
+		for (host, port, device) in simulated[1::2]:
+			device.version = 3.3 if args.version == 3.1 else 3.1
+	dps_count  = len(args.dps.split(","))
+	per_device = dps_count + (3 if args.meter else 0)	#units of a device (multi device mode)
+
+	parameters = {"Mode4": "None", "Mode5": "None", "Mode6": "0", "Username": args.options, "HardwareID": 1, "HomeFolder": (args.home or tempfile.mkdtemp()) + os.sep}
+	if(args.devices == 1):
+		(host, port, device) = simulated[0]
+		parameters.update({"Address": host, "Mode1": device.dev_id, "Mode2": device.local_key, "Mode3": ";".join(args.dps.split(","))})
+	else:
+		inventory = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False)
+		entries = tuya_simulator.inventory(simulated)
+		if(args.negotiate):	#versions negotiated by the plugin
+			for entry in entries:
+				del entry["version"]
+		json.dump(entries, inventory)
+		inventory.close()
+		parameters.update({"Address": inventory.name, "Mode1": "", "Mode2": "", "Mode3": ""})
+
+	if(args.unreachable > 0):	#inventory entries without device (unplugged)
+		if(args.devices == 1):
+			raise SystemExit("--unreachable needs --devices > 1")
+		with open(parameters["Address"]) as f:
+			entries = json.load(f)
+		entries += [{"name": "Unplugged " + str(i), "ip": "10.1.0." + str(i + 1), "devId": "unplugged%011d" % i,
+					 "localKey": "0123456789abcdef", "dps": ";".join(args.dps.split(","))} for i in range(args.unreachable)]
+		with open(parameters["Address"], "w") as f:
+			json.dump(entries, f)
+
+	random.seed(args.seed)	#jitter of the plugin
+	runtime = fake_domoticz.Runtime(parameters, dict((host, device) for (host, port, device) in simulated), verbose=args.verbose)
+
+	#activity: commands (Domoticz side) and button presses (device side)
+	rng      = random.Random(args.seed)
+	duration = args.hours * 3600
+	for i in range(int(args.commands * args.hours)):
+		index = rng.randrange(args.devices)
+		unit  = (index * per_device if args.devices > 1 else 0) + 1 + rng.randrange(dps_count)
+		if(args.devices == 1):
+			unit = int(args.dps.split(",")[unit - 1])
+		runtime.command(rng.uniform(0, duration), unit, rng.choice(("On", "Off")))
+	presses = []	#(time, unit, new state) of the button presses
+	for i in range(int(args.presses * args.hours)):
+		index  = rng.randrange(args.devices)
+		dps_id = rng.choice(args.dps.split(","))
+		unit   = int(dps_id) if args.devices == 1 else index * per_device + 1 + args.dps.split(",").index(dps_id)
+		(host, port, device) = simulated[index]
+		at = rng.uniform(0, duration)
+		runtime.press(at, host, dps_id)
+		runtime.schedule(at, lambda at=at, unit=unit, device=device, dps_id=dps_id: presses.append((at, unit, int(device.dps[dps_id]))))
+
+	if(args.outage is not None):	#e.g. router reboot
+		(at, length) = (float(value) for value in args.outage.split(":"))
+		runtime.outage(at, length)
+
+	start = time.perf_counter()
+	runtime.run(duration)
+	runtime.stop()
+	elapsed = time.perf_counter() - start
+
+	stats = runtime.stats
+	print("%d devices, %.1f h simulated in %.2f s (x%.0f), options '%s'" % (args.devices, args.hours, elapsed, duration / elapsed, args.options))
+	for name in ("onHeartbeat", "onConnect", "onMessage", "onCommand", "onDisconnect", "Device.Update", "Connection.Connect", "Domoticz.Error"):
+		print("  %-20s %10d  (%8.1f per device-hour)" % (name, stats[name], stats[name] / args.devices / args.hours))
+	print("  %-20s %10d  (%8.1f per device-hour)" % ("bytes sent", stats["bytes sent"], stats["bytes sent"] / args.devices / args.hours))
+	print("  %-20s %10d  (%8.1f per device-hour)" % ("bytes received", stats["bytes received"], stats["bytes received"] / args.devices / args.hours))
+	print("  %-20s %10d" % ("device requests", sum(device.requests for (host, port, device) in simulated)))
+	print("  %-20s %10d" % ("lost answers", sum(device.losses for (host, port, device) in simulated)))
+	print("  %-20s %10d" % ("version errors", sum(device.version_errors for (host, port, device) in simulated)))
+
+	#button press -> Domoticz device updated
+	delays = []
+	for (at, unit, state) in presses:
+		delay = next((when - at for (when, Unit, nValue, TimedOut) in runtime.updates if when >= at and Unit == unit and nValue == state), None)
+		if(delay is not None):
+			delays.append(delay)
+	delays.sort()
+	if(len(delays) != 0):
+		print("  %-20s p50 %.2f s, p95 %.2f s, max %.2f s (%d/%d presses seen)" % ("press latency", delays[len(delays) // 2],
+			  delays[min(len(delays) - 1, int(len(delays) * 0.95))], delays[-1], len(delays), len(presses)))
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Replay plug activity through plugin.py on a virtual clock")
+	parser.add_argument("--devices",   type=int,   default=10)
+	parser.add_argument("--dps",                   default="1",  help="dps ids of each device separated by ','")
+	parser.add_argument("--hours",     type=float, default=24.0, help="simulated duration")
+	parser.add_argument("--commands",  type=float, default=20.0, help="commands per hour (all devices)")
+	parser.add_argument("--presses",   type=float, default=5.0,  help="button presses per hour (all devices)")
+	parser.add_argument("--options",               default="",   help="Options parameter of the plugin (e.g. 'poll_max=20')")
+	parser.add_argument("--version",   type=float, default=3.1,  choices=(3.1, 3.3))
+	parser.add_argument("--latency",   type=float, default=0.05, help="answer latency of the devices (seconds)")
+	parser.add_argument("--fragment",  type=int,   default=0,    help="fragment size of the answers (bytes)")
+	parser.add_argument("--drop-rate", type=float, default=0.0,  help="probability of a connection drop per request")
+	parser.add_argument("--reply-dps", action="store_true",      help="set answers hold the new dps")
+	parser.add_argument("--push",      action="store_true",      help="devices push the new state after a set")
+	parser.add_argument("--idle",      type=float, default=0.0,  help="devices close the connections idle for IDLE seconds (0: never)")
+	parser.add_argument("--loss-rate", type=float, default=0.0,  help="probability of a lost answer per request")
+	parser.add_argument("--meter",     action="store_true",      help="metering devices (dps 18, 19 and 20, plugin option energy)")
+	parser.add_argument("--mixed",     action="store_true",      help="every other device uses the other protocol version")
+	parser.add_argument("--negotiate", action="store_true",      help="inventory without the protocol versions (negotiated by the plugin)")
+	parser.add_argument("--unreachable", type=int, default=0,    help="inventory entries without device (multi device mode)")
+	parser.add_argument("--outage",                default=None, help="START:DURATION (seconds): all the devices are unreachable (e.g. router reboot)")
+	parser.add_argument("--home",                  default=None, help="plugin folder (snapshot, version cache...), default: a new temporary folder")
+	parser.add_argument("--seed",      type=int,   default=1)
+	parser.add_argument("--verbose",   action="store_true",      help="print the Domoticz log")
+	main(parser.parse_args())
@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# replay of a capture file of the plugin (option capture=<file>) through tuya_protocol.FrameDecoder
+#	the file is memory mapped, the inbound data of each device is fed to its own decoder
+#	reports the decoding throughput, the frames per command and the decoding failures per device
+
+import os
+import sys
+import json
+import time
+import argparse
+import collections
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tuya_protocol
+import tuya_capture
+
+#commands which answer holds dps: no dps means a decoding failure
+DPS_COMMANDS = (tuya_protocol.DP_QUERY, tuya_protocol.STATUS)
+
+#######################################################################
+#
+# read_keys: devId -> localKey (inventory of the plugin or of get_dps.py discover, tuya-cli wizard, plain dict)
+#
+#######################################################################
+def read_keys(filename):
+	if(filename is None):
+		return {}
+	with open(filename) as f:
+		keys = json.load(f)
+	if(isinstance(keys, dict)):
+		return keys
+	result = {}
+	for device in keys:
+		if("devId" in device):
+			result[device["devId"]] = device.get("localKey", "")
+		elif("id" in device):
+			result[device["id"]] = device.get("key", "")
+	return result
+
+#######################################################################
+#
+# Channel: decoder and counters of a device
+#
+#######################################################################
+class Channel:
+
+	def __init__(self, info, key):
+		self.info     = info
+		cipher        = tuya_protocol.AESCipher(key.encode('latin1')) if key else None
+		self.decoder  = tuya_protocol.FrameDecoder(cipher)
+		self.commands = collections.Counter()
+		self.frames   = 0
+		self.bytes    = 0
+		self.failures = 0
+
+	def feed(self, data, dump):
+		self.bytes += len(data)
+		for frame in self.decoder.feed(data):
+			self.frames += 1
+			self.commands[frame.cmd] += 1
+			if(frame.dps is None and frame.cmd in DPS_COMMANDS):
+				self.failures += 1
+			if(dump):
+				print("%-22s cmd=%-2d seq=%-5d retcode=%s dps=%s" % (self.info.get("devId", "?"), frame.cmd, frame.seq, frame.retcode, json.dumps(frame.dps)))
+
+#######################################################################
+#
+# replay: one pass on the capture file, returns (channels, elapsed time, time span of the capture)
+#
+#######################################################################
+def replay(args, keys):
+	channels = {}		#channel -> Channel (the channels are numbered again at each start of the plugin)
+	sessions = []
+	kinds    = (tuya_capture.OUT,) if args.outbound else (tuya_capture.IN,)
+	first    = None
+	last     = None
+	start    = time.perf_counter()
+	for (now, kind, channel, data) in tuya_capture.read_records(args.capture):
+		if(first is None):
+			first = now
+		last = now
+		if(kind == tuya_capture.OPEN):
+			info = json.loads(bytes(data).decode('utf-8'))
+			channels[channel] = Channel(info, args.key or keys.get(info.get("devId"), ""))
+			sessions.append(channels[channel])
+		elif(kind in kinds and channel in channels):
+			channels[channel].feed(data, args.dump)
+	elapsed = time.perf_counter() - start
+	return (sessions, elapsed, (last - first) if first is not None else 0)
+
+def main(args):
+	keys = read_keys(args.inventory)
+
+	tuya_protocol.load_backend()
+	elapsed = 0
+	for i in range(args.repeat):
+		(channels, duration, span) = replay(args, keys)
+		elapsed += duration
+		args.dump = False
+
+	frames   = sum(channel.frames for channel in channels)
+	size     = sum(channel.bytes for channel in channels)
+	print(args.capture + ": " + str(len(channels)) + " device sessions over " + str(round(span, 1)) + " s of traffic (" + ("outbound" if args.outbound else "inbound") + ")")
+	print("%-22s %-15s %8s %10s %8s %6s %8s  %s" % ("devId", "ip", "frames", "bytes", "failures", "crc", "skipped", "per command"))
+	for channel in channels:
+		print("%-22s %-15s %8d %10d %8d %6d %8d  %s" % (channel.info.get("devId", "?"), channel.info.get("ip", "?"), channel.frames, channel.bytes, channel.failures,
+													 channel.decoder.crc_errors, channel.decoder.skipped,
+													 " ".join(str(cmd) + ":" + str(count) for (cmd, count) in sorted(channel.commands.items()))))
+	print("")
+	print("decoding failures: " + str(sum(channel.failures for channel in channels)) + ", crc errors: " + str(sum(channel.decoder.crc_errors for channel in channels)))
+	if(elapsed > 0):
+		print("throughput: " + str(int(frames * args.repeat / elapsed)) + " frames/s, " + str(round(size * args.repeat / elapsed / 1e6, 2)) + " MB/s (" + str(args.repeat) + " passes, " + str(round(elapsed, 3)) + " s)")
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="replay of a capture file of the plugin")
+	parser.add_argument("capture", help="capture file (option capture=<file> of the plugin)")
+	parser.add_argument("--inventory", help="json file with the local keys (inventory of the plugin, get_dps.py discover output or devId -> localKey)")
+	parser.add_argument("--key", help="local key used for all the devices")
+	parser.add_argument("--repeat", type=int, default=1, help="number of passes on the file (throughput measure)")
+	parser.add_argument("--outbound", action="store_true", help="decode the frames sent by the plugin instead of the received ones")
+	parser.add_argument("--dump", action="store_true", help="print the decoded frames (first pass)")
+	main(parser.parse_args())
@@ -0,0 +1,370 @@
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# stand-in of the Domoticz python plugin module, driven by a deterministic event loop on a virtual clock
+#	sys.modules['Domoticz'] = fake_domoticz before loading plugin.py (see Runtime.load_plugin)
+#	the Tuya devices are tuya_simulator.SimulatedDevice objects reached without network:
+#	Connection.Send feeds the device and its answers are delivered by onMessage after the device latency
+#
+# Runtime counts the callbacks, the Devices[...].Update calls and the bytes exchanged
+
+import os
+import sys
+import heapq
+import importlib.util
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+runtime = None		#current Runtime (one at a time)
+
+########################################################################################
+#
+# Domoticz API (subset used by the plugin)
+#
+########################################################################################
+def Debugging(mask):
+	runtime.debug = (int(mask) != 0)
+
+def Debug(message):
+	runtime.log("Debug", message)
+
+def Log(message):
+	runtime.log("Log", message)
+
+def Status(message):
+	runtime.log("Status", message)
+
+def Error(message):
+	runtime.log("Error", message)
+
+def Heartbeat(seconds):
+	runtime.heartbeat = seconds
+
+########################################################################################
+#
+# Device
+#
+########################################################################################
+class Device:
+
+	def __init__(self, Name, Unit, TypeName="Switch", Options=None, Type=0, Subtype=0, Switchtype=0, Image=0, Used=0):
+		self.Name     = Name
+		self.Unit     = Unit
+		self.TypeName = TypeName
+		self.Options  = Options or {}
+		self.nValue   = 0
+		self.sValue   = ""
+		self.TimedOut = 0
+		self.LastUpdate = 0.0
+		return
+
+	def Create(self):
+		runtime.devices[self.Unit] = self
+		runtime.stats["Device.Create"] += 1
+
+	def Update(self, nValue, sValue, TimedOut=0, **kwargs):
+		self.nValue     = nValue
+		self.sValue     = sValue
+		self.TimedOut   = TimedOut
+		self.LastUpdate = runtime.now
+		runtime.stats["Device.Update"] += 1
+		runtime.updates.append((runtime.now, self.Unit, nValue, TimedOut))
+
+	def Delete(self):
+		del runtime.devices[self.Unit]
+
+########################################################################################
+#
+# Connection (TCP/IP only)
+#
+########################################################################################
+class Connection:
+
+	def __init__(self, Name, Transport, Address, Port, Protocol="None"):
+		self.Name         = Name
+		self.Transport    = Transport
+		self.Address      = Address
+		self.Port         = Port
+		self.__device     = None		#SimulatedDevice while connected
+		self.__decoder    = None		#device side decoder
+		self.__connecting = False
+		return
+
+	def Connected(self):
+		return self.__device is not None
+
+	def Connecting(self):
+		return self.__connecting
+
+	def Connect(self):
+		self.__connecting = True
+		runtime.stats["Connection.Connect"] += 1
+		runtime.schedule(runtime.connect_delay, self.__connected)
+
+	def __connected(self):
+		self.__connecting = False
+		device = runtime.simulated.get(self.Address)
+		if(device is None or self.Address in runtime.unreachable):
+			runtime.call("onConnect", self, 113, "No route to host")
+			return
+		if(device in runtime.busy):
+			runtime.call("onConnect", self, 111, "Connection refused")
+			return
+		runtime.busy.add(device)
+		self.__device  = device
+		self.__decoder = device.decoder()
+		self.__last    = runtime.now
+		runtime.call("onConnect", self, 0, "")
+		if(device.idle > 0):
+			runtime.schedule(device.idle, self.__idle, device)
+
+	def __idle(self, device):	#the device closes the connections idle for too long
+		if(self.__device is not device):
+			return
+		if(runtime.now - self.__last >= device.idle):
+			self.Disconnect()
+		else:
+			runtime.schedule(max(0.001, self.__last + device.idle - runtime.now), self.__idle, device)
+
+	def Disconnect(self):
+		if(self.__device is None):
+			return
+		runtime.busy.discard(self.__device)
+		self.__device = None
+		runtime.schedule(0, runtime.call, "onDisconnect", self)
+
+	def Send(self, Message, Delay=0):
+		runtime.stats["bytes sent"] += len(Message)
+		if(self.__device is None):
+			return
+		device = self.__device
+		self.__last = runtime.now
+		version = device.request_version(Message)
+		for frame in self.__decoder.feed(Message):
+			device.requests += 1
+			if(device.drop()):
+				self.Disconnect()
+				return
+			for answer in device.answers(frame, version):
+				self.deliver(answer, device.latency + Delay)
+
+	#######################################################################
+	#
+	# deliver function (not in the Domoticz API)
+	#		data sent by the device: onMessage after delay (one call per fragment)
+	#
+	#######################################################################
+	def deliver(self, data, delay=0):
+		size = runtime.fragment_of(self.__device, len(data))
+		for i in range(0, len(data), size):
+			runtime.schedule(delay, self.__receive, self.__device, data[i:i + size])
+
+	def __receive(self, device, data):
+		if(self.__device is not device):	#connection closed in between
+			return
+		runtime.stats["bytes received"] += len(data)
+		runtime.call("onMessage", self, data)
+
+########################################################################################
+#
+# Runtime: virtual clock, event loop and statistics
+#
+########################################################################################
+class Runtime:
+
+	#######################################################################
+	#
+	# constructor
+	#
+	# Parameters
+	#	parameters: dict of the hardware parameters (Address, Mode1...)
+	#	simulated:  dict address -> tuya_simulator.SimulatedDevice
+	#
+	#######################################################################
+	def __init__(self, parameters, simulated, connect_delay=0.05, verbose=False):
+		global runtime
+		runtime             = self
+		self.parameters     = dict(parameters)
+		self.simulated      = simulated
+		self.connect_delay  = connect_delay
+		self.verbose        = verbose
+		self.devices        = {}			#Devices
+		self.busy           = set()			#simulated devices with an open connection
+		self.unreachable    = set()			#addresses of the simulated devices during an outage
+		self.connections    = {}			#last Connection by address (for pushes)
+		self.heartbeat      = 10			#seconds
+		self.debug          = False
+		self.now            = 0.0
+		self.stats          = Counter()
+		self.updates        = []			#(time, Unit, nValue, TimedOut) of the Device.Update calls
+		self.plugin         = None
+		self.__events       = []
+		self.__count        = 0
+		return
+
+	def log(self, level, message):
+		self.stats["Domoticz." + level] += 1
+		if(self.verbose and (level != "Debug" or self.debug)):
+			print("%10.3f %-6s %s" % (self.now, level, message))
+
+	def fragment_of(self, device, size):
+		if(device is None or device.fragment <= 0):
+			return max(1, size)
+		return device.fragment
+
+	#######################################################################
+	#
+	# schedule function
+	#		call function(*args) at now + delay (virtual time)
+	#
+	#######################################################################
+	def schedule(self, delay, function, *args):
+		self.__count += 1
+		heapq.heappush(self.__events, (self.now + delay, self.__count, function, args))
+
+	#######################################################################
+	#
+	# call function
+	#		call the plugin callback name
+	#
+	#######################################################################
+	def call(self, name, *args):
+		self.stats[name] += 1
+		if(name == "onConnect" and args[1] == 0):
+			self.connections[args[0].Address] = args[0]
+		getattr(self.plugin, name)(*args)
+
+	#######################################################################
+	#
+	# load_plugin function
+	#		load a fresh copy of plugin.py using this runtime
+	#
+	#######################################################################
+	def load_plugin(self, path=None):
+		if(path is None):
+			path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'plugin.py')
+		sys.modules['Domoticz'] = sys.modules[__name__]
+		spec        = importlib.util.spec_from_file_location("plugin_under_test_" + str(id(self)), path)
+		self.plugin = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(self.plugin)
+		self.plugin.Parameters = self.parameters
+		self.plugin.Devices    = self.devices
+		self.plugin.time       = VirtualTime(self)
+		return self.plugin
+
+	#######################################################################
+	#
+	# command function
+	#		onCommand(Unit, Command, Level) at now + delay
+	#
+	#######################################################################
+	def command(self, delay, Unit, Command, Level=0):
+		self.schedule(delay, self.call, "onCommand", Unit, Command, Level, "")
+
+	#######################################################################
+	#
+	# press function
+	#		button press on the simulated device at address (dps_id toggled and pushed)
+	#
+	#######################################################################
+	def press(self, delay, address, dps_id):
+		self.schedule(delay, self.__press, address, dps_id)
+
+	def __press(self, address, dps_id):
+		device = self.simulated[address]
+		frame  = device.toggle(dps_id)
+		connection = self.connections.get(address)
+		if(connection is not None and connection.Connected()):
+			connection.deliver(frame)
+
+	#######################################################################
+	#
+	# outage function
+	#		the devices at addresses (all by default) are unreachable from delay to delay + duration
+	#		(e.g. router reboot: the connections are closed)
+	#
+	#######################################################################
+	def outage(self, delay, duration, addresses=None):
+		self.schedule(delay, self.__outage_start, list(self.simulated) if addresses is None else list(addresses))
+		self.schedule(delay + duration, self.__outage_end, list(self.simulated) if addresses is None else list(addresses))
+
+	def __outage_start(self, addresses):
+		self.unreachable.update(addresses)
+		for address in addresses:
+			connection = self.connections.get(address)
+			if(connection is not None):
+				connection.Disconnect()
+
+	def __outage_end(self, addresses):
+		self.unreachable.difference_update(addresses)
+
+	#######################################################################
+	#
+	# run function
+	#		onStart (first call only), then the events and the heartbeats for duration seconds
+	#
+	#######################################################################
+	def run(self, duration):
+		if(self.plugin is None):
+			self.load_plugin()
+		if(self.stats["onStart"] == 0):
+			self.call("onStart")
+			self.schedule(self.heartbeat, self.__heartbeat)
+		end = self.now + duration
+		while(len(self.__events) != 0 and self.__events[0][0] <= end):
+			(when, count, function, args) = heapq.heappop(self.__events)
+			self.now = when
+			function(*args)
+		self.now = end
+
+	def __heartbeat(self):
+		self.call("onHeartbeat")
+		self.schedule(self.heartbeat, self.__heartbeat)
+
+	def stop(self):
+		self.call("onStop")
+
+########################################################################################
+#
+# VirtualTime: replaces the time module of the plugin
+#
+########################################################################################
+class VirtualTime:
+
+	def __init__(self, runtime):
+		self.__runtime = runtime
+
+	def time(self):
+		return self.__runtime.now
+
+	def perf_counter(self):
+		return self.__runtime.now
+
+	def monotonic(self):
+		return self.__runtime.now
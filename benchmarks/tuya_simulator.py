@@ -0,0 +1,376 @@
+#!/usr/bin/python3
+
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# local Tuya device simulator (asyncio, Python 3.7+)
+#	speaks the 3.1/3.3 framing and encryption of pytuya.OutletDevice
+#	configurable dps, answer latency, fragmentation of the answers and connection drops
+#	like a real device, only one connection is accepted at a time
+#
+# usage: tuya_simulator.py [options]  (prints the inventory of the simulated devices, see --help)
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tuya_protocol
+
+PORT  = 6668
+METER = ("18", "19", "20")		#dps of the current (mA), power (dW) and voltage (dV) of the metering devices
+
+########################################################################################
+#
+# SimulatedDevice
+#
+########################################################################################
+class SimulatedDevice:
+
+	#######################################################################
+	#
+	# constructor
+	#
+	# Parameters
+	#	dev_id, local_key (str), version (3.1 or 3.3)
+	#	dps:       initial dps (dict dps id (str) -> value)
+	#	latency:   delay before each answer (seconds)
+	#	fragment:  answers are sent in chunks of fragment bytes (0: in one write)
+	#	drop_rate: probability to close the connection instead of answering
+	#	reply_dps: True if the set answers hold the new dps
+	#	push:      True if a command 8 push follows each set answer
+	#	idle:      the connection is closed after idle seconds without request (0: never)
+	#	loss_rate: probability to ignore a request (lost answer, the connection stays open)
+	#	meter:     True if the device reports its current (mA), power (dW) and voltage (dV) in the dps METER
+	#
+	#######################################################################
+	def __init__(self, dev_id, local_key, version=3.1, dps=None, latency=0.0, fragment=0, drop_rate=0.0, reply_dps=False, push=False, seed=None, idle=0.0, loss_rate=0.0, meter=False):
+		self.dev_id     = dev_id
+		self.local_key  = local_key
+		self.version    = version
+		self.dps        = dict(dps) if dps else {"1": False}
+		self.latency    = latency
+		self.fragment   = fragment
+		self.drop_rate  = drop_rate
+		self.reply_dps  = reply_dps
+		self.push       = push
+		self.idle       = idle
+		self.loss_rate  = loss_rate
+		self.meter      = meter
+		self.losses     = 0			#number of requests ignored
+		self.requests   = 0			#number of requests received
+		self.drops      = 0			#number of connections dropped
+		self.rejected   = 0			#number of connections refused (already connected)
+		self.version_errors = 0		#number of requests of the other protocol version (answered by an error)
+		self.__key      = local_key.encode('latin1')
+		self.__cipher   = tuya_protocol.AESCipher(self.__key)
+		self.__random   = random.Random(seed)
+		self.__writer   = None		#current connection
+		self.__measure()
+		return
+
+	#######################################################################
+	#
+	# __measure: metering dps (about 100 W per socket on, noisy voltage)
+	#
+	#######################################################################
+	def __measure(self):
+		if(not self.meter):
+			return
+		voltage = int(self.__random.gauss(2300, 15))
+		power   = sum(int(self.__random.gauss(1000, 50)) for (key, value) in self.dps.items() if value is True)
+		self.dps.update(zip(METER, (int(power * 1000 / voltage) if voltage > 0 else 0, power, voltage)))
+
+	#######################################################################
+	#
+	# __crypted_payload: json encrypted like a set/push payload
+	#
+	#######################################################################
+	def __crypted_payload(self, dps):
+		plain = json.dumps({"devId": self.dev_id, "dps": dps, "t": int(time.time())}, separators=(',', ':')).encode()
+		return tuya_protocol.wrap_crypted(self.__cipher.encrypt(plain, False), self.__key, self.version)
+
+	#######################################################################
+	#
+	# __status_payload
+	#
+	#######################################################################
+	def __status_payload(self):
+		self.__measure()
+		plain = json.dumps({"devId": self.dev_id, "dps": self.dps}, separators=(',', ':')).encode()
+		if(self.version == 3.3):
+			return self.__cipher.encrypt(plain, False)
+		return plain
+
+	#######################################################################
+	#
+	# decoder function
+	#		returns a decoder for the frames received by the device
+	#
+	#######################################################################
+	def decoder(self):
+		return tuya_protocol.FrameDecoder(self.__cipher)
+
+	#######################################################################
+	#
+	# drop function
+	#		returns True if the connection has to be dropped instead of answering
+	#
+	#######################################################################
+	def drop(self):
+		if(self.__random.random() < self.drop_rate):
+			self.drops += 1
+			return True
+		return False
+
+	#######################################################################
+	#
+	# request_version function
+	#		returns the protocol version of the request in data (None: unknown, e.g. several frames)
+	#
+	#######################################################################
+	@staticmethod
+	def request_version(data):
+		frame = tuya_protocol.split_frame(bytes(data))
+		return None if frame is None else tuya_protocol.payload_version(frame[3])
+
+	#######################################################################
+	#
+	# answers function
+	#		returns the frames answering frame (without transport: fake Domoticz runtime)
+	#		version: protocol version of the request (see request_version, None: not checked)
+	#
+	#######################################################################
+	def answers(self, frame, version=None):
+
+		if(self.loss_rate > 0 and self.__random.random() < self.loss_rate):
+			self.losses += 1
+			return []
+
+		if(version is not None and version != self.version and frame.cmd in (tuya_protocol.DP_QUERY, tuya_protocol.CONTROL)):
+			self.version_errors += 1	#like the real devices: the request of the other version is not understood
+			return [tuya_protocol.encode_frame(frame.cmd, b'data format error', frame.seq, 1)]
+
+		if(frame.cmd == tuya_protocol.DP_QUERY):
+			return [tuya_protocol.encode_frame(tuya_protocol.DP_QUERY, self.__status_payload(), frame.seq, 0)]
+
+		if(frame.cmd == tuya_protocol.HEART_BEAT):
+			return [tuya_protocol.encode_frame(tuya_protocol.HEART_BEAT, b'', frame.seq, 0)]
+
+		if(frame.cmd == tuya_protocol.CONTROL and frame.dps is not None):
+			changed = {}
+			for (key, value) in frame.dps.items():
+				if(key in self.dps):
+					self.dps[key] = value
+					changed[key]  = value
+			result = [tuya_protocol.encode_frame(tuya_protocol.CONTROL, self.__crypted_payload(changed) if self.reply_dps else b'', frame.seq, 0)]
+			if(self.push):
+				result.append(tuya_protocol.encode_frame(tuya_protocol.STATUS, self.__crypted_payload(changed), 0, 0))
+			return result
+
+		return []
+
+	#######################################################################
+	#
+	# __send: write data (in fragments if needed)
+	#
+	#######################################################################
+	async def __send(self, writer, data):
+		if(self.fragment <= 0):
+			writer.write(data)
+			await writer.drain()
+			return
+		for i in range(0, len(data), self.fragment):
+			writer.write(data[i:i + self.fragment])
+			await writer.drain()
+			await asyncio.sleep(0.001)
+
+	#######################################################################
+	#
+	# toggle function
+	#		toggle dps_id (button press) and returns the push frame of the new state
+	#
+	#######################################################################
+	def toggle(self, dps_id):
+		self.dps[dps_id] = not self.dps[dps_id]
+		return tuya_protocol.encode_frame(tuya_protocol.STATUS, self.__crypted_payload({dps_id: self.dps[dps_id]}), 0, 0)
+
+	#######################################################################
+	#
+	# press function
+	#		simulate a button press on the device: toggle dps_id and push the new state
+	#
+	#######################################################################
+	async def press(self, dps_id):
+		frame = self.toggle(dps_id)
+		if(self.__writer is not None):
+			await self.__send(self.__writer, frame)
+
+	#######################################################################
+	#
+	# handle function (asyncio.start_server callback)
+	#
+	#######################################################################
+	async def handle(self, reader, writer):
+
+		if(self.__writer is not None):
+			self.rejected += 1
+			writer.close()
+			return
+
+		self.__writer = writer
+		decoder = self.decoder()
+		try:
+			while(True):
+				if(self.idle > 0):
+					data = await asyncio.wait_for(reader.read(4096), self.idle)
+				else:
+					data = await reader.read(4096)
+				if(len(data) == 0):
+					break
+				version = self.request_version(data)
+				for frame in decoder.feed(data):
+					self.requests += 1
+					if(self.drop()):
+						return
+					if(self.latency > 0):
+						await asyncio.sleep(self.latency)
+					for answer in self.answers(frame, version):
+						await self.__send(writer, answer)
+		except (ConnectionError, OSError, asyncio.CancelledError, asyncio.TimeoutError) as e:
+			pass
+		finally:
+			self.__writer = None
+			writer.close()
+
+	#######################################################################
+	#
+	# broadcast function
+	#		send the discovery broadcast of the device every period seconds
+	#		(port 6666 in clear text for 3.1, port 6667 encrypted with the UDP key for 3.3)
+	#
+	#######################################################################
+	async def broadcast(self, ip, target="255.255.255.255", period=5.0):
+		plain = json.dumps({"ip": ip, "gwId": self.dev_id, "active": 2, "ability": 0, "mode": 0, "encrypt": True,
+							"productKey": "simulated", "version": str(self.version)}).encode()
+		if(self.version == 3.3):
+			frame = tuya_protocol.encode_frame(tuya_protocol.UDP_NEW, tuya_protocol.AESCipher(tuya_protocol.UDP_KEY).encrypt(plain, False), 0, 0)
+			port  = tuya_protocol.UDP_PORTS[1]
+		else:
+			frame = tuya_protocol.encode_frame(tuya_protocol.UDP, plain, 0, 0)
+			port  = tuya_protocol.UDP_PORTS[0]
+		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+		try:
+			while(True):
+				sock.sendto(frame, (target, port))
+				await asyncio.sleep(period)
+		finally:
+			sock.close()
+
+	#######################################################################
+	#
+	# start function
+	#		returns the asyncio server
+	#
+	#######################################################################
+	async def start(self, host, port=PORT):
+		return await asyncio.start_server(self.handle, host, port)
+
+#######################################################################
+#
+# create_devices
+#		returns a list of (host, port, SimulatedDevice)
+#		port_step False: devices on 127.0.0.1, 127.0.0.2... (port unchanged, Linux only)
+#		port_step True:  devices on host, port, port + 1...
+#
+#######################################################################
+def create_devices(count, host="127.0.0.1", port=PORT, port_step=False, dps_ids=("1",), **kwargs):
+	result = []
+	base   = [int(val) for val in host.split(".")]
+	for i in range(count):
+		dev_id    = "sim%017d" % i
+		local_key = ("simkey%010d" % i)[:16]
+		device    = SimulatedDevice(dev_id, local_key, dps=dict((dps_id, False) for dps_id in dps_ids), seed=i, **kwargs)
+		if(port_step):
+			result.append((host, port + i, device))
+		else:
+			result.append((".".join(str(val) for val in base[:3] + [base[3] + i]), port, device))
+	return result
+
+#######################################################################
+#
+# inventory
+#		returns the inventory (plugin multi device mode) of devices
+#
+#######################################################################
+def inventory(devices):
+	return [{"name": "Sim " + str(i), "ip": host, "port": port, "devId": device.dev_id, "localKey": device.local_key,
+			 "version": device.version, "dps": ";".join(sorted((key for key in device.dps if key not in METER), key=int)),
+			 "energy": ";".join(METER) if device.meter else "None"}
+			for (i, (host, port, device)) in enumerate(devices)]
+
+async def main(args):
+	devices = create_devices(args.devices, args.host, args.port, args.port_step, args.dps.split(","),
+							 version=args.version, latency=args.latency, fragment=args.fragment,
+							 drop_rate=args.drop_rate, reply_dps=args.reply_dps, push=args.push, idle=args.idle, loss_rate=args.loss_rate, meter=args.meter)
+	servers = [await device.start(host, port) for (host, port, device) in devices]
+	print(json.dumps(inventory(devices), indent=1))
+	sys.stdout.flush()
+	tasks = [server.serve_forever() for server in servers]
+	if(args.broadcast is not None):
+		tasks += [device.broadcast(host, args.broadcast) for (host, port, device) in devices]
+	await asyncio.gather(*tasks)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Local Tuya device simulator")
+	parser.add_argument("--devices",   type=int,   default=1,           help="number of devices")
+	parser.add_argument("--host",                  default="127.0.0.1", help="address of the first device")
+	parser.add_argument("--port",      type=int,   default=PORT,        help="port of the first device")
+	parser.add_argument("--port-step", action="store_true",             help="one port per device instead of one address per device")
+	parser.add_argument("--dps",                   default="1",         help="dps ids separated by ',' (default 1)")
+	parser.add_argument("--version",   type=float, default=3.1,         choices=(3.1, 3.3))
+	parser.add_argument("--latency",   type=float, default=0.0,         help="answer latency (seconds)")
+	parser.add_argument("--fragment",  type=int,   default=0,           help="fragment size of the answers (bytes)")
+	parser.add_argument("--drop-rate", type=float, default=0.0,         help="probability to drop the connection instead of answering")
+	parser.add_argument("--reply-dps", action="store_true",             help="set answers hold the new dps")
+	parser.add_argument("--push",      action="store_true",             help="send a command 8 push after each set")
+	parser.add_argument("--idle",      type=float, default=0.0,         help="close the connections idle for IDLE seconds (0: never)")
+	parser.add_argument("--loss-rate", type=float, default=0.0,         help="probability to ignore a request (lost answer)")
+	parser.add_argument("--meter",     action="store_true",             help="metering devices (current, power and voltage in the dps 18, 19 and 20)")
+	parser.add_argument("--broadcast", metavar="ADDRESS",               help="send the discovery broadcasts to ADDRESS (e.g. 255.255.255.255)")
+	try:
+		asyncio.run(main(parser.parse_args()))
+	except KeyboardInterrupt:
+		pass
@@ -27,18 +27,313 @@
 #                                                                                      #
 ########################################################################################
 
+import os
 import sys
-import pytuya
+import json
+import math
+import time
 import socket #needed for socket.timeout exception
+import asyncio
+import argparse
+import statistics
 
+import tuya_async
+import tuya_protocol
+
+#######################################################################
+#
+# boolean_dps
+#		returns the list of the boolean dps separated by ';'
+#
+#######################################################################
+def boolean_dps(dps):
+	return ";".join(str(key) for key in sorted((int(key) for key in dps if type(dps[key]) is bool)))
+
+#######################################################################
+#
+# energy_dps
+#		returns the metering dps (current;power;voltage, value of the energy option) or None
+#
+#######################################################################
+METER_DPS = ("18", "19", "20")	#current (mA), power (dW) and voltage (dV) of the common metering plugs
+
+def energy_dps(dps):
+	if(all(type(dps.get(key)) is int for key in METER_DPS)):
+		return ";".join(METER_DPS)
+	return "None"
+
+#######################################################################
+#
+# discovery mode (Python 3.7+)
+#	listen to the Tuya broadcasts (UDP 6666: 3.1, UDP 6667: 3.3)
+#	and probe the status of each new device concurrently
+#
+#######################################################################
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+
+	def __init__(self, cipher, found):
+		self.__cipher = cipher		#None for the clear text broadcasts
+		self.__found  = found		#callback(info, address)
+
+	def datagram_received(self, data, address):
+		frame = tuya_protocol.split_frame(data)
+		if(frame is None):
+			return
+		info = tuya_protocol.decode_json(frame[3], self.__cipher)
+		if(info is not None and "gwId" in info):
+			self.__found(info, address[0])
+
+def read_keys(filename):
+	if(filename is None):
+		return {}
+	with open(filename) as f:
+		keys = json.load(f)
+	if(isinstance(keys, list)): #tuya-cli wizard format: [{"name": ..., "id": ..., "key": ...}]
+		return dict((device["id"], device["key"]) for device in keys)
+	return keys
+
+async def probe(info, address, keys, semaphore, timeout):
+	dev_id  = info["gwId"]
+	result  = {"ip": info.get("ip", address), "devId": dev_id, "localKey": keys.get(dev_id, ""), "version": info.get("version", "3.1"),
+			   "productKey": info.get("productKey", ""), "dps": None}
+	try:
+		version = float(result["version"])
+	except (TypeError, ValueError):
+		version = None
+	if(version not in tuya_protocol.VERSIONS):	#e.g. 3.4: other framing and session key
+		result["error"] = "unsupported protocol version " + str(result["version"]) + " (supported: " + ", ".join(str(supported) for supported in tuya_protocol.VERSIONS) + ")"
+		return result
+	result["version"] = version
+	if(version == 3.3 and result["localKey"] == ""):
+		result["error"] = "local key needed (protocol 3.3)"
+		return result
+	async with semaphore:
+		connection = tuya_async.TuyaConnection(result["ip"], dev_id, result["localKey"], version, timeout=timeout)
+		try:
+			status           = await connection.status()
+			result["dps"]    = boolean_dps(status)
+			result["energy"] = energy_dps(status)
+		except (OSError, asyncio.TimeoutError, ValueError) as e:
+			result["error"] = type(e).__name__ + " " + str(e)
+		finally:
+			await connection.close()
+	return result
+
+async def discover(args):
+	loop      = asyncio.get_running_loop()
+	keys      = read_keys(args.keys)
+	semaphore = asyncio.Semaphore(args.concurrency)
+	probes    = {}
+
+	def found(info, address):
+		if(info["gwId"] not in probes):
+			probes[info["gwId"]] = loop.create_task(probe(info, address, keys, semaphore, args.timeout))
+
+	transports = []
+	for (port, cipher) in zip(tuya_protocol.UDP_PORTS, (None, tuya_protocol.AESCipher(tuya_protocol.UDP_KEY))):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		if(hasattr(socket, "SO_REUSEPORT")):
+			sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+		sock.bind(("", port))
+		(transport, protocol) = await loop.create_datagram_endpoint(lambda: DiscoveryProtocol(cipher, found), sock=sock)
+		transports.append(transport)
+
+	await asyncio.sleep(args.listen)
+	for transport in transports:
+		transport.close()
+
+	results = await asyncio.gather(*probes.values())
+	return sorted(results, key=lambda result: socket.inet_aton(result["ip"]))
+
+def discover_main(argv):
+	parser = argparse.ArgumentParser(prog=sys.argv[0] + " discover", description="Discover the Tuya devices of the LAN and print their inventory")
+	parser.add_argument("--listen",      type=float, default=12.0, help="listening time of the broadcasts (seconds, default 12)")
+	parser.add_argument("--concurrency", type=int,   default=32,   help="max number of simultaneous probes (default 32)")
+	parser.add_argument("--timeout",     type=float, default=5.0,  help="timeout of a probe (seconds, default 5)")
+	parser.add_argument("--keys",                                  help="json file of the local keys (devId -> localKey, or tuya-cli wizard output)")
+	args = parser.parse_args(argv)
+	results = asyncio.run(discover(args))
+	#the devices without dps (probe failed, no key or no socket) are left out of the inventory
+	for result in results:
+		if(not result["dps"]):
+			print("skipped " + result["devId"] + " (" + result["ip"] + "): " + result.get("error", "no boolean dps"), file=sys.stderr)
+	print(json.dumps([result for result in results if result["dps"]], indent=1))
+
+
+#######################################################################
+#
+# profiling mode (Python 3.7+)
+#	sample the status of a device, classify its dps and recommend
+#	the dps, groups and polling options of the plugin
+#
+#######################################################################
+FLAG_RATE = 30.0	#boolean dps changing more often (per hour, without command) are flags, not relays
+POLL_CAP  = 300		#max recommended poll_max (seconds)
+
+async def sample(args):
+	versions   = tuya_protocol.VersionCache(args.versions) if args.versions != "" else None
+	version    = args.version or (versions.get(args.devId) if versions is not None else None)
+	connection = tuya_async.TuyaConnection(args.ip, args.devId, args.key, version or tuya_protocol.VERSIONS[0], timeout=args.timeout)
+	samples    = []			#(time, dps)
+	latencies  = []			#seconds
+	failures   = 0
+	end        = time.monotonic() + args.duration
+	try:
+		if(version is None):		#unknown protocol version: negotiated (and cached) before the sampling
+			try:
+				await connection.negotiate(versions)
+			except (OSError, asyncio.TimeoutError, ValueError):
+				pass
+		while(time.monotonic() < end):
+			begin = time.monotonic()
+			try:
+				dps = await connection.status()
+				latencies.append(time.monotonic() - begin)
+				samples.append((time.time(), dict(dps)))
+			except (OSError, asyncio.TimeoutError, ValueError):
+				failures += 1
+			await asyncio.sleep(max(0.0, begin + args.interval - time.monotonic()))
+	finally:
+		await connection.close()
+	return (samples, latencies, failures, connection.pushes, connection.version)
+
+#######################################################################
+#
+# classify
+#		returns the class of a dps from its values (in sampling order)
+#		switch, flag, meter, countdown, counter, sensor, setting, mode, text or other
+#
+#######################################################################
+def classify(key, values, rate, meter):
+	changes = [(old, new) for (old, new) in zip(values, values[1:]) if old != new]
+	kind    = type(values[0])
+	if(kind is bool):
+		return "flag" if rate > FLAG_RATE else "switch"
+	if(kind is int):
+		if(meter and key in METER_DPS):
+			return "meter"
+		if(len(changes) == 0):
+			return "setting"
+		down = sum(1 for (old, new) in changes if new < old)
+		if(down >= 0.8 * len(changes)):
+			return "countdown"		#e.g. timer of the socket, decreases on its own
+		if(len(changes) - down >= 0.8 * len(changes)):
+			return "counter"
+		return "sensor"
+	if(kind is str):
+		return "mode" if len(changes) == 0 else "text"
+	return "other"
+
+#######################################################################
+#
+# analyse
+#		returns the profile of the device (dict) from the samples
+#
+#######################################################################
+def analyse(samples, latencies, failures, pushes, version=None):
+	result = {"version": version, "samples": len(samples), "failures": failures, "pushes": pushes, "dps": {}}
+	if(len(samples) == 0):
+		return result
+	
+	duration  = max(samples[-1][0] - samples[0][0], 1.0)
+	latencies = sorted(latencies)
+	result["duration"]   = round(duration, 1)
+	result["latency_ms"] = {"mean":  round(statistics.mean(latencies) * 1000, 1),
+							"stdev": round(statistics.pstdev(latencies) * 1000, 1),
+							"p50":   round(latencies[len(latencies) // 2] * 1000, 1),
+							"p95":   round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+							"max":   round(latencies[-1] * 1000, 1)}
+	
+	meter = energy_dps(samples[-1][1]) != "None"
+	keys  = sorted(set(key for (when, dps) in samples for key in dps), key=lambda key: int(key) if key.isdigit() else 0)
+	for key in keys:
+		values  = [dps[key] for (when, dps) in samples if key in dps]
+		changes = sum(1 for (old, new) in zip(values, values[1:]) if old != new)
+		rate    = changes * 3600.0 / duration
+		result["dps"][key] = {"type": type(values[0]).__name__, "class": classify(key, values, rate, meter),
+							  "changes": changes, "changes_per_hour": round(rate, 1), "last": values[-1]}
+	
+	#recommended options of the plugin
+	switches = [key for key in keys if result["dps"][key]["class"] == "switch"]
+	external = sum(result["dps"][key]["changes_per_hour"] for key in switches)	#changes not done by the plugin (button, app, timers)
+	p95      = result["latency_ms"]["p95"] / 1000.0
+	poll_min = max(2, int(math.ceil(2 * p95)))
+	if(pushes > 0):
+		poll_max = POLL_CAP					#the changes are pushed, the polling is only a safety net
+	elif(external > 0):
+		poll_max = int(3600.0 / external / 4)	#about 4 polls between two external changes
+	else:
+		poll_max = POLL_CAP
+	if(meter):
+		poll_max = min(poll_max, 60)		#samples for the energy integration
+	poll_max = max(poll_min, min(POLL_CAP, poll_max))
+	result["recommended"] = {"version":  version,
+							 "dps":      ";".join(switches) if len(switches) != 0 else "None",
+							 "groups":   ";".join(switches) if len(switches) > 1 else "None",
+							 "energy":   energy_dps(samples[-1][1]) if meter else "None",
+							 "poll_min": poll_min,
+							 "poll_max": poll_max,
+							 "push":     1 if pushes > 0 else 0,
+							 "timeout":  max(2, int(math.ceil(3 * result["latency_ms"]["max"] / 1000.0)))}
+	return result
+
+def profile_main(argv):
+	parser = argparse.ArgumentParser(prog=sys.argv[0] + " profile", description="Sample the status of a device, classify its dps and recommend the plugin options")
+	parser.add_argument("ip")
+	parser.add_argument("devId")
+	parser.add_argument("--key",      default="",                 help="local key (required for protocol 3.3)")
+	parser.add_argument("--version",  type=float, default=None,   choices=tuya_protocol.VERSIONS, help="protocol version (default: cached or negotiated)")
+	parser.add_argument("--versions", default=tuya_protocol.VERSION_CACHE, help="cache of the protocol versions (default " + tuya_protocol.VERSION_CACHE + ", '' to disable)")
+	parser.add_argument("--duration", type=float, default=300.0,  help="sampling time (seconds, default 300): press the buttons or use the app meanwhile to see the relays change")
+	parser.add_argument("--interval", type=float, default=5.0,    help="interval between two status requests (seconds, default 5)")
+	parser.add_argument("--timeout",  type=float, default=5.0,    help="timeout of a request (seconds, default 5)")
+	parser.add_argument("--json",     action="store_true",        help="print the profile as json")
+	args = parser.parse_args(argv)
+	
+	result = analyse(*asyncio.run(sample(args)))
+	if(args.json):
+		print(json.dumps(result, indent=1))
+		return
+	
+	print("protocol " + str(result["version"]) + ", " + str(result["samples"]) + " samples, " + str(result["failures"]) + " failures, " + str(result["pushes"]) + " pushes")
+	if(result["samples"] == 0):
+		return
+	latency = result["latency_ms"]
+	print("latency (ms): mean " + str(latency["mean"]) + " stdev " + str(latency["stdev"]) + " p50 " + str(latency["p50"]) + " p95 " + str(latency["p95"]) + " max " + str(latency["max"]))
+	print("\n%5s %6s %10s %8s %8s  %s" % ("dps", "type", "class", "changes", "per hour", "last value"))
+	for (key, entry) in result["dps"].items():
+		print("%5s %6s %10s %8d %8.1f  %s" % (key, entry["type"], entry["class"], entry["changes"], entry["changes_per_hour"], json.dumps(entry["last"])))
+	print("\nRecommended (inventory entry or hardware parameters and options):")
+	print(json.dumps(result["recommended"]))
+
+
+if(len(sys.argv) >= 2 and sys.argv[1] == "discover"):
+	discover_main(sys.argv[2:])
+	exit(0)
+
+if(len(sys.argv) >= 2 and sys.argv[1] == "profile"):
+	profile_main(sys.argv[2:])
+	exit(0)
 
 if(len(sys.argv)!=3):
 	print("usage: " + sys.argv[0] + " <IP> <DevID>")
+	print("       " + sys.argv[0] + " discover [--listen <seconds>] [--concurrency <N>] [--timeout <seconds>] [--keys <file>]")
+	print("       " + sys.argv[0] + " profile <IP> <DevID> [--key <localKey>] [--version 3.3] [--versions <file>] [--duration <seconds>] [--interval <seconds>] [--json]")
 	exit(1)
 
+import pytuya	#legacy mode only, the other modes use tuya_async
+
 ip       = sys.argv[1]
 devid    = sys.argv[2]
 
+#the status without local key needs the protocol 3.1 (version cache of the plugin, in its folder)
+versions = tuya_protocol.VersionCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), tuya_protocol.VERSION_CACHE))
+if(versions.get(devid) == 3.3):
+	print("The device uses the protocol 3.3 (" + versions.path + "), its status needs the local key:")
+	print("       " + sys.argv[0] + " profile " + ip + " " + devid + " --key <localKey>")
+	exit(1)
+
 device   = pytuya.OutletDevice(devid,ip,"")
 
 data = 0 #stub for the try except
@@ -47,20 +342,21 @@ try:
 except (ConnectionResetError, socket.timeout, OSError)  as e:
 	print("A problem occur please retry...")
 	exit(1)
+except ValueError:
+	data = None
+if(not isinstance(data, dict) or "dps" not in data): #e.g. "data format error" of a 3.3 device
+	print("The device does not answer in the protocol 3.1 (3.3 device?), its status needs the local key:")
+	print("       " + sys.argv[0] + " profile " + ip + " " + devid + " --key <localKey>")
+	exit(1)
+versions.set(devid, 3.1)
 
 print("\nPlug State Information:")
 print(data)
 
 print("\nPlug DPS List:")
 
-dps_list = ""
-first=True
-for key in data['dps'].keys():
-	
-	if(type (data['dps'][key]) is bool):
-		if(not first):
-			dps_list += ";"
-		dps_list += str(int(key))
-		first=False
-				
-print(dps_list)
+print(boolean_dps(data['dps']))
+
+if(energy_dps(data['dps']) != "None"):
+	print("\nPlug metering DPS (option energy):")
+	print(energy_dps(data['dps']))
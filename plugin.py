@@ -29,12 +29,13 @@
 """
 <plugin key="tixi_tuya_smartplug_plugin" name="Tuya SmartPlug" author="tixi" version="3.0.0" externallink=" https://github.com/tixi/Domoticz-Tuya-SmartPlug-Plugin">
 	<params>
-		<param field="Address" label="IP address" width="200px" required="true"/>
+		<param field="Address" label="IP address or inventory file" width="200px" required="true"/>
 		<param field="Mode1" label="DevID" width="200px" required="true"/>
 		<param field="Mode2" label="Local Key" width="200px" required="true"/>
 		<param field="Mode3" label="DPS" width="200px" required="true" default="1"/>
 		<param field="Mode4" label="DPS group" width="200px" required="true" default="None"/>
 		<param field="Mode5" label="DPS always ON" width="200px" required="true" default="None"/>
+		<param field="Username" label="Options" width="200px" required="false" default=""/>
 		<param field="Mode6" label="Debug" width="75px">
 			<options>
 				<option label="0"   value="0" default="true"/>
@@ -66,8 +67,23 @@
 # 128 		Mask Value. Shows plugin framework debug messages related to the message queue. 
 
 import Domoticz
-import pytuya
+import tuya_protocol
+import tuya_stats
 import json
+import heapq
+import random
+import time
+import os
+from hashlib import md5
+
+#source of a state (values of tuya_history.COMMAND, POLL and PUSH, tuya_history is imported only when used)
+SOURCE_COMMAND = 0
+SOURCE_POLL    = 1
+SOURCE_PUSH    = 2
+
+#direction of a captured frame (values of tuya_capture.IN and OUT, tuya_capture is imported only when used)
+CAPTURE_IN     = 1
+CAPTURE_OUT    = 2
 
 ########################################################################################
 #
@@ -78,86 +94,1567 @@ class Plug:
 
 	#######################################################################
 	#
-	# constructor
+	# constructor
+	#
+	#######################################################################
+	def __init__(self,dps_id,unit=None,history=None):
+		if(unit is None):
+			unit = dps_id
+		self.__dps_id   = dps_id	# dps id
+		self.__unit     = unit		# domoticz unit
+		self.__history  = history	# tuya_history.HistoryWriter of the device (None: no history)
+		self.__state    = None		# last known state (None: unknown)
+		return
+	
+	#######################################################################
+	# restore function
+	#		last known state (e.g. from a snapshot), not recorded in the history
+	#
+	#######################################################################
+	def restore(self,state):
+		self.__state = state
+	
+	#######################################################################
+	# update_state function
+	#		update the domoticz device with the observed state
+	#		(the commands are followed by the Reconciler of the device)
+	#		and record the transitions in the history
+	#
+	# parameters:
+	#		state:  True <=> On ; False <=> Off
+	#		source: SOURCE_COMMAND, SOURCE_POLL or SOURCE_PUSH
+	#
+	#######################################################################
+	def update_state(self,state,source=SOURCE_POLL): #state: True <=> On ; False <=> Off
+		
+		if(self.__history is not None and state != self.__state):
+			self.__history.append(time.time(), self.__dps_id, self.__state, state, source)
+		self.__state = state
+		
+		if(state):
+			UpdateDevice(self.__unit, 1, "On")
+		else:
+			UpdateDevice(self.__unit, 0, "Off")
+
+########################################################################################
+
+########################################################################################
+#
+# energy meter object (current, power and voltage dps of a metering device)
+#	the samples received (polls and pushes) are kept in a fixed size ring buffer,
+#	the energy is integrated at each sample and the Domoticz devices (kWh, voltage
+#	and current) are only written once per period with the aggregated values
+#
+########################################################################################
+class EnergyMeter:
+
+	#######################################################################
+	#
+	# constant definition
+	#
+	#######################################################################
+	SIZE     = 256			# number of samples kept
+	MAX_GAP  = 900.0		# longer intervals between two samples are not integrated (seconds)
+
+	#######################################################################
+	#
+	# constructor
+	#
+	# Parameters
+	#	dps_ids: dps id of the current, power and voltage
+	#	units:   domoticz units of the kWh, voltage and current devices
+	#	scales:  divisors of the raw current, power and voltage values (e.g. mA, dW, dV)
+	#	period:  min interval between two writes of the domoticz devices (seconds)
+	#
+	#######################################################################
+	def __init__(self, dps_ids, units, scales, period):
+		self.__dps_ids  = [str(dps_id) for dps_id in dps_ids]
+		self.__units    = list(units)
+		self.__scales   = list(scales)
+		self.__period   = period
+		self.__samples  = [None] * self.SIZE	# ring buffer of (time, current, power, voltage)
+		self.__next     = 0						# next slot of the ring buffer
+		self.__last     = [0.0, 0.0, 0.0]		# last known current (A), power (W) and voltage (V)
+		self.__last_at  = None					# time of the last sample
+		self.__energy   = 0.0					# cumulative energy (Wh)
+		self.__window   = None					# beginning of the current aggregation window
+		return
+	
+	#######################################################################
+	#
+	# units function
+	#		returns the domoticz units of the meter
+	#
+	#######################################################################
+	def units(self):
+		return list(self.__units)
+	
+	#######################################################################
+	#
+	# restore function
+	#		energy: cumulative energy (Wh) written by the previous run
+	#
+	#######################################################################
+	def restore(self, energy):
+		self.__energy = energy
+	
+	#######################################################################
+	#
+	# update function
+	#		dps received from the device (may be partial, ignored without metering dps)
+	#
+	#######################################################################
+	def update(self, dps, now):
+		present = False
+		for (index, dps_id) in enumerate(self.__dps_ids):
+			value = dps.get(dps_id)
+			if(isinstance(value, (int, float)) and not isinstance(value, bool)):
+				self.__last[index] = value / self.__scales[index]
+				present = True
+		if(not present):
+			return
+		
+		#energy: the power is held between two samples
+		if(self.__last_at is not None and 0 < now - self.__last_at <= self.MAX_GAP):
+			self.__energy += self.__samples[self.__next - 1][2] * (now - self.__last_at) / 3600.0
+		self.__last_at = now
+		
+		self.__samples[self.__next] = (now, self.__last[0], self.__last[1], self.__last[2])
+		self.__next = (self.__next + 1) % self.SIZE
+		if(self.__window is None):
+			self.__window = now
+	
+	#######################################################################
+	#
+	# publish function
+	#		write the aggregated values of the window to domoticz when the period is over:
+	#		kWh (mean power ; cumulative energy), mean voltage and mean current
+	#
+	#######################################################################
+	def publish(self, now):
+		if(self.__window is None or now - self.__window < self.__period):
+			return
+		samples = [sample for sample in self.__samples if sample is not None and sample[0] >= self.__window]
+		self.__window = now
+		if(len(samples) == 0):
+			return
+		current = sum(sample[1] for sample in samples) / len(samples)
+		power   = sum(sample[2] for sample in samples) / len(samples)
+		voltage = sum(sample[3] for sample in samples) / len(samples)
+		if(_debug):
+			Domoticz.Debug("Meter unit " + str(self.__units[0]) + ": " + str(len(samples)) + " samples, power mean " + str(round(power, 1))
+						   + " W max " + str(round(max(sample[2] for sample in samples), 1)) + " W, energy " + str(round(self.__energy, 1)) + " Wh")
+		UpdateDevice(self.__units[0], 0, str(round(power, 1)) + ";" + str(round(self.__energy, 1)))
+		UpdateDevice(self.__units[1], 0, str(round(voltage, 1)))
+		UpdateDevice(self.__units[2], 0, str(round(current, 3)))
+
+########################################################################################
+
+########################################################################################
+#
+# reconciler (desired and observed states of the sockets of a device)
+#	a desired state is kept until a frame of the device confirms it (for ever for the
+#	always ON sockets), the set payload holds only the sockets whose observed state differs.
+#	a socket is sent again at most every RETRY_MIN seconds (doubling up to RETRY_MAX)
+#	and a command refused GIVE_UP times is abandoned (an always ON socket is then
+#	sent again every RETRY_MAX seconds until the device confirms it).
+#
+########################################################################################
+class Reconciler:
+
+	#######################################################################
+	#
+	# constant definition
+	#
+	#######################################################################
+	RETRY_MIN = 2.0			# min delay between two sets of the same socket (seconds)
+	RETRY_MAX = 300.0		# max delay between two sets of the same socket (seconds)
+	GIVE_UP   = 5			# number of sets of a command before it is abandoned (except always ON)
+
+	#######################################################################
+	#
+	# constructor
+	#
+	#######################################################################
+	def __init__(self):
+		self.__observed  = {}		# mapping between dps id (str) and its last known state
+		self.__desired   = {}		# mapping between dps id (str) and [state, sets sent, time of the next allowed set]
+		self.__always_on = set()	# dps id (str) of the always ON sockets
+		return
+	
+	#######################################################################
+	#
+	# set_always_on function
+	#
+	#######################################################################
+	def set_always_on(self,dps_id):
+		self.__always_on.add(str(dps_id))
+		self.__desired[str(dps_id)] = [True, 0, 0.0]
+	
+	#######################################################################
+	#
+	# command function
+	#		dps_id should be in state (True <=> On), the last command wins
+	#
+	#######################################################################
+	def command(self,dps_id,state):
+		dps_id = str(dps_id)
+		if(dps_id in self.__always_on):
+			state = True
+		entry = self.__desired.get(dps_id)
+		if(entry is None or entry[0] != state):
+			self.__desired[dps_id] = [state, 0, 0.0]
+		elif(not self.given_up(dps_id)):
+			entry[2] = 0.0 #same command again: can be sent at once
+	
+	#######################################################################
+	#
+	# observe function
+	#		dps received from the device (may be partial)
+	#
+	#######################################################################
+	def observe(self,dps):
+		for dps_id in dps:
+			self.__observed[dps_id] = dps[dps_id]
+			entry = self.__desired.get(dps_id)
+			if(entry is not None and entry[0] == dps[dps_id]):
+				if(dps_id in self.__always_on):
+					entry[1] = 0
+				else:
+					del self.__desired[dps_id] #confirmed
+	
+	#######################################################################
+	#
+	# desired function
+	#		returns the state commanded for dps_id (None if no command is pending)
+	#
+	#######################################################################
+	def desired(self,dps_id):
+		entry = self.__desired.get(str(dps_id))
+		return None if entry is None else entry[0]
+	
+	#######################################################################
+	#
+	# given_up function
+	#		returns True if the always ON socket dps_id was refused GIVE_UP times
+	#		(sent again every RETRY_MAX seconds only)
+	#
+	#######################################################################
+	def given_up(self,dps_id):
+		entry = self.__desired.get(str(dps_id))
+		return entry is not None and entry[1] >= self.GIVE_UP and str(dps_id) in self.__always_on
+	
+	#######################################################################
+	#
+	# observed function
+	#		returns the last known states (dps id (str) -> state)
+	#
+	#######################################################################
+	def observed(self):
+		return dict(self.__observed)
+	
+	#######################################################################
+	#
+	# pending function
+	#		returns True if some commands are not confirmed
+	#
+	#######################################################################
+	def pending(self):
+		for (dps_id, entry) in self.__desired.items():
+			if(dps_id not in self.__always_on or self.__observed.get(dps_id) != entry[0]):
+				return True
+		return False
+	
+	#######################################################################
+	#
+	# missing function
+	#		returns True if some commands not confirmed are absent from dps
+	#
+	#######################################################################
+	def missing(self,dps):
+		for (dps_id, entry) in self.__desired.items():
+			if(dps_id not in dps and self.__observed.get(dps_id) != entry[0]):
+				return True
+		return False
+	
+	#######################################################################
+	#
+	# ready function
+	#		returns True if a set can be sent at now
+	#
+	#######################################################################
+	def ready(self,now):
+		for (dps_id, entry) in self.__desired.items():
+			if(self.__observed.get(dps_id) != entry[0] and now >= entry[2]):
+				return True
+		return False
+	
+	#######################################################################
+	#
+	# payload function
+	#		returns the dps to set at now (minimal delta), the list of the dps
+	#		whose command is abandoned (refused too many times) and the list
+	#		of the dps of the payload already sent (retries)
+	#
+	#######################################################################
+	def payload(self,now):
+		result  = {}
+		refused = []
+		retried = []
+		for dps_id in list(self.__desired):
+			entry = self.__desired[dps_id]
+			if(self.__observed.get(dps_id) == entry[0] or now < entry[2]):
+				continue
+			if(entry[1] >= self.GIVE_UP and dps_id not in self.__always_on):
+				del self.__desired[dps_id]
+				refused.append(dps_id)
+				continue
+			result[dps_id] = entry[0]
+			if(entry[1] > 0):
+				retried.append(dps_id)
+			entry[1] += 1
+			entry[2]  = now + (self.RETRY_MAX if entry[1] >= self.GIVE_UP else min(self.RETRY_MAX, self.RETRY_MIN * (2 ** min(entry[1] - 1, 20))))
+		return (result, refused, retried)
+
+########################################################################################
+#
+# poll scheduler (adaptive status requests of all the devices)
+#	after a command or a mismatch a device is polled every min interval (FAST_POLLS times),
+#	then the interval doubles at each request up to the max interval of the device.
+#	idle requests are limited per heartbeat to spread them, fast ones are never delayed.
+#
+########################################################################################
+class PollScheduler:
+
+	#######################################################################
+	#
+	# constant definition
+	#
+	#######################################################################
+	FAST_POLLS = 3			# number of requests at the min interval after a boost
+
+	#######################################################################
+	#
+	# constructor
+	#
+	#######################################################################
+	def __init__(self):
+		self.__tick   = 0			# heartbeat counter
+		self.__state  = {}			# mapping between a device and its [min, max, interval, fast polls left, entry id]
+		self.__heap   = []			# heap of (due tick, entry id, device)
+		self.__count  = 0			# entry id generator
+		self.__rate   = 0.0			# idle requests per heartbeat of all the devices
+		self.__budget = 1			# max number of idle requests per heartbeat
+		return
+	
+	#######################################################################
+	#
+	# __push function
+	#		schedule device at tick due (previous entries become stale)
+	#
+	#######################################################################
+	def __push(self,device,due):
+		self.__count += 1
+		self.__state[device][4] = self.__count
+		heapq.heappush(self.__heap, (due, self.__count, device))
+	
+	#######################################################################
+	#
+	# add function
+	#		register a device, the first requests are staggered
+	#
+	# parameters:
+	#		min_interval, max_interval: in heartbeats
+	#
+	#######################################################################
+	def add(self,device,min_interval,max_interval):
+		index = len(self.__state)
+		self.__state[device] = [min_interval, max_interval, max_interval, 0, 0]
+		self.__push(device, self.__tick + 1 + (index % max_interval))
+		self.__rate  += 1.0 / max_interval
+		self.__budget = max(1, int(2 * self.__rate + 0.999))	# twice the idle rate: room for backing off devices
+	
+	#######################################################################
+	#
+	# boost function
+	#		something happened on device (command, mismatch): poll it fast
+	#
+	#######################################################################
+	def boost(self,device):
+		state    = self.__state[device]
+		state[2] = state[0]
+		state[3] = self.FAST_POLLS
+		self.__push(device, self.__tick + state[0])
+	
+	#######################################################################
+	#
+	# settle function
+	#		the commands of device are confirmed: back to the max interval
+	#
+	#######################################################################
+	def settle(self,device):
+		state    = self.__state[device]
+		state[2] = state[1]
+		state[3] = 0
+		self.__push(device, self.__tick + state[1])
+	
+	#######################################################################
+	#
+	# reset function
+	#		a request has just been sent to device: schedule the next one
+	#
+	#######################################################################
+	def reset(self,device):
+		state = self.__state[device]
+		self.__push(device, self.__tick + state[2])
+		if(state[3] > 0):
+			state[3] -= 1
+		else:
+			state[2] = min(state[2] * 2, state[1])
+	
+	#######################################################################
+	#
+	# interval function
+	#		returns the current interval of device (in heartbeats)
+	#
+	#######################################################################
+	def interval(self,device):
+		return self.__state[device][2]
+	
+	#######################################################################
+	#
+	# tick function
+	#		to be called at each heartbeat
+	#
+	# returns: the list of devices to poll
+	#		   (idle devices over __budget are kept for the next heartbeat)
+	#
+	#######################################################################
+	def tick(self):
+		self.__tick += 1
+		result   = []
+		deferred = []
+		budget   = self.__budget
+		while(len(self.__heap) != 0 and self.__heap[0][0] <= self.__tick):
+			(due, count, device) = heapq.heappop(self.__heap)
+			state = self.__state[device]
+			if(state[4] != count): # skip stale entries
+				continue
+			if(state[3] > 0):
+				result.append(device)
+			elif(budget > 0):
+				budget -= 1
+				result.append(device)
+			else:
+				deferred.append(device)
+		for device in deferred:
+			self.__push(device, self.__tick + 1)
+		return result
+
+########################################################################################
+
+########################################################################################
+#
+# reconnect policy (one per connection)
+#	the delay between two connection attempts doubles at each failure (with jitter to
+#	spread the reconnections of many devices, e.g. after a router reboot) up to max_delay.
+#	after threshold failures the circuit is open (the units are TimedOut) and
+#	the next attempts are probes (half open) until the device answers again.
+#
+########################################################################################
+class ReconnectPolicy:
+
+	#######################################################################
+	#
+	# constant definition
+	#
+	#######################################################################
+	CLOSED    = 0			# the device answers (or has not failed enough yet)
+	OPEN      = 1			# too many failures, waiting for the next probe
+	HALF_OPEN = 2			# a probe is in progress
+
+	#######################################################################
+	#
+	# constructor
+	#
+	# parameters:
+	#		min_delay, max_delay: in seconds
+	#		threshold: failures before opening the circuit (0: never)
+	#
+	#######################################################################
+	def __init__(self,min_delay,max_delay,threshold):
+		self.state       = self.CLOSED
+		self.failures    = 0			# consecutive failures
+		self.__min_delay = min_delay
+		self.__max_delay = max(min_delay, max_delay)
+		self.__threshold = threshold
+		self.__next      = 0.0			# time of the next allowed attempt
+		return
+	
+	#######################################################################
+	#
+	# ready function
+	#		returns True if a connection attempt is allowed at now
+	#
+	#######################################################################
+	def ready(self,now):
+		return now >= self.__next
+	
+	#######################################################################
+	#
+	# delay function
+	#		returns the time left before the next allowed attempt (seconds)
+	#
+	#######################################################################
+	def delay(self,now):
+		return max(0.0, self.__next - now)
+	
+	#######################################################################
+	#
+	# attempt function
+	#		a connection attempt is started
+	#
+	#######################################################################
+	def attempt(self,now):
+		if(self.state == self.OPEN):
+			self.state = self.HALF_OPEN
+	
+	#######################################################################
+	#
+	# failure function
+	#		the connection failed (or was closed before any answer)
+	#
+	# returns: True if the circuit has just been opened
+	#
+	#######################################################################
+	def failure(self,now):
+		self.failures += 1
+		delay = min(self.__max_delay, self.__min_delay * (2 ** min(self.failures - 1, 20)))
+		self.__next = now + random.uniform(delay / 2, delay) # equal jitter
+		if(self.state != self.CLOSED):
+			self.state = self.OPEN #failed probe
+			return False
+		if(self.__threshold > 0 and self.failures >= self.__threshold):
+			self.state = self.OPEN
+			return True
+		return False
+	
+	#######################################################################
+	#
+	# success function
+	#		the device answered
+	#
+	# returns: True if the circuit was open (recovery)
+	#
+	#######################################################################
+	def success(self):
+		recovered     = (self.state != self.CLOSED)
+		self.state    = self.CLOSED
+		self.failures = 0
+		self.__next   = 0.0
+		return recovered
+
+########################################################################################
+
+########################################################################################
+#
+# request queue (one per connection)
+#	one request in flight at a time, the set requests (user commands) go ahead
+#	of the status requests (polls), the answers are matched with the sequence number
+#	and the requests without answer before their deadline are retried
+#
+########################################################################################
+class RequestQueue:
+
+	#######################################################################
+	#
+	# constant definition
+	#
+	#######################################################################
+	SET    = 0			# set request (priority of the user commands)
+	STATUS = 1			# status request (priority of the polls)
+
+	#######################################################################
+	#
+	# constructor
+	#
+	# parameters:
+	#		timeout: deadline of a request (seconds)
+	#		retries: number of retries of a request without answer
+	#
+	#######################################################################
+	def __init__(self,timeout,retries):
+		self.timeout    = timeout
+		self.retries    = retries
+		self.in_flight  = None			# [kind, cmd, seq, deadline, attempts, sent_at, seqs of the previous attempts, acknowledged]
+		self.__queued   = {}			# mapping between a queued kind and its priority
+		self.__heap     = []			# heap of (priority, order, kind)
+		self.__order    = 0				# fifo order of the same priorities
+		self.__seq      = 0				# last sequence number
+		return
+	
+	#######################################################################
+	#
+	# push function
+	#		queue a request of kind (once: a queued request gets the highest priority asked)
+	#
+	#######################################################################
+	def push(self,kind,priority=None):
+		if(priority is None):
+			priority = kind
+		if(kind in self.__queued and self.__queued[kind] <= priority):
+			return
+		self.__queued[kind] = priority
+		self.__order += 1
+		heapq.heappush(self.__heap, (priority, self.__order, kind))
+	
+	#######################################################################
+	#
+	# pop function
+	#		returns the kind of the next request to send (None if nothing is queued)
+	#
+	#######################################################################
+	def pop(self):
+		while(len(self.__heap) != 0):
+			(priority, order, kind) = heapq.heappop(self.__heap)
+			if(self.__queued.get(kind) == priority): # skip stale entries
+				del self.__queued[kind]
+				return kind
+		return None
+	
+	#######################################################################
+	#
+	# idle function
+	#		returns True if no answer is expected
+	#
+	#######################################################################
+	def idle(self):
+		return self.in_flight is None
+	
+	#######################################################################
+	#
+	# sent function
+	#		a request of kind (frame type cmd) is sent at now
+	#
+	# returns: the sequence number of the request
+	#
+	#######################################################################
+	def sent(self,kind,cmd,now,attempts=0,previous=()):
+		self.__seq = self.__seq % 0xffffffff + 1 # never 0 (pushes)
+		self.in_flight = [kind, cmd, self.__seq, now + self.timeout, attempts, now, previous, False]
+		return self.__seq
+	
+	#######################################################################
+	#
+	# wait_push function
+	#		request (a set) is acknowledged without dps: it stays in flight until its
+	#		deadline, waiting for the push (cmd 8) of the new states
+	#
+	#######################################################################
+	def wait_push(self,request):
+		request[7]     = True
+		self.in_flight = request
+	
+	#######################################################################
+	#
+	# match function
+	#		returns the request in flight answered by frame (None if frame is not its answer)
+	#		the devices which do not echo the sequence number are matched by frame type
+	#		(but late answers of the previous attempts are skipped)
+	#
+	#######################################################################
+	def match(self,frame):
+		request = self.in_flight
+		if(request is None):
+			return None
+		if(request[7] and frame.cmd != tuya_protocol.STATUS):
+			return None
+		if(frame.seq != request[2]):
+			if(frame.seq in request[6]):
+				return None
+			if(frame.cmd != request[1] and not (request[0] == self.SET and frame.cmd == tuya_protocol.STATUS)):
+				return None
+		self.in_flight = None
+		return request
+	
+	#######################################################################
+	#
+	# expired function
+	#		returns the request in flight if its deadline is over at now (it is removed)
+	#
+	#######################################################################
+	def expired(self,now):
+		request = self.in_flight
+		if(request is None or now < request[3]):
+			return None
+		self.in_flight = None
+		return request
+	
+	#######################################################################
+	#
+	# clear function
+	#		forget the queued requests and the request in flight (connection closed)
+	#
+	#######################################################################
+	def clear(self):
+		self.in_flight = None
+		self.__queued  = {}
+		self.__heap    = []
+
+########################################################################################
+
+########################################################################################
+#
+# gateway link (option gateway=host:port): a single connection to tuya_gateway.py
+#	which owns the connections to the devices, the TuyaDevice objects only send
+#	their requests (json lines) and receive the dps of their device
+#
+########################################################################################
+class GatewayLink:
+
+	#######################################################################
+	#
+	# constructor
+	#
+	#######################################################################
+	def __init__(self, address, port, reconnect):
+		self.name               = "Tuya gateway"		#name of the connection
+		self.__address          = address				#address of the gateway (localhost)
+		self.__port             = port					#TCP port of the gateway
+		self.__reconnect        = reconnect				#reconnect policy of the connection
+		self.__connection       = None					#connection to the gateway
+		self.__buffer           = bytearray()			#received data not processed yet (partial line)
+		self.__devices          = {}					#mapping between devID and a TuyaDevice object
+		return
+	
+	#######################################################################
+	#
+	# attach function
+	#		the dps of devID are given to device
+	#
+	#######################################################################
+	def attach(self, devID, device):
+		self.__devices[devID] = device
+	
+	#######################################################################
+	#
+	# start function
+	#
+	#######################################################################
+	def start(self):
+		self.__connection = Domoticz.Connection(Name=self.name, Transport="TCP/IP", Address=self.__address, Port=str(self.__port))
+		self.reconnect(time.time())
+	
+	#######################################################################
+	#
+	# stop function
+	#
+	#######################################################################
+	def stop(self):
+		if(self.__connection.Connected() or self.__connection.Connecting()):
+			self.__connection.Disconnect()
+		self.__connection = None
+		self.__devices    = {}
+	
+	#######################################################################
+	#
+	# request function
+	#		send a request to the gateway (dict, see tuya_gateway.py)
+	#		returns False if the gateway is not connected (the connection is started)
+	#
+	#######################################################################
+	def request(self, message):
+		if(self.__connection is None or not self.__connection.Connected()):
+			self.reconnect(time.time())
+			return False
+		self.__connection.Send(json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n')
+		return True
+	
+	#######################################################################
+	#
+	# reconnect function
+	#		called at each heartbeat: the connection is kept open
+	#
+	#######################################################################
+	def reconnect(self, now):
+		if(self.__connection is None or self.__connection.Connected() or self.__connection.Connecting() or not self.__reconnect.ready(now)):
+			return
+		self.__reconnect.attempt(now)
+		self.__connection.Connect()
+	
+	#######################################################################
+	#
+	# on_connect function
+	#		subscribe to the dps of the devices (the gateway sends their current state at once)
+	#
+	#######################################################################
+	def on_connect(self, Connection, Status, Description):
+		if (Status == 0):
+			Domoticz.Debug("Connected successfully to the gateway " + Connection.Address + ":" + Connection.Port)
+			if(self.__reconnect.success()):
+				Domoticz.Log("Gateway reachable again")
+			del self.__buffer[:]
+			self.request({"op": "subscribe", "devices": list(self.__devices.keys())})
+		else:
+			Domoticz.Debug("Gateway OnConnect Error Status: " + str(Status))
+			if(self.__reconnect.failure(time.time())):
+				Domoticz.Error("Gateway " + self.__address + ":" + str(self.__port) + " unreachable (is tuya_gateway.py running?)")
+				for device in self.__devices.values():
+					device.on_gateway({"online": False})
+	
+	#######################################################################
+	#
+	# on_disconnect function
+	#
+	#######################################################################
+	def on_disconnect(self, Connection):
+		Domoticz.Debug("Gateway disconnected")
+	
+	#######################################################################
+	#
+	# on_message function
+	#		one json object per line: answers and events of the devices
+	#
+	#######################################################################
+	def on_message(self, Connection, Data):
+		self.__buffer += Data
+		end = self.__buffer.rfind(b'\n')
+		if(end == -1):
+			return
+		lines = bytes(self.__buffer[:end]).split(b'\n')
+		del self.__buffer[:end + 1]
+		for line in lines:
+			try:
+				message = json.loads(line.decode('utf-8'))
+			except ValueError:
+				Domoticz.Error("Invalid data from the gateway: " + str(line[:80]))
+				continue
+			device = self.__devices.get(message.get("devId"))
+			if(device is not None):
+				device.on_gateway(message)
+			elif(not message.get("ok", True)):
+				Domoticz.Error("Gateway: " + str(message.get("error")))
+
+########################################################################################
+
+########################################################################################
+#
+# tuya device object (one connection per device, owns the plugs of the device)
+#
+########################################################################################
+class TuyaDevice:
+
+	#######################################################################
+	#
+	# private functions definition
+	#	__is_encoded
+	#	__connect
+	#	__failed
+	#	__alive
+	#	__request
+	#	__gateway_request
+	#	__pump
+	#	__commands
+	#	__send
+	#	__write
+	#	__answered
+	#	__process_dps
+	#	__handle_frame
+	#
+	#######################################################################
+	
+	
+	#######################################################################
+	#
+	# __is_encoded
+	#
+	# Parameter
+	#	Data: a received payload from the tuya smart plug
+	#
+	# Returns 
+	#	True if Data is encoded
+	#	False otherwise
+	#
+	# Remark: for debugging purpose
+	#
+	#######################################################################
+	#~ def __is_encoded(self, Data):
+
+		#~ tmp = Data[20:-8]  # hard coded offsets
+		#~ if(tmp.startswith(b'3.1')):#PROTOCOL_VERSION_BYTES
+			#~ return True
+		#~ else:
+			#~ return False
+	
+	#######################################################################
+	#
+	# __connect
+	#	start a connection if allowed by the reconnect policy
+	#
+	#######################################################################
+	def __connect(self, now):
+		if(self.__connection.Connected() or self.__connection.Connecting() or not self.__reconnect.ready(now)):
+			return
+		self.__reconnect.attempt(now)
+		self.__alive_since_connect = False
+		self.__connection.Connect()
+	
+	#######################################################################
+	#
+	# __failed
+	#	a connection failed: back off and open the circuit after too many failures
+	#
+	#######################################################################
+	def __failed(self, now):
+		if(self.__reconnect.failure(now)):
+			self.stats.count("circuit_opens")
+			self.stats.reachable = False
+			Domoticz.Error(self.name + " unreachable after " + str(self.__reconnect.failures) + " attempts")
+			for unit in self.units():
+				TimeoutDevice(unit, 1)
+		Domoticz.Debug(self.name + " next connection attempt in " + str(round(self.__reconnect.delay(now), 1)) + "s")
+	
+	#######################################################################
+	#
+	# __alive
+	#	a valid frame is received: the device is reachable
+	#
+	#######################################################################
+	def __alive(self):
+		if(self.__alive_since_connect):
+			return
+		self.__alive_since_connect = True
+		if(self.__reconnect.success()):
+			self.stats.reachable = True
+			Domoticz.Log(self.name + " is reachable again")
+			for unit in self.units():
+				TimeoutDevice(unit, 0)
+	
+	#######################################################################
+	#
+	# __request
+	#	queue a request and send it as soon as possible
+	#
+	# Parameters
+	#	kind:     RequestQueue.SET or RequestQueue.STATUS
+	#	priority: RequestQueue.SET to send a status request ahead of the polls
+	#
+	#######################################################################
+	def __request(self, kind, priority=None):
+		if(self.__gateway is not None):
+			self.__gateway_request(kind, time.time())
+			return
+		self.__queue.push(kind, priority)
+		if(self.__connection.Connected()):
+			self.__pump(time.time())
+		else:
+			self.__connect(time.time())
+	
+	#######################################################################
+	#
+	# __gateway_request
+	#	gateway mode: send the request to the gateway (answered by the dps of the device)
+	#	the commands not sent (gateway not connected) are sent again when the gateway
+	#	reports states different from the commands
+	#
+	#######################################################################
+	def __gateway_request(self, kind, now):
+		self.__sending(now)
+		dict_payload = self.__commands(now) if kind == RequestQueue.SET else {}
+		if(len(dict_payload) != 0):
+			self.__pending_since = None
+			self.stats.count("set_requests")
+			self.__gateway.request({"op": "set", "device": self.__devID, "dps": dict_payload})
+		else:
+			self.stats.count("status_requests")
+			self.__gateway.request({"op": "status", "device": self.__devID})
+	
+	#######################################################################
+	#
+	# __pump
+	#	send the next queued request if no answer is expected
+	#
+	#######################################################################
+	def __pump(self, now):
+		if(not self.__queue.idle() or not self.__connection.Connected()):
+			return
+		kind = self.__queue.pop()
+		if(kind is not None):
+			self.__send(kind, now)
+	
+	#######################################################################
+	#
+	# __commands
+	#	returns the dps to set (commands allowed by the reconciler, the refused ones are logged)
+	#	the device is polled fast after the set unless it only holds always ON sockets
+	#	the device keeps refusing (no tight loop on a locked socket)
+	#
+	#######################################################################
+	def __commands(self, now):
+		(dict_payload, refused, retried) = self.__reconciler.payload(now)
+		for dps_id in refused:
+			self.stats.count("refused_commands")
+			Domoticz.Error(self.name + " does not apply the command of dps " + dps_id + ": abandoned")
+		if(len(retried) != 0):
+			self.stats.count("mismatch_retries")
+		if(not all(self.__reconciler.given_up(dps_id) for dps_id in dict_payload)):
+			self.__scheduler.boost(self)
+		return dict_payload
+	
+	#######################################################################
+	#
+	# __send
+	#	send a request (a set request is built with the commands waiting at that time,
+	#	it becomes a status request if there is none)
+	#
+	# Parameters
+	#	kind:     RequestQueue.SET or RequestQueue.STATUS
+	#	attempts: number of previous attempts (retry)
+	#	previous: sequence numbers of the previous attempts
+	#
+	#######################################################################
+	def __send(self, kind, now, attempts=0, previous=()):
+		self.__sending(now)
+		dict_payload = self.__commands(now) if kind == RequestQueue.SET else {}
+		
+		if(len(dict_payload) != 0):
+			seq = self.__queue.sent(RequestQueue.SET, tuya_protocol.CONTROL, now, attempts, previous)
+			self.__pending_since = None
+			self.stats.count("set_requests")
+			payload = self.__encoder.set(dict_payload, now, seq)
+		else:
+			seq = self.__queue.sent(RequestQueue.STATUS, tuya_protocol.DP_QUERY, now, attempts, previous)
+			self.stats.count("status_requests")
+			payload = self.__encoder.status(seq)
+		
+		self.__last_sent = now
+		self.__write(payload)
+	
+	#######################################################################
+	#
+	# __sending
+	#	a request is sent at now: lag since the poll asked by the scheduler
+	#
+	#######################################################################
+	def __sending(self, now):
+		if(self.__poll_at is not None):
+			self.stats.send_lag.add(now - self.__poll_at)
+			self.__poll_at = None
+	
+	#######################################################################
+	#
+	# __write
+	#	send data to the device (and record it)
+	#
+	#######################################################################
+	def __write(self, data):
+		if(self.__recorder is not None):
+			self.__recorder.record(CAPTURE_OUT, self.__channel, data, time.time())
+		self.__connection.Send(data)
+	
+	#######################################################################
+	#
+	# __answered
+	#	request is answered
+	#
+	#######################################################################
+	def __answered(self, request):
+		self.stats.last_answer = time.time()
+		self.stats.rtt.add(self.stats.last_answer - request[5])
+		self.stats.count("answers")
+	
+	#######################################################################
+	#
+	# __process_dps
+	#	update all the plugs present in dps (set answer, push or status answer)
+	#	and send the commands again in case of mismatch (when allowed by the reconciler)
+	#
+	# Parameter
+	#	dps:    dict of the dps (may be partial)
+	#	source: SOURCE_POLL or SOURCE_PUSH (SOURCE_COMMAND for the states requested by a command)
+	#
+	# Returns
+	#	False if some plugs waiting for a command are absent from dps
+	#	True otherwise
+	#
+	#######################################################################
+	def __process_dps(self, dps, source=SOURCE_POLL):
+		
+		if(self.__meter is not None):
+			self.__meter.update(dps, time.time())
+		commanded = {}
+		for key in self.__plugs:
+			if(str(key) in dps):
+				commanded[key] = (self.__reconciler.desired(key) == dps[str(key)])
+		self.__reconciler.observe(dps)
+		for key in commanded:
+			self.__plugs[key].update_state(dps[str(key)], SOURCE_COMMAND if commanded[key] else source)
+		
+		if(self.__reconciler.pending()):
+			if(self.__reconciler.missing(dps)):
+				return False
+			#mismatch: corrective set now or at a next poll (rate limited, the set boosts the polls)
+			if(self.__reconciler.ready(time.time())):
+				self.__request(RequestQueue.SET)
+			return True
+		
+		self.__pending_since = None #all the commands are done
+		if(self.__command_at is not None):
+			self.stats.confirm.add(time.time() - self.__command_at)
+			self.__command_at = None
+			self.__scheduler.settle(self)	#confirmed: no fast polls
+		return True
+	
+	#######################################################################
+	#
+	# __readable
+	#	an answer of the device is read: its protocol version is saved if it changed
+	#
+	#######################################################################
+	def __readable(self):
+		self.__unreadable_count = 0
+		self.__readable_since_connect = True
+		if(self.__versions is not None and self.__versions.get(self.__devID) != self.__version):
+			if(self.__versions.set(self.__devID, self.__version)):
+				Domoticz.Log(self.name + " uses the protocol " + str(self.__version) + " (saved in " + self.__versions.path + ")")
+	
+	#######################################################################
+	#
+	# __unreadable
+	#	an answer cannot be read (e.g. "data format error" of a device of the other protocol version):
+	#	after VERSION_FAILURES answers in a row, the requests are encoded with the other version
+	#	(only if the version is not fixed by the configuration)
+	#
+	#######################################################################
+	def __unreadable(self):
+		if(self.__versions is None or self.__localKey == ""):
+			return
+		self.__unreadable_count += 1
+		if(self.__unreadable_count < tuya_protocol.VERSION_FAILURES):
+			return
+		self.__unreadable_count = 0
+		self.__version = tuya_protocol.other_version(self.__version)
+		self.__encoder = tuya_protocol.PayloadEncoder(self.__devID, self.__localKey.encode('latin1'), self.__version)
+		self.stats.count("version_switches")
+		Domoticz.Log(self.name + " does not understand the requests: trying the protocol " + str(self.__version))
+	
+	#######################################################################
+	#
+	# __handle_frame
+	#	process a complete frame received from the tuya device
+	#
+	# Parameter
+	#	frame: a tuya_protocol.TuyaFrame
+	#
+	#######################################################################
+	def __handle_frame(self, frame):
+		
+		self.__alive()
+		
+		if(frame.cmd == tuya_protocol.HEART_BEAT):#answer of a keep alive
+			return
+		
+		request = self.__queue.match(frame)
+		
+		if(request is None):
+			if(frame.cmd == tuya_protocol.STATUS and frame.dps is not None):#unsolicited push
+				self.stats.count("pushes")
+				self.__process_dps(frame.dps, SOURCE_PUSH)
+			return #otherwise late answer of a previous request
+		
+		if(not request[7]):	#the push of an acknowledged set is not another answer
+			self.__answered(request)
+		
+		if(frame.dps is not None):
+			self.__readable()
+		elif(frame.cmd == tuya_protocol.DP_QUERY or frame.retcode):
+			self.__unreadable()
+		
+		if(request[0] == RequestQueue.SET):
+			if(request[7]):
+				self.__set_pushes = True
+			if(frame.dps is None and not frame.retcode and self.__set_pushes is not False):
+				#acknowledged without dps: the new states may be pushed (cmd 8) before the deadline
+				self.__queue.wait_push(request)
+				return
+			#use the dps of the answer (or of a push) if they confirm the commands, otherwise ask the status
+			if(frame.dps is None or not self.__process_dps(frame.dps, SOURCE_PUSH if frame.cmd == tuya_protocol.STATUS else SOURCE_POLL)):
+				self.__queue.push(RequestQueue.STATUS, RequestQueue.SET)
+		
+		elif(frame.dps is None):
+			self.stats.count("decode_failures")
+			self.__scheduler.boost(self)
+		
+		else:
+			self.__process_dps(frame.dps)
+		
+		self.__pump(time.time())
+	
+	#######################################################################
+	#
+	# constructor
+	#
+	#######################################################################
+	def __init__(self, name, address, devID, localKey, scheduler, reconnect, coalesce=0, heartbeat=0, timeout=5, retries=2, recorder=None, gateway=None, history=None, version=3.1, versions=None):
+		self.name               = name					#name of the connection
+		self.__address          = address				#IP address of the smartplug
+		self.__devID            = devID					#devID of the smartplug
+		self.__localKey         = localKey				#localKey of the smartplug
+		self.__scheduler        = scheduler				#poll scheduler
+		self.__reconnect        = reconnect				#reconnect policy of the connection
+		self.__alive_since_connect = False				#True if a frame was received on the current connection
+		self.__encoder          = None          		#payload encoder of the smartplug
+		self.__connection       = None					#connection to the tuya plug
+		self.__decoder          = None					#frame decoder of the connection
+		self.__unit2dps_id_list = {}					#mapping between Unit and list of dps id
+		self.__plugs	        = {}					#mapping between dps id and a plug object
+		self.__reconciler       = Reconciler()			#desired and observed states of the plugs
+		self.__queue            = RequestQueue(timeout, retries)	#requests waiting or in flight
+		self.__coalesce         = coalesce				#coalescing window of the commands (seconds)
+		self.__pending_since    = None					#time of the first command not sent yet (None if no command)
+		self.__command_at       = None					#time of the first command not confirmed yet (None if no command)
+		self.__set_pushes       = None					#True if the device pushes the states after an acknowledged set (None: unknown)
+		self.__heartbeat        = heartbeat				#interval of the heartbeat frames (seconds, 0: no heartbeat, push mode otherwise)
+		self.__last_sent        = 0						#time of the last frame sent
+		self.__last_received    = 0						#time of the last data received
+		self.stats              = tuya_stats.DeviceStats(devID)	#performance counters
+		self.__recorder         = recorder				#tuya_capture.Recorder of the traffic (None: no capture)
+		self.__channel          = None					#channel of the device in the capture
+		self.__gateway          = gateway				#GatewayLink (None: direct connection to the device)
+		self.__online           = True					#gateway mode: False when the gateway reports the device as unreachable
+		self.__meter            = None					#EnergyMeter of the device (None: no metering dps)
+		self.__history          = history				#tuya_history.HistoryWriter of the transitions (None: no history)
+		self.__poll_at          = None					#time of the poll not sent yet (None: no poll waiting)
+		self.__version          = version				#protocol version of the requests
+		self.__versions         = versions				#tuya_protocol.VersionCache (None: version fixed by the configuration)
+		self.__unreadable_count = 0						#unreadable answers in a row
+		self.__readable_since_connect = False			#True if an answer was read on the current connection
+		return
+	
+	#######################################################################
+	#
+	# add_plug function
+	#		add a socket (dps_id) managed by the domoticz device unit
+	#
+	#######################################################################
+	def add_plug(self, dps_id, unit):
+		self.__unit2dps_id_list[unit] = [dps_id,]
+		self.__plugs[dps_id]          = Plug(dps_id, unit, self.__history)
+	
+	#######################################################################
+	#
+	# add_group function
+	#		add a group of sockets (dps_id_list) managed by the domoticz device unit
+	#
+	#######################################################################
+	def add_group(self, unit, dps_id_list):
+		self.__unit2dps_id_list[unit] = list(dps_id_list)
+	
+	#######################################################################
+	#
+	# add_meter function
+	#		the metering dps of the device feed meter (EnergyMeter)
+	#
+	#######################################################################
+	def add_meter(self, meter):
+		self.__meter = meter
+	
+	#######################################################################
+	#
+	# set_alwaysON function
+	#		force the socket dps_id to be always ON
+	#
+	#######################################################################
+	def set_alwaysON(self, dps_id):
+		self.__reconciler.set_always_on(dps_id)
+	
+	#######################################################################
+	#
+	# units function
+	#		returns the list of the domoticz units managed by the device
+	#
+	#######################################################################
+	def units(self):
+		return list(self.__unit2dps_id_list.keys()) + (self.__meter.units() if self.__meter is not None else [])
+	
+	#######################################################################
+	#
+	# command_to_execute function
+	#	send a command (set or status) to the tuya device
+	#
+	#######################################################################
+	def command_to_execute(self):
+		
+		self.__scheduler.reset(self)
+		if(self.__poll_at is None):
+			self.__poll_at = time.time()
+		
+		if(self.__reconciler.ready(time.time())):
+			self.__request(RequestQueue.SET)
+		else:
+			self.__request(RequestQueue.STATUS)
+	
+	#######################################################################
+	#
+	# start function
+	#		create the payload encoder and start the connection
+	#
+	#######################################################################
+	def start(self):
+		
+		#requests
+		self.__queue.clear()
+		
+		#gateway mode: no connection to the device
+		if(self.__gateway is not None):
+			self.__gateway.attach(self.__devID, self)
+			return
+		
+		#capture of the traffic
+		if(self.__recorder is not None):
+			self.__channel = self.__recorder.open_channel({"devId": self.__devID, "ip": self.__address, "version": self.__version}, time.time())
+
+		#start the connection
+		self.__connection = Domoticz.Connection(Name=self.name, Transport="TCP/IP", Address=self.__address, Port="6668")
+		self.__connect(time.time())
+	
+	#######################################################################
+	#
+	# stop function
+	#
+	#######################################################################
+	def stop(self):
+		self.__encoder          = None
+		self.__plugs	        = None
+		self.__unit2dps_id_list = None
+		self.__decoder          = None
+		if(self.__connection is not None and (self.__connection.Connected() or self.__connection.Connecting())):
+			self.__connection.Disconnect()
+		self.__connection       = None
+		self.__queue.clear()
+	
+	#######################################################################
+	#
+	# on_connect function
 	#
 	#######################################################################
-	def __init__(self,unit):
-		self.__dps_id   = unit		# dps id
-		self.__command  = None		# command ('On'/'Off'/None)
-		self.__alwaysON = False		# True if the socket should be always ON, False otherwise
-		return
+	def on_connect(self, Connection, Status, Description):
+		self.__last_received = time.time()
+		if (Status == 0):
+			Domoticz.Debug("Connected successfully to: "+Connection.Address+":"+Connection.Port)
+			self.stats.count("connects")
+			self.stats.connected = True
+			if(self.__encoder is None):
+				#create the payload encoder (status and set payloads are cached, the cipher is shared with the decoder)
+				#at the first connection: the crypto backend is not imported by onStart
+				self.__encoder = tuya_protocol.PayloadEncoder(self.__devID, self.__localKey.encode('latin1'), self.__version)
+				#incremental decoder of the received data
+				self.__decoder = tuya_protocol.FrameDecoder(self.__encoder.cipher)
+			self.__decoder.reset()
+			self.__queue.clear()
+			self.__readable_since_connect = False
+			self.__set_pushes = None	#learnt again on each connection
+			self.command_to_execute()
+		else:
+			Domoticz.Debug("OnConnect Error Status: " + str(Status))
+			self.stats.count("connect_errors")
+			if(self.__connection.Connected()):
+				self.__connection.Disconnect()
+			self.__failed(time.time()) #the next attempt is done by reconnect (heartbeat)
 	
 	#######################################################################
-	# update_state function
-	#		update the domoticz device 
-	#		and checks if the last command is equal to the current state
 	#
-	# parameters:
-	#		state: True <=> On ; False <=> Off
+	# on_disconnect function
+	#		a connection closed before any answer counts as a failure
+	#		(e.g. wrong local key or device busy with another client)
+	#		and before any readable answer as an unreadable answer
+	#		(e.g. 3.3 firmwares closing the connection on the requests of the other version)
 	#
-	# returns: 
-	#		True in case of an error (the state does not correspond to the command)
-	#		False otherwise
 	#######################################################################
-	def update_state(self,state): #state: True <=> On ; False <=> Off
-		
-		if(state):
-			UpdateDevice(self.__dps_id, 1, "On")
-			if(self.__command == 'Off'):
-				return True
-			else:
-				self.__command = None
-		
-		elif(self.__alwaysON): #if not state: need to change the state for always_on devices
-			self.__command = 'On'
-			return True
-			
-		else:
-			UpdateDevice(self.__dps_id, 0, "Off")
-			if(self.__command == 'On'):
-				return True
-			else:
-				self.__command = None
-
-		return False
+	def on_disconnect(self, Connection):
+		connected = self.stats.connected
+		self.stats.connected = False
+		self.__queue.clear() #the commands are still in the plugs, they are sent again after the connection
+		if(connected and not self.__readable_since_connect):
+			self.__unreadable()
+		if(not self.__alive_since_connect):
+			self.__failed(time.time())
+	
+	#######################################################################
+	#
+	# keep_alive function
+	#		push mode: called at each heartbeat, send a heartbeat frame when the connection is idle
+	#		(the device keeps the connection open and pushes its changes)
+	#		and close the connection when the device does not answer anymore
+	#
+	#######################################################################
+	def keep_alive(self, now):
+		if(self.__heartbeat <= 0 or self.__connection is None or not self.__connection.Connected()):
+			return
+		if(self.__last_sent > self.__last_received and now - self.__last_received > 3 * self.__heartbeat):
+			Domoticz.Debug(self.name + " does not answer the heartbeats: reconnecting")
+			self.__connection.Disconnect()
+			return
+		if(self.__queue.idle() and now - self.__last_sent >= self.__heartbeat):
+			self.__last_sent = now
+			self.stats.count("heartbeats")
+			self.__write(self.__encoder.heartbeat())
 	
 	#######################################################################
 	#
-	# set_command function
-	# 		set the command for the next request
+	# expire function
+	#		called at each heartbeat: retry the request in flight when its deadline is over,
+	#		after the last retry the connection is considered as broken and closed
 	#
 	#######################################################################
-	def set_command(self,cmd):
-		if(self.__alwaysON):
-			self.__command = 'On'
+	def expire(self, now):
+		request = self.__queue.expired(now)
+		if(request is None):
+			return
+		if(request[7]):
+			#acknowledged set without push: ask the status (at once for the next sets of the device)
+			self.__set_pushes = False
+			self.__queue.push(RequestQueue.STATUS, RequestQueue.SET)
+			self.__pump(now)
+			return
+		self.stats.count("timeouts")
+		if(request[4] < self.__queue.retries):
+			Domoticz.Debug(self.name + " request without answer: retry")
+			self.__send(request[0], now, request[4] + 1, request[6] + (request[2],))
 		else:
-			self.__command = cmd
+			Domoticz.Debug(self.name + " requests without answer: reconnecting")
+			self.__connection.Disconnect()	#unreadable answer in on_disconnect (devices ignoring the requests of the other version)
+			self.__queue.clear()
+			self.__scheduler.boost(self)
 	
 	#######################################################################
 	#
-	# set_alwaysON function
-	# 		set __alwaysON to True
+	# reconnect function
+	#		called at each heartbeat: reconnect when the backoff delay is over
+	#		(and at once in push mode, otherwise the next poll reconnects)
 	#
 	#######################################################################
-	def set_alwaysON(self):
-		self.__alwaysON = True
-		self.__command  = 'On'
+	def reconnect(self, now):
+		if(self.__connection is not None and (self.__heartbeat > 0 or self.__reconnect.failures > 0)):
+			self.__connect(now)
 	
 	#######################################################################
 	#
-	# put_payload function
-	#		add to dict_payload the command to be sent to the device
+	# on_message function
 	#
 	#######################################################################
-	def put_payload(self,dict_payload):
-		
-		if(self.__command == None):
+	def on_message(self, Connection, Data):
+		self.__last_received = time.time()
+		if(self.__recorder is not None):
+			self.__recorder.record(CAPTURE_IN, self.__channel, Data, self.__last_received)
+		for frame in self.__decoder.feed(Data):
+			self.__handle_frame(frame)
+	
+	#######################################################################
+	#
+	# on_gateway function
+	#		gateway mode: answer or event of the gateway for the device
+	#		(dict with the keys devId, dps, online and error, all optional)
+	#
+	#######################################################################
+	def on_gateway(self, message):
+		online = message.get("online", True)
+		self.stats.connected = online
+		self.stats.reachable = online
+		if(online != self.__online):
+			self.__online = online
+			if(online):
+				Domoticz.Log(self.name + " is reachable again")
+			else:
+				self.stats.count("circuit_opens")
+				Domoticz.Error(self.name + " unreachable (gateway)")
+			for unit in self.units():
+				TimeoutDevice(unit, 0 if online else 1)
+		if(message.get("error") is not None):
+			Domoticz.Debug(self.name + " gateway: " + str(message["error"]))
+		if(isinstance(message.get("dps"), dict) and len(message["dps"]) != 0):
+			self.stats.count("answers")
+			self.stats.last_answer = time.time()
+			self.__process_dps(message["dps"], SOURCE_PUSH if "event" in message else SOURCE_POLL)
+	
+	#######################################################################
+	#
+	# on_command function
+	#		Command: 'On' or 'Off'
+	#
+	#######################################################################
+	def on_command(self, Unit, Command):
+		if(Unit not in self.__unit2dps_id_list): #meter devices
 			return
+		for val in self.__unit2dps_id_list[Unit]:
+			self.__reconciler.command(val, Command == 'On') #last command wins
 		
-		if(self.__command =="On"):
-			dict_payload[str(self.__dps_id)] = True
-		else:
-			dict_payload[str(self.__dps_id)] = False
+		self.__scheduler.boost(self)
+		
+		now = time.time()
+		if(self.__pending_since is None):
+			self.__pending_since = now
+		if(self.__command_at is None):
+			self.__command_at = now
+		self.flush(now)
+	
+	#######################################################################
+	#
+	# restore function
+	#		last known states of the plugs (dps id (str) -> state, e.g. from a snapshot)
+	#
+	#######################################################################
+	def restore(self, dps):
+		self.__reconciler.observe(dps)
+		for key in self.__plugs:
+			if(str(key) in dps):
+				self.__plugs[key].restore(dps[str(key)])
+	
+	#######################################################################
+	#
+	# states function
+	#		returns the last known states of the plugs (dps id (str) -> state)
+	#
+	#######################################################################
+	def states(self):
+		return self.__reconciler.observed()
+	
+	#######################################################################
+	#
+	# get_stats function
+	#		returns the DeviceStats of the device
+	#
+	#######################################################################
+	def get_stats(self):
+		if(self.__decoder is not None):
+			self.stats.counters["crc_errors"] = self.__decoder.crc_errors
+		return self.stats
+	
+	#######################################################################
+	#
+	# publish_meter function
+	#		called at each heartbeat: write the aggregated metering values when their period is over
+	#
+	#######################################################################
+	def publish_meter(self, now):
+		if(self.__meter is not None):
+			self.__meter.publish(now)
+	
+	#######################################################################
+	#
+	# flush function
+	#		send the pending commands in one set request
+	#		when the coalescing window is over and no answer is expected
+	#		(otherwise the commands are merged with the next ones and sent
+	#		 at a next heartbeat or after the answer)
+	#
+	#######################################################################
+	def flush(self, now):
+		if(self.__pending_since is None or not self.__queue.idle()):
+			return
+		if(now - self.__pending_since < self.__coalesce):
+			return
+		self.command_to_execute()
 
 ########################################################################################
 	
@@ -173,110 +1670,459 @@ class BasePlugin:
 	# constant definition
 	#
 	#######################################################################
-	__HB_BASE_FREQ = 2			  #heartbeat frequency (val x 10 seconds)
+	__HEARTBEAT    = 2			  #heartbeat frequency (seconds)
+	__POLL_MIN     = 2			  #default min interval between two status requests (seconds)
+	__POLL_MAX     = 60			  #default max interval between two status requests (seconds)
+	__POLL_PUSH    = 300		  #default max interval between two status requests in push mode (seconds)
+	__PUSH_PERIOD  = 10			  #default interval of the heartbeat frames in push mode (seconds)
+	__COALESCE     = 0			  #default coalescing window of the commands (seconds)
+	__BACKOFF_MIN  = 2			  #default delay before the first reconnection (seconds)
+	__BACKOFF_MAX  = 120		  #default max delay between two connection attempts (seconds)
+	__BREAKER      = 5			  #default number of failed attempts before the units are TimedOut (0: never)
+	__TIMEOUT      = 5			  #default deadline of a request (seconds)
+	__RETRIES      = 2			  #default number of retries of a request without answer
+	__STATS_FILE   = "tuya_stats.json" #default file of the performance counters (in the plugin folder)
+	__SNAPSHOT     = "tuya_snapshot_%s.json" #snapshot of the topology and of the states (in the plugin folder, per hardware)
+	__SNAPSHOT_PERIOD = 300		  #min interval between two writes of the snapshot (seconds)
+	__CAPTURE_MAX  = 64			  #default max size of the capture file (MB)
+	__HISTORY      = "tuya_history_%s.bin" #history of the transitions of the sockets (in the plugin folder, per devID)
+	__METRICS_ADDRESS = "127.0.0.1" #default address of the metrics exporter
+	__PROFILE      = 300		  #default period of the profiling summaries (seconds, Debug "All")
+	__ENERGY_SCALE = "1000;10;10" #default divisors of the current (mA), power (dW) and voltage (dV) dps
+	__ENERGY_PERIOD = 60		  #default interval between two writes of the metering devices (seconds)
 	__VALID_CMD    = ('On','Off') #list of valid command
+	__MAX_UNIT     = 255		  #domoticz limit
 
 	#######################################################################
 	#
 	# private functions definition
-	#	__extract_status
-	#	__is_encoded
-	#	__command_to_execute
+	#	__parameters_key
+	#	__load_inventory
+	#	__plan_device
+	#	__allocate_units
+	#	__add_device
+	#	__read_snapshot
+	#	__write_snapshot
+	#	__heartbeats
+	#	__seconds
+	#	__create_switch
+	#	__create_meter
+	#	__create_stats_device
+	#	__publish_stats
 	#
 	#######################################################################
 	
 	
 	#######################################################################
 	#
-	# __extract_status
+	# __parameters_key
+	#
+	# Returns a tuple (key, inventory):
+	#	key:       hash of the hardware parameters (and of the inventory file)
+	#	inventory: content of the inventory file (multi device mode, None otherwise)
+	#
+	#######################################################################
+	def __parameters_key(self):
+		
+		inventory = None
+		if(self.__multi):
+			try:
+				with open(Parameters["Address"], "rb") as f:
+					inventory = f.read()
+			except OSError as e:
+				Domoticz.Error("Cannot read the inventory " + Parameters["Address"] + ": " + str(e))
+				inventory = b''
+		
+		key = md5(json.dumps([Parameters.get(name) for name in ("Address", "Mode1", "Mode2", "Mode3", "Mode4", "Mode5", "Username")]).encode('utf-8'))
+		if(inventory is not None):
+			key.update(inventory)
+		return (key.hexdigest(), inventory)
+	
+	#######################################################################
+	#
+	# __load_inventory
 	#
 	# Parameter
-	#	Data: a received payload from the tuya smart plug
+	#	inventory: content of the inventory file (multi device mode)
 	#
-	# Returns a tuple (bool,dict)
-	#	first:  set to True if an error occur and False otherwise
-	#	second: dict of the dps (irrelevant if first is True )
+	# Returns the list of the device configurations:
+	#	single device mode: built from the hardware parameters
+	#	multi device mode (Address is a .json file): read from the inventory file
+	#	
+	#	a configuration is a dict with the keys:
+	#		name, ip, devId, localKey, dps, groups (default: None), alwaysOn (default: None)
+	#		and the options (default: value of the Options parameter)
+	#	dps, groups and alwaysOn use the syntax of the hardware parameters
 	#
 	#######################################################################
-	def __extract_status(self, Data):
-
-		start=Data.find(b'{"devId')
+	def __load_inventory(self, inventory):
 		
-		if(start==-1):
-			return (True,"")
-			
-		result = Data[start:] #in 2 steps to deal with the case where '}}' is present before {"devId'
-			
-		end=result.find(b'}}')
+		if(not self.__multi):
+			config = {"name":     "Tuya SmartPlug",
+					  "ip":       Parameters["Address"],
+					  "devId":    Parameters["Mode1"],
+					  "localKey": Parameters["Mode2"],
+					  "dps":      Parameters["Mode3"],
+					  "groups":   Parameters["Mode4"],
+					  "alwaysOn": Parameters["Mode5"]}
+			config.update(self.__options)
+			return [config]
+		
+		try:
+			inventory = json.loads(inventory.decode('utf-8'))
+		except ValueError as e:
+			Domoticz.Error("Cannot read the inventory " + Parameters["Address"] + ": " + str(e))
+			return []
 		
-		if(end==-1):
-			return (True,"")
+		result = []
+		for config in inventory:
+			if(not all(key in config for key in ("ip", "devId", "localKey", "dps"))):
+				Domoticz.Error("Invalid inventory entry (ip, devId, localKey and dps are required): " + str(config))
+				continue
+			if(not all(isinstance(config.get(key, "None"), str) for key in ("dps", "groups", "alwaysOn"))):
+				Domoticz.Error("Invalid inventory entry (dps, groups and alwaysOn are strings eg. \"1;2\"): " + str(config))
+				continue
+			config.setdefault("name", "Tuya " + config["ip"])
+			config.setdefault("groups", "None")
+			config.setdefault("alwaysOn", "None")
+			for (key, value) in self.__options.items():
+				config.setdefault(key, value)
+			result.append(config)
+		
+		return result
+	
+	#######################################################################
+	#
+	# __plan_device
+	#
+	# Parameters
+	#	config:  a device configuration (see __load_inventory)
+	#	devices: set of the devID already planned
+	#
+	# Returns the topology of the device (None if invalid): a dict with the keys
+	#	config, dps (list of dps id), groups (list of dps id lists), alwaysOn (list of dps id)
+	#	and units (units of the sockets then of the groups):
+	#	single device mode: unit = dps id for the sockets and next units for the groups
+	#	multi device mode:  the units of a devID are kept (see __allocate_units)
+	#
+	#######################################################################
+	def __plan_device(self, config, devices):
+		
+		if(config["devId"] in devices):
+			Domoticz.Error("Duplicated devId in the inventory: " + config["devId"])
+			return None
 		
-		end=end+2
-		result = result[:end]
-		if not isinstance(result, str):
-			result = result.decode()
-			
 		try:
-			result = json.loads(result)
-			return (False,result['dps'])
-		except (JSONError, KeyError) as e:
-			return (True,"")
-
-
+			dps_list = parse_dps_list(config["dps"])
+			groups   = parse_dps_groups(config["groups"])
+			always   = parse_dps_list(config["alwaysOn"])
+		except ValueError:
+			Domoticz.Error("Invalid DPS, DPS group or DPS always ON (expected dps id separated by ';'): " + config["name"] + " is skipped")
+			return None
+		if(len(dps_list) == 0):
+			Domoticz.Error("Empty DPS (at least one dps id is required): " + config["name"] + " is skipped")
+			return None
+		energy   = parse_energy(config.get("energy", "None"))
+		if(energy is None):
+			Domoticz.Error("Invalid energy option (expected current;power;voltage dps eg. 18;19;20): " + config["name"] + " has no meter")
+			energy = []
+		
+		if(self.__multi):
+			roles = unit_roles(dps_list, groups, energy)
+			units = self.__allocate_units(config["devId"], roles)
+		else:
+			units = dps_list + list(range(max(dps_list) + 1, max(dps_list) + 1 + len(groups) + len(energy)))
+		
+		if(units is None or (len(units) != 0 and max(units) > self.__MAX_UNIT)):
+			Domoticz.Error("Too many units: " + config["name"] + " is skipped")
+			return None
+		
+		if(self.__multi):
+			self.__unit_map[config["devId"]] = dict(self.__unit_map.get(config["devId"], {}), **dict(zip(roles, units)))
+		devices.add(config["devId"])
+		
+		return {"config": config, "dps": dps_list, "groups": groups, "alwaysOn": always, "energy": energy, "units": units}
+	
 	#######################################################################
 	#
-	# __is_encoded
+	# __allocate_units
+	#
+	# Parameters
+	#	devID: devID of the device
+	#	roles: the roles of its units ("dps:1", "group:1;2", "meter:0"...)
+	#
+	# Returns the units of the roles (None if there is no free unit):
+	#	the units of the roles already known for devID (snapshot) are kept so that inserting,
+	#	removing or extending an inventory entry (e.g. energy) does not move the units of the
+	#	other devices, the new roles get the lowest free units (never used by another devID).
+	#	Without unit map (first start), the units are allocated in the inventory order.
+	#
+	#######################################################################
+	def __allocate_units(self, devID, roles):
+		
+		if(not self.__unit_map_known):
+			units = list(range(self.__next_unit, self.__next_unit + len(roles)))
+			self.__next_unit += len(roles)
+			return units
+		
+		known    = self.__unit_map.get(devID, {})
+		reserved = set(Devices)
+		for mapped in self.__unit_map.values():
+			reserved.update(mapped.values())
+		units = []
+		for role in roles:
+			unit = known.get(role)
+			if(unit is None):
+				unit = next((candidate for candidate in range(1, self.__MAX_UNIT + 1) if candidate not in reserved), None)
+				if(unit is None):
+					return None
+			reserved.add(unit)
+			units.append(unit)
+		return units
+	
+	#######################################################################
+	#
+	# __add_device
 	#
 	# Parameter
-	#	Data: a received payload from the tuya smart plug
+	#	topology: a device topology (see __plan_device)
 	#
-	# Returns 
-	#	True if Data is encoded
-	#	False otherwise
+	# create the TuyaDevice and its domoticz devices
 	#
-	# Remark: for debugging purpose
+	#######################################################################
+	def __add_device(self, topology):
+		
+		config   = topology["config"]
+		dps_list = topology["dps"]
+		groups   = topology["groups"]
+		units    = topology["units"]
+		
+		reconnect = ReconnectPolicy(self.__seconds(config, "backoff_min", self.__BACKOFF_MIN), self.__seconds(config, "backoff_max", self.__BACKOFF_MAX), int(self.__seconds(config, "breaker", self.__BREAKER)))
+		heartbeat = self.__seconds(config, "heartbeat", self.__PUSH_PERIOD) if self.__seconds(config, "push", 0) > 0 and self.__gateway is None else 0
+		
+		#history of the transitions (see tuya_history.py)
+		history   = None
+		if(self.__seconds(config, "history", 0) > 0):
+			import tuya_history		#imported only when used (mmap, argparse)
+			if(not all(0 <= dps <= tuya_history.MAX_DPS for dps in dps_list)):
+				Domoticz.Error("The history records the dps 0 to " + str(tuya_history.MAX_DPS) + ": " + config["name"] + " has no history")
+			else:
+				path = os.path.join(Parameters.get("HomeFolder", ""), self.__HISTORY % config["devId"])
+				try:
+					history = tuya_history.HistoryWriter(path)
+					self.__histories.append(history)
+				except OSError as e:
+					Domoticz.Error("Cannot open the history file " + path + ": " + str(e))
+		
+		#protocol version: fixed by the inventory (or the option version), negotiated otherwise (cached per devId)
+		version   = self.__versions.get(config["devId"], tuya_protocol.VERSIONS[0])
+		versions  = self.__versions
+		if(config.get("version") is not None):
+			try:
+				(version, versions) = (float(config["version"]), None)
+				if(version not in tuya_protocol.VERSIONS):
+					raise ValueError(str(version))
+			except ValueError:
+				Domoticz.Error("Invalid version " + str(config["version"]) + " (expected 3.1 or 3.3): " + config["name"] + " negotiates it")
+				(version, versions) = (self.__versions.get(config["devId"], tuya_protocol.VERSIONS[0]), self.__versions)
+		
+		device    = TuyaDevice("Tuya " + config["devId"], config["ip"], config["devId"], config["localKey"], self.__scheduler, reconnect, self.__seconds(config, "coalesce", self.__COALESCE), heartbeat,
+							self.__seconds(config, "timeout", self.__TIMEOUT), int(self.__seconds(config, "retries", self.__RETRIES)), self.__recorder, self.__gateway, history, version, versions)
+		
+		#build internal maps
+		for (dps, unit) in zip(dps_list, units):
+			device.add_plug(dps, unit)
+			self.__create_switch(unit, config, "#" + str(dps if self.__multi else unit), False)
+		
+		for (group, unit) in zip(groups, units[len(dps_list):]):
+			device.add_group(unit, group)
+			self.__create_switch(unit, config, ("group #" if self.__multi else "#") + str(unit), True)
+		
+		#manage always on
+		for val in topology["alwaysOn"]:
+			device.set_alwaysON(val)
+		
+		#metering dps: kWh, voltage and current devices
+		energy = topology.get("energy", [])
+		if(len(energy) != 0):
+			meter_units = units[len(dps_list) + len(groups):]
+			scales      = parse_energy(config.get("energy_scale", self.__ENERGY_SCALE)) or parse_energy(self.__ENERGY_SCALE)
+			meter       = EnergyMeter(energy, meter_units, [scale or 1 for scale in scales], self.__seconds(config, "energy_period", self.__ENERGY_PERIOD))
+			self.__create_meter(meter_units, config)
+			if(meter_units[0] in Devices):	#cumulative energy of the previous run
+				try:
+					meter.restore(float(Devices[meter_units[0]].sValue.split(";")[1]))
+				except (ValueError, IndexError):
+					pass
+			device.add_meter(meter)
+		
+		for unit in units:
+			self.__units[unit] = device
+		self.__stats_units[device] = self.__MAX_UNIT - len(self.__devices)
+		self.__devices[config["devId"]] = device
+		self.__connections[device.name] = device
+		#push and gateway modes: the polling is only a safety net
+		self.__scheduler.add(device, self.__heartbeats(config, "poll_min", self.__POLL_MIN), self.__heartbeats(config, "poll_max", self.__POLL_PUSH if heartbeat > 0 or self.__gateway is not None else self.__POLL_MAX))
+	
+	#######################################################################
+	#
+	# __read_snapshot
+	#
+	# Returns the snapshot written by the last run (empty dict if none):
+	#	key:     hash of the parameters (see __parameters_key)
+	#	devices: list of the device topologies (see __plan_device)
+	#	states:  mapping between devID and the last known states of its plugs
+	#	units:   mapping between devID and the units of its roles (multi device mode, see __allocate_units)
 	#
 	#######################################################################
-	#~ def __is_encoded(self, Data):
-
-		#~ tmp = Data[20:-8]  # hard coded offsets
-		#~ if(tmp.startswith(b'3.1')):#PROTOCOL_VERSION_BYTES
-			#~ return True
-		#~ else:
-			#~ return False
-			
+	def __read_snapshot(self):
+		try:
+			with open(self.__snapshot_file) as f:
+				snapshot = json.load(f)
+		except (OSError, ValueError) as e:
+			return {}
+		return snapshot if isinstance(snapshot, dict) else {}
+	
 	#######################################################################
 	#
-	# __command_to_execute
-	#	send a command (set or status) to the tuya device
+	# __write_snapshot
 	#
+	# write the topology, the unit map and the last known states (when they changed or if force)
 	#
 	#######################################################################
-	def __command_to_execute(self):
+	def __write_snapshot(self, force=False):
 		
-		self.__runAgain = self.__HB_BASE_FREQ
-				
-		if(self.__connection.Connected()):
-					
-			dict_payload = {}
-			
-			for key in self.__plugs:
-				self.__plugs[key].put_payload(dict_payload)
-			
-			if(len(dict_payload) != 0):
-				self.__state_machine = 1
-				payload = self.__device.generate_payload('set', dict_payload)
-				self.__connection.Send(payload)
-			
-			else:
-				self.__state_machine = 2
-				payload=self.__device.generate_payload('status')
-				self.__connection.Send(payload)	
+		states = dict((devID, device.states()) for (devID, device) in self.__devices.items())
+		if(states == self.__snapshot_states and not force):
+			return
+		
+		try:
+			with open(self.__snapshot_file + ".tmp", "w") as f:
+				json.dump({"key": self.__snapshot_key, "devices": self.__topology, "states": states, "units": self.__unit_map}, f)
+			os.replace(self.__snapshot_file + ".tmp", self.__snapshot_file)
+			self.__snapshot_states = states
+		except OSError as e:
+			Domoticz.Error("Cannot write " + self.__snapshot_file + ": " + str(e))
+	
+	#######################################################################
+	#
+	# __heartbeats
+	#
+	# returns the option name of config (in seconds, default if absent)
+	#	converted in a number of heartbeats (at least 1)
+	#
+	#######################################################################
+	def __heartbeats(self, config, name, default):
+		return max(1, int(round(self.__seconds(config, name, default) / self.__HEARTBEAT)))
+	
+	#######################################################################
+	#
+	# __seconds
+	#
+	# returns the option name of config (in seconds, default if absent)
+	#
+	#######################################################################
+	def __seconds(self, config, name, default):
+		try:
+			return float(config.get(name, default))
+		except (TypeError, ValueError):
+			Domoticz.Error("Invalid value for " + name + ": " + str(config[name]))
+			return default
+	
+	#######################################################################
+	#
+	# __create_switch
+	#
+	# create the domoticz device Unit if needed
+	#	single device mode: only when there is no device at all
+	#	multi device mode:  when Unit does not exist (new inventory entries)
+	#
+	#######################################################################
+	def __create_switch(self, Unit, config, suffix, group):
+		
+		if(Unit in Devices or (not self.__multi and not self.__create_all)):
+			return
+		
+		if(self.__multi):
+			name = config["name"] + " " + suffix
+		else:
+			name = "Tuya SmartPlug " + suffix
+		
+		if(not group): #single socket dps
+			Domoticz.Device(Name=name, Unit=Unit, TypeName="Switch").Create()
 			
+		else: #group: selector switch
+			Options = {"LevelActions": "|",
+				"LevelNames": "Off|On",
+				"LevelOffHidden": "false",
+				"SelectorStyle": "0"}
+			Domoticz.Device(Name=name, Unit=Unit, TypeName="Selector Switch", Options=Options).Create()
+		
+		Domoticz.Log(name + " device (unit " + str(Unit) + ") created.")
+	
+	#######################################################################
+	#
+	# __create_meter
+	#
+	# create the kWh, voltage and current devices (Units) of a metering device if needed
+	#	in both modes: the energy option may be added once the switches exist
+	#
+	#######################################################################
+	def __create_meter(self, Units, config):
+		
+		if(self.__multi):
+			prefix = config["name"] + " "
 		else:
-			if(not self.__connection.Connecting()):
-				self.__connection.Connect()	
+			prefix = "Tuya SmartPlug "
+		
+		for (Unit, suffix, type_name) in zip(Units, ("power", "voltage", "current"), ("kWh", "Voltage", "Current (Single)")):
+			if(Unit in Devices):
+				continue
+			Domoticz.Device(Name=prefix + suffix, Unit=Unit, TypeName=type_name).Create()
+			Domoticz.Log(prefix + suffix + " device (unit " + str(Unit) + ") created.")
+	
+	#######################################################################
+	#
+	# __create_stats_device
+	#
+	# create the text device Unit showing the performance counters of device if needed
+	#	(units are allocated from 255 downwards)
+	#
+	#######################################################################
+	def __create_stats_device(self, Unit, device):
+		
+		if(Unit in self.__units):
+			Domoticz.Error("Unit " + str(Unit) + " already used: no performance device for " + device.name)
+			return False
+		
+		if(Unit not in Devices):
+			Domoticz.Device(Name=device.name + " stats", Unit=Unit, TypeName="Text").Create()
+			Domoticz.Log(device.name + " stats device (unit " + str(Unit) + ") created.")
+		
+		return True
+	
+	#######################################################################
+	#
+	# __publish_stats
+	#
+	# write the performance counters in the text devices and in the json file
+	#
+	#######################################################################
+	def __publish_stats(self, now):
+		
+		result = {}
+		for (devID, device) in self.__devices.items():
+			stats = device.get_stats()
+			result[devID] = stats.to_dict()
+			if(self.__stats_units.get(device) is not None):
+				UpdateDevice(self.__stats_units[device], 0, stats.summary())
+		
+		try:
+			with open(self.__stats_file + ".tmp", "w") as f:
+				json.dump({"time": now, "devices": result}, f, indent=1)
+			os.replace(self.__stats_file + ".tmp", self.__stats_file)
+		except OSError as e:
+			Domoticz.Error("Cannot write " + self.__stats_file + ": " + str(e))
 	
 	#######################################################################
 	#
@@ -284,15 +2130,30 @@ class BasePlugin:
 	#
 	#######################################################################
 	def __init__(self):
-		self.__address          = None          		#IP address of the smartplug
-		self.__devID            = None          		#devID of the smartplug
-		self.__localKey         = None          		#localKey of the smartplug
-		self.__device           = None          		#pytuya object of the smartplug
-		self.__runAgain         = self.__HB_BASE_FREQ	#heartbeat frequency
-		self.__connection       = None					#connection to the tuya plug
-		self.__unit2dps_id_list = None					#mapping between Unit and list of dps id
-		self.__plugs	        = None					#mapping between dps id and a plug object
-		self.__state_machine    = 0						#state_machine: 0 -> no waiting msg ; 1 -> set command sent ; 2 -> status command sent
+		self.__multi            = False					#True in multi device mode (inventory file)
+		self.__create_all       = False					#True if the domoticz devices have to be created
+		self.__next_unit        = 1						#next free unit (multi device mode, first start)
+		self.__unit_map         = {}					#devID -> role -> unit (multi device mode, see __allocate_units)
+		self.__unit_map_known   = False					#True if the unit map was read from the snapshot
+		self.__options          = None					#options (name=value, ...) of the hardware
+		self.__scheduler        = None					#poll scheduler
+		self.__devices          = None					#mapping between devID and a TuyaDevice object
+		self.__connections      = None					#mapping between connection name and a TuyaDevice object
+		self.__units            = None					#mapping between Unit and a TuyaDevice object
+		self.__stats_units      = None					#mapping between a TuyaDevice object and the Unit of its stats device
+		self.__stats_period     = 0						#period of the performance counters publication (seconds, 0: disabled)
+		self.__stats_file       = None					#json file of the performance counters
+		self.__stats_next       = 0						#time of the next publication
+		self.__snapshot_file    = None					#snapshot of the topology and of the states
+		self.__snapshot_key     = None					#hash of the parameters
+		self.__snapshot_states  = None					#states written in the snapshot
+		self.__snapshot_next    = 0						#time of the next snapshot write
+		self.__topology         = None					#list of the device topologies
+		self.__recorder         = None					#tuya_capture.Recorder (capture option)
+		self.__gateway          = None					#GatewayLink (gateway option)
+		self.__histories        = []					#tuya_history.HistoryWriter of the devices (history option)
+		self.__metrics          = None					#tuya_metrics.MetricsExporter (metrics option)
+		self.__versions         = None					#tuya_protocol.VersionCache of the negotiated protocol versions
 		return
 		
 	#######################################################################
@@ -302,74 +2163,120 @@ class BasePlugin:
 	#######################################################################
 	def onStart(self):
 		
+		global _debug, _keepalive, _profiler
+		
 		# Debug mode
 		Domoticz.Debugging(int(Parameters["Mode6"]))
 		Domoticz.Debug("onStart called")
-			
-		#get parameters
-		self.__address  = Parameters["Address"]
-		self.__devID    = Parameters["Mode1"]
-		self.__localKey = Parameters["Mode2"]
-		
-		#set the next heartbeat
-		self.__runAgain = self.__HB_BASE_FREQ
-		
-		#build internal maps (__unit2dps_id_list and __plugs)
-		self.__unit2dps_id_list = {}
-		self.__plugs            = {}
-		max_unit                = 0
-		max_dps					= 0
-		for val in sorted(Parameters["Mode3"].split(";")):
-			
-			self.__unit2dps_id_list[int(val)]=[int(val),]
-			
-			self.__plugs[int(val)]=Plug(int(val))
-			
-			if(int(val)>max_unit):
-				max_unit=int(val)
-	
-		max_dps = max_unit
-		
-		#groups management: #syntax: 1;2 : 3;4
-		max_unit = max_unit + 1
-		if(Parameters["Mode4"]!="None"):
-			groups = Parameters["Mode4"].split(":")
-			for group in groups:
-				self.__unit2dps_id_list[max_unit]=[]
-				for val in sorted(group.split(";")):
-					self.__unit2dps_id_list[max_unit].append(int(val))
-				max_unit = max_unit + 1
-				
-		#create domoticz devices			
-		if(len(Devices) == 0):
-			for val in self.__unit2dps_id_list:
-				
-				if(val <= max_dps): #single socket dps
-					Domoticz.Device(Name="Tuya SmartPlug #" + str(val), Unit=val, TypeName="Switch").Create()
-					Domoticz.Log("Tuya SmartPlug Device #" + str(val) +" created.")
-					
-				else: #group: selector switch
-					Options = {"LevelActions": "|",
-						"LevelNames": "Off|On",
-						"LevelOffHidden": "false",
-						"SelectorStyle": "0"}
-					Domoticz.Device(Name="Tuya SmartPlug #" + str(val), Unit=val, TypeName="Selector Switch", Options=Options).Create()
-					Domoticz.Log("Tuya SmartPlug Device #" + str(val) +" created.")
+		_debug = (int(Parameters["Mode6"]) & 3) != 0 #1: all ; 2: plugin debug messages
 		
-		#manage always on
-		if(Parameters["Mode5"]!="None"):
-			for val in sorted(Parameters["Mode5"].split(";")):
-				self.__plugs[int(val)].set_alwaysON()
+		self.__multi       = Parameters["Address"].endswith(".json")
+		self.__create_all  = (len(Devices) == 0)
+		self.__next_unit   = 1
+		self.__options     = parse_options(Parameters["Username"])
+		_keepalive         = self.__seconds(self.__options, "keepalive", 0)
+		_shadow.clear()
+		self.__scheduler   = PollScheduler()
 		
-		#create the pytuya object
-		self.__device = pytuya.OutletDevice(self.__devID, self.__address, self.__localKey)
-
-		#state machine
-		self.__state_machine = 0
-
-		#start the connection
-		self.__connection = Domoticz.Connection(Name="Tuya", Transport="TCP/IP", Address=self.__address, Port="6668")
-		self.__connection.Connect()
+		#profiling of the callbacks: option profile=period or Debug "All"
+		if(_profiler is not None):
+			_profiler.close()
+			_profiler      = None
+		period = self.__seconds(self.__options, "profile", self.__PROFILE if int(Parameters["Mode6"]) == 1 else 0)
+		if(period > 0):
+			_profiler = tuya_stats.CallbackProfiler(period, self.__seconds(self.__options, "profile_cpu", 0), self.__seconds(self.__options, "profile_mem", 0) > 0, time.time())
+			Domoticz.Log("Profiling of the callbacks enabled (summary every " + str(period) + " s)")
+		
+		Domoticz.Heartbeat(self.__HEARTBEAT)
+		self.__devices     = {}
+		self.__connections = {}
+		self.__units       = {}
+		self.__stats_units = {}
+		
+		#capture of the traffic
+		self.__recorder = None
+		if(self.__options.get("capture", "") != ""):
+			path = os.path.join(Parameters.get("HomeFolder", ""), self.__options["capture"])
+			import tuya_capture		#imported only when used (mmap)
+			try:
+				self.__recorder = tuya_capture.Recorder(path, int(self.__seconds(self.__options, "capture_max", self.__CAPTURE_MAX) * 1024 * 1024))
+				Domoticz.Log("Traffic captured in " + path)
+			except OSError as e:
+				Domoticz.Error("Cannot open the capture file " + path + ": " + str(e))
+		
+		self.__histories = []
+		self.__versions  = tuya_protocol.VersionCache(os.path.join(Parameters.get("HomeFolder", ""), tuya_protocol.VERSION_CACHE))
+		
+		#gateway mode: the connections to the devices are owned by tuya_gateway.py
+		self.__gateway = None
+		if(self.__options.get("gateway", "") != ""):
+			try:
+				(address, port) = self.__options["gateway"].rsplit(":", 1)
+				self.__gateway  = GatewayLink(address, int(port), ReconnectPolicy(self.__seconds(self.__options, "backoff_min", self.__BACKOFF_MIN), self.__seconds(self.__options, "backoff_max", self.__BACKOFF_MAX), int(self.__seconds(self.__options, "breaker", self.__BREAKER))))
+				self.__connections[self.__gateway.name] = self.__gateway
+				Domoticz.Log("Devices reached through the gateway " + self.__options["gateway"])
+			except ValueError:
+				Domoticz.Error("Invalid gateway option " + self.__options["gateway"] + " (expected host:port): direct connections")
+		
+		#topology: from the snapshot if the parameters did not change
+		self.__snapshot_file = os.path.join(Parameters.get("HomeFolder", ""), self.__SNAPSHOT % Parameters.get("HardwareID", 0))
+		(self.__snapshot_key, inventory) = self.__parameters_key()
+		snapshot = self.__read_snapshot()
+		units    = snapshot.get("units")
+		self.__unit_map_known = isinstance(units, dict) and all(isinstance(mapped, dict) for mapped in units.values())
+		self.__unit_map       = units if self.__unit_map_known else {}
+		mapped   = json.dumps(self.__unit_map, sort_keys=True)
+		if(snapshot.get("key") == self.__snapshot_key):
+			Domoticz.Debug("Topology restored from " + self.__snapshot_file)
+			self.__topology = snapshot["devices"]
+		else:
+			planned = set()
+			self.__topology = [topology for topology in (self.__plan_device(config, planned) for config in self.__load_inventory(inventory)) if topology is not None]
+		
+		#units of the devices kept for the next inventories (snapshots written before the unit map)
+		if(self.__multi):
+			for topology in self.__topology:
+				roles = unit_roles(topology["dps"], topology["groups"], topology.get("energy", []))
+				self.__unit_map.setdefault(topology["config"]["devId"], {}).update(zip(roles, topology["units"]))
+		
+		for topology in self.__topology:
+			self.__add_device(topology)
+		
+		#warm state: last known states of the plugs
+		self.__snapshot_states = snapshot.get("states", {})
+		for (devID, states) in self.__snapshot_states.items():
+			if(devID in self.__devices):
+				self.__devices[devID].restore(states)
+		self.__snapshot_next = time.time() + self.__SNAPSHOT_PERIOD
+		if(json.dumps(self.__unit_map, sort_keys=True) != mapped):
+			self.__write_snapshot(True)		#unit map of the new devices
+		
+		#performance counters publication
+		self.__stats_period = self.__seconds(self.__options, "stats", 0)
+		self.__stats_file   = self.__options.get("stats_file", os.path.join(Parameters.get("HomeFolder", ""), self.__STATS_FILE))
+		self.__stats_next   = time.time() + self.__stats_period
+		for device in list(self.__stats_units):
+			if(self.__stats_period <= 0 or not self.__create_stats_device(self.__stats_units[device], device)):
+				self.__stats_units[device] = None
+		
+		#metrics exporter: HTTP server thread reading the performance counters
+		self.__metrics = None
+		if(self.__options.get("metrics", "") != ""):
+			(address, separator, port) = self.__options["metrics"].rpartition(":")
+			try:
+				import tuya_metrics		#imported only when used (http.server)
+				self.__metrics = tuya_metrics.MetricsExporter(address or self.__METRICS_ADDRESS, int(port))
+				self.__metrics.devices = [device.stats for device in self.__devices.values()]
+				self.__metrics.start()
+				Domoticz.Log("Metrics served on http://" + self.__metrics.address + ":" + str(self.__metrics.port) + "/metrics")
+			except (ValueError, OSError) as e:
+				Domoticz.Error("Cannot start the metrics exporter " + self.__options["metrics"] + ": " + str(e))
+				self.__metrics = None
+		
+		for device in self.__devices.values():
+			device.start()
+		if(self.__gateway is not None):
+			self.__gateway.start()
 
 	#######################################################################
 	#		
@@ -377,20 +2284,8 @@ class BasePlugin:
 	#
 	#######################################################################
 	def onConnect(self, Connection, Status, Description):
-		if (Connection == self.__connection):
-			if (Status == 0):
-				Domoticz.Debug("Connected successfully to: "+Connection.Address+":"+Connection.Port)
-				self.__command_to_execute()
-			else:
-				Domoticz.Debug("OnConnect Error Status: " + str(Status))
-				if(Status==113):#no route to host error (skip to avoid intempestive connect call)
-					return
-				if(self.__connection.Connected()):
-					self.__connection.Disconnect()
-				if(not self.__connection.Connecting()):
-					self.__connection.Connect()
-				
-
+		if (Connection.Name in self.__connections):
+			self.__connections[Connection.Name].on_connect(Connection, Status, Description)
 
 	#######################################################################
 	#		
@@ -398,33 +2293,11 @@ class BasePlugin:
 	#
 	#######################################################################
 	def onMessage(self, Connection, Data):
-		Domoticz.Debug("onMessage called: " + Connection.Address + ":" + Connection.Port +" "+ str(Data))
+		if(_debug):
+			Domoticz.Debug("onMessage called: " + Connection.Address + ":" + Connection.Port +" "+ str(Data))
 		
-		if (Connection == self.__connection):
-			
-			if(self.__state_machine == 0):#skip nothing was waiting
-				return
-			
-			if(self.__state_machine == 1):#after a set command: need to ask the status
-				self.__state_machine = 2
-				payload=self.__device.generate_payload('status')
-				self.__connection.Send(payload)#TODO active connection check (it should be because we just get a message)
-				return
-				
-			#now self.__state_machine == 2
-			self.__state_machine = 0
-			
-			(error,state) = self.__extract_status(Data)
-			if(error):
-				self.__command_to_execute()
-				return
-			
-			error = False
-			for key in self.__plugs:				
-				error = error or self.__plugs[key].update_state(state[str(key)])	
-				
-			if(error):
-				self.__command_to_execute()
+		if (Connection.Name in self.__connections):
+			self.__connections[Connection.Name].on_message(Connection, Data)
 
 	#######################################################################
 	#		
@@ -447,10 +2320,13 @@ class BasePlugin:
 			Domoticz.Error("Undefined command: " + Command)
 			return
 		
-		for val in self.__unit2dps_id_list[Unit]:
-			self.__plugs[val].set_command(Command)
+		if(Unit not in self.__units):
+			Domoticz.Error("Undefined unit: " + str(Unit))
+			return
+		
+		ForgetDevice(Unit) #the device may have been changed outside the plugin
 		
-		self.__command_to_execute()		
+		self.__units[Unit].on_command(Unit, Command)
 
 	#######################################################################
 	#		
@@ -459,6 +2335,9 @@ class BasePlugin:
 	#######################################################################
 	def onDisconnect(self, Connection):
 		Domoticz.Debug("Disconnected from: "+Connection.Address+":"+Connection.Port)
+		
+		if (self.__connections is not None and Connection.Name in self.__connections):
+			self.__connections[Connection.Name].on_disconnect(Connection)
 
 	#######################################################################
 	#		
@@ -466,9 +2345,39 @@ class BasePlugin:
 	#
 	#######################################################################
 	def onHeartbeat(self):
-		self.__runAgain -= 1
-		if(self.__runAgain == 0):
-			self.__command_to_execute()
+		now   = time.time()
+		start = time.perf_counter()
+		if(self.__gateway is not None):
+			self.__gateway.reconnect(now)
+		for device in self.__devices.values():
+			device.reconnect(now)
+			device.expire(now)
+			device.keep_alive(now)
+			device.flush(now)
+			device.publish_meter(now)
+		for device in self.__scheduler.tick():
+			device.command_to_execute()
+		if(self.__stats_period > 0 and now >= self.__stats_next):
+			self.__stats_next = now + self.__stats_period
+			self.__publish_stats(now)
+		if(now >= self.__snapshot_next):
+			self.__snapshot_next = now + self.__SNAPSHOT_PERIOD
+			self.__write_snapshot()
+		if(_profiler is not None):
+			for line in (_profiler.tick(now) or ()):
+				Domoticz.Log(line)
+		if(self.__recorder is not None):
+			self.__recorder.flush()
+			if(self.__recorder.full):
+				Domoticz.Log("Capture file " + self.__recorder.path + " full: capture stopped")
+				self.__recorder.close()
+				self.__recorder = None
+		for history in self.__histories:
+			history.flush()
+		if(self.__metrics is not None):
+			for device in self.__devices.values():
+				device.get_stats()
+			self.__metrics.heartbeat.add(time.perf_counter() - start)
 	
 	#######################################################################
 	#		
@@ -476,13 +2385,29 @@ class BasePlugin:
 	#
 	#######################################################################
 	def onStop(self):
-		self.__device           = None
-		self.__plugs	        = None
-		self.__unit2dps_id_list = None
-		if(self.__connection.Connected() or self.__connection.Connecting()):
-			self.__connection.Disconnect()
-		self.__connection       = None
-		self.__state_machine    = 0
+		global _profiler
+		if(self.__metrics is not None):
+			self.__metrics.stop()		#no thread may survive the plugin
+			self.__metrics      = None
+		self.__write_snapshot()
+		for device in self.__devices.values():
+			device.stop()
+		if(self.__gateway is not None):
+			self.__gateway.stop()
+			self.__gateway      = None
+		if(self.__recorder is not None):
+			self.__recorder.close()
+			self.__recorder     = None
+		for history in self.__histories:
+			history.close()
+		self.__histories        = []
+		if(_profiler is not None):
+			_profiler.close()
+			_profiler           = None
+		self.__devices          = None
+		self.__connections      = None
+		self.__units            = None
+		self.__scheduler        = None
 
 ########################################################################################
 #
@@ -494,39 +2419,109 @@ _plugin = BasePlugin()
 
 def onStart():
 	global _plugin
-	_plugin.onStart()
+	_call("onStart", _plugin.onStart)
 
 def onStop():
 	global _plugin
-	_plugin.onStop()
+	_call("onStop", _plugin.onStop)
 
 def onConnect(Connection, Status, Description):
 	global _plugin
-	_plugin.onConnect(Connection, Status, Description)
+	_call("onConnect", _plugin.onConnect, Connection, Status, Description)
 
 def onMessage(Connection, Data):
 	global _plugin
-	_plugin.onMessage(Connection, Data)
+	_call("onMessage", _plugin.onMessage, Connection, Data)
 
 def onCommand(Unit, Command, Level, Hue):
 	global _plugin
-	_plugin.onCommand(Unit, Command, Level, Hue)
+	_call("onCommand", _plugin.onCommand, Unit, Command, Level, Hue)
 
 def onDisconnect(Connection):
 	global _plugin
-	_plugin.onDisconnect(Connection)
+	_call("onDisconnect", _plugin.onDisconnect, Connection)
 
 def onHeartbeat():
 	global _plugin
-	_plugin.onHeartbeat()
+	_call("onHeartbeat", _plugin.onHeartbeat)
 
 ################################################################################
 # Generic helper functions
 ################################################################################
 
+_debug     = False	# True if the plugin debug messages are enabled (avoid building unused strings)
+_shadow    = {}		# mapping between Unit and the (nValue, sValue, TimedOut, time) last written
+_keepalive = 0		# min interval between two writes of unchanged values (seconds, 0: never)
+_profiler  = None	# tuya_stats.CallbackProfiler of the Domoticz callbacks (None: profiling disabled)
+
+# call a Domoticz callback of the plugin (timed when the profiling is enabled)
+def _call(name, function, *args):
+	if _profiler is None:
+		return function(*args)
+	return _profiler.call(name, function, *args)
+
 def UpdateDevice(Unit, nValue, sValue, TimedOut=0, AlwaysUpdate=False):
+	sValue = str(sValue)
+	now    = time.time()
+	# Skip the unchanged values without reading the Domoticz device (shadow of the last write)
+	shadow = _shadow.get(Unit)
+	if shadow is not None and shadow[0] == nValue and shadow[1] == sValue and shadow[2] == TimedOut and not AlwaysUpdate:
+		if _keepalive <= 0 or now - shadow[3] < _keepalive:
+			return
+		AlwaysUpdate = True # keepalive: refresh the last seen of the device
 	# Make sure that the Domoticz device still exists (they can be deleted) before updating it
 	if Unit in Devices:
-		if Devices[Unit].nValue != nValue or Devices[Unit].sValue != sValue or Devices[Unit].TimedOut != TimedOut or AlwaysUpdate:
-			Devices[Unit].Update(nValue=nValue, sValue=str(sValue), TimedOut=TimedOut)
-			Domoticz.Debug("Update " + Devices[Unit].Name + ": " + str(nValue) + " - '" + str(sValue) + "'")
+		if shadow is not None or Devices[Unit].nValue != nValue or Devices[Unit].sValue != sValue or Devices[Unit].TimedOut != TimedOut or AlwaysUpdate:
+			Devices[Unit].Update(nValue=nValue, sValue=sValue, TimedOut=TimedOut)
+			if _debug:
+				Domoticz.Debug("Update " + Devices[Unit].Name + ": " + str(nValue) + " - '" + sValue + "'")
+		_shadow[Unit] = (nValue, sValue, TimedOut, now)
+
+# write Unit again with its last values and the TimedOut flag (last written values if known)
+def TimeoutDevice(Unit, TimedOut):
+	shadow = _shadow.get(Unit)
+	if shadow is not None:
+		UpdateDevice(Unit, shadow[0], shadow[1], TimedOut)
+	elif Unit in Devices:
+		UpdateDevice(Unit, Devices[Unit].nValue, Devices[Unit].sValue, TimedOut)
+
+# forget the last write of Unit (the next UpdateDevice reads the Domoticz device)
+def ForgetDevice(Unit):
+	_shadow.pop(Unit, None)
+
+# parse a dps list parameter (e.g. "1;2;3") and returns the sorted list of dps id
+def parse_dps_list(value):
+	if(value == "None" or value.strip() == ""):
+		return []
+	return sorted(int(val) for val in value.split(";"))
+
+# returns the roles of the units of a device (see BasePlugin.__allocate_units), in the order of its units
+def unit_roles(dps_list, groups, energy):
+	return (["dps:" + str(dps) for dps in dps_list] + ["group:" + ";".join(str(dps) for dps in group) for group in groups]
+			+ ["meter:" + str(index) for index in range(len(energy))])
+
+# parse a dps group parameter (e.g. "1;2 : 3;4") and returns the list of dps id lists
+def parse_dps_groups(value):
+	if(value == "None" or value.strip() == ""):
+		return []
+	return [parse_dps_list(group) for group in value.split(":")]
+
+# parse an energy option (e.g. "18;19;20": current, power and voltage) and returns the list of the 3 values
+# (empty list for None, None if invalid)
+def parse_energy(value):
+	if(value == "None" or str(value).strip() == ""):
+		return []
+	try:
+		result = [int(val) for val in str(value).split(";")]
+	except ValueError:
+		return None
+	return result if len(result) == 3 else None
+
+# parse the options parameter (e.g. "poll_min=2, poll_max=60") and returns a dict
+def parse_options(value):
+	result = {}
+	for option in value.split(","):
+		if("=" in option):
+			(name, val) = option.split("=", 1)
+			result[name.strip()] = val.strip()
+	return result
@@ -27,9 +27,13 @@
 #                                                                                      #
 ########################################################################################
 
+# single device shortcut of tuya_control.py (Python 3.7+, pytuya request with Python 3.5 and 3.6)
+
+import os
 import sys
-import pytuya
-import socket #needed for socket.timeout exception
+import asyncio
+
+import tuya_protocol
 
 
 if(len(sys.argv)!=5):
@@ -41,13 +45,34 @@ devid     = sys.argv[2]
 localkey  = sys.argv[3]
 dps_value = sys.argv[4]
 
-device    = pytuya.OutletDevice(devid,ip,localkey)
-
 try:
-	
-	payload = device.generate_payload('set', {str(dps_value):False})
-	device._send_receive(payload)
-	
-except (ConnectionResetError, socket.timeout, OSError)  as e:
-	print("A problem occur please retry...")
+	tuya_protocol.check_local_key(localkey)
+except ValueError as e:
+	print("usage: " + sys.argv[0] + " <IP> <DevID> <Local key> <DPS value>")
+	print(str(e))
+	exit(1)
+
+device    = {"ip": ip, "devId": devid, "localKey": localkey}
+versions  = tuya_protocol.VersionCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), tuya_protocol.VERSION_CACHE))	#shared with the plugin
+
+if(not hasattr(asyncio, "run")):	#Python 3.5 and 3.6: single request of the plugin's pytuya
+	import pytuya
+	import socket #needed for socket.timeout exception
+
+	outlet = pytuya.OutletDevice(devid, ip, localkey)
+	if(versions.get(devid) == 3.3 and hasattr(outlet, "set_version")):
+		outlet.set_version(3.3)
+	try:
+		outlet._send_receive(outlet.generate_payload('set', {str(dps_value):False}))
+	except (ConnectionResetError, socket.timeout, OSError) as e:
+		print("A problem occur please retry... (" + str(e) + ")")
+		exit(1)
+	exit(0)
+
+import tuya_control
+
+report    = asyncio.run(tuya_control.run([device], [(devid, [dps_value], False)], versions=versions))[0]
+
+if(not report["ok"]):
+	print("A problem occur please retry... (" + report.get("error", "") + ")")
 	exit(1)
@@ -0,0 +1,206 @@
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# asyncio client of the Tuya LAN protocol (helper scripts and benchmarks, Python 3.7+)
+#	one TuyaConnection per device, requests are serialized on the connection
+
+import asyncio
+
+import tuya_protocol
+
+PORT    = 6668
+TIMEOUT = 5.0		#default timeout of a request (seconds)
+
+########################################################################################
+#
+# TuyaConnection: persistent connection to a device
+#
+########################################################################################
+class TuyaConnection:
+
+	#######################################################################
+	#
+	# constructor
+	#
+	# Parameters
+	#	address:   IP address of the device
+	#	dev_id:    devID of the device
+	#	local_key: local key (str, may be empty for 3.1 status requests)
+	#	version:   protocol version (3.1 or 3.3)
+	#
+	#######################################################################
+	def __init__(self, address, dev_id, local_key, version=3.1, port=PORT, timeout=TIMEOUT):
+		self.address   = address
+		self.dev_id    = dev_id
+		self.port      = port
+		self.timeout   = timeout
+		self.local_key = local_key
+		self.version   = version
+		self.encoder   = tuya_protocol.PayloadEncoder(dev_id, local_key.encode('latin1'), version)
+		self.decoder   = tuya_protocol.FrameDecoder(self.encoder.cipher)
+		self.dps       = {}			#last known dps
+		self.pushes    = 0			#unsolicited status frames received
+		self.__reader  = None
+		self.__writer  = None
+		self.__lock    = None			#created in the event loop
+		return
+
+	#######################################################################
+	#
+	# connected function
+	#
+	#######################################################################
+	def connected(self):
+		return self.__writer is not None
+
+	#######################################################################
+	#
+	# open function
+	#
+	#######################################################################
+	async def open(self):
+		if(self.__writer is not None):
+			return
+		(self.__reader, self.__writer) = await asyncio.wait_for(asyncio.open_connection(self.address, self.port), self.timeout)
+		self.decoder.reset()
+
+	#######################################################################
+	#
+	# close function
+	#
+	#######################################################################
+	async def close(self):
+		writer = self.__writer
+		self.__reader = None
+		self.__writer = None
+		if(writer is not None):
+			writer.close()
+			try:
+				await writer.wait_closed()
+			except OSError:
+				pass
+
+	#######################################################################
+	#
+	# __receive function
+	#		returns the first frame of one of the types cmds
+	#		(the dps of the other frames, e.g. pushes, are kept in self.dps)
+	#
+	#######################################################################
+	async def __receive(self, cmds):
+		while(True):
+			data = await self.__reader.read(4096)
+			if(len(data) == 0):
+				raise ConnectionResetError("connection closed by " + self.address)
+			for frame in self.decoder.feed(data):
+				if(frame.dps is not None):
+					self.dps.update(frame.dps)
+				if(frame.cmd == tuya_protocol.STATUS and tuya_protocol.STATUS not in cmds):
+					self.pushes += 1
+				if(frame.cmd in cmds):
+					return frame
+
+	#######################################################################
+	#
+	# request function
+	#		send frame and returns the answer (a frame of one of the types cmds)
+	#		the connection is opened if needed and closed on error
+	#
+	#######################################################################
+	async def request(self, frame, cmds):
+		if(self.__lock is None):
+			self.__lock = asyncio.Lock()
+		async with self.__lock:
+			try:
+				await self.open()
+				self.__writer.write(frame)
+				return await asyncio.wait_for(self.__receive(cmds), self.timeout)
+			except (OSError, asyncio.TimeoutError) as e:
+				await self.close()
+				raise
+
+	#######################################################################
+	#
+	# status function
+	#		returns the dps of the device
+	#
+	#######################################################################
+	async def status(self):
+		frame = await self.request(self.encoder.status(), (tuya_protocol.DP_QUERY,))
+		if(frame.dps is None):
+			raise ValueError("invalid status answer from " + self.address)
+		return frame.dps
+
+	#######################################################################
+	#
+	# set function
+	#		send dps (dict dps id (str) -> value) and returns the dps confirmed by the device
+	#		(from the answer when it holds all of them, from a status request otherwise)
+	#
+	#######################################################################
+	async def set(self, dps):
+		frame = await self.request(self.encoder.set(dps), (tuya_protocol.CONTROL,))
+		if(frame.dps is not None and all(key in frame.dps for key in dps)):
+			return frame.dps
+		return await self.status()
+
+	#######################################################################
+	#
+	# use_version function
+	#		encode the next requests with the protocol version
+	#
+	#######################################################################
+	def use_version(self, version):
+		if(version != self.version):
+			self.version = version
+			self.encoder = tuya_protocol.PayloadEncoder(self.dev_id, self.local_key.encode('latin1'), version)
+
+	#######################################################################
+	#
+	# negotiate function
+	#		returns the dps of the device asked with the current version then with the other ones
+	#		(3.3 only with a local key), the version answering is kept and saved in cache (VersionCache, optional)
+	#		raises the error of the last version tried
+	#
+	#######################################################################
+	async def negotiate(self, cache=None):
+		versions = [self.version] + [version for version in tuya_protocol.VERSIONS if version != self.version]
+		error    = None
+		for version in versions:
+			if(version == 3.3 and self.local_key == ""):
+				continue
+			self.use_version(version)
+			try:
+				dps = await self.status()
+			except (ValueError, OSError, asyncio.TimeoutError) as e:	#not understood (error answer, connection closed) or ignored
+				error = e
+				continue
+			if(cache is not None):
+				cache.set(self.dev_id, version)
+			return dps
+		raise error if error is not None else ValueError("no protocol version available for " + self.address)
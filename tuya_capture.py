@@ -0,0 +1,158 @@
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+
+# raw traffic recorder of the plugin and its reader (no Domoticz dependency)
+#
+# File layout:
+#	MAGIC, then records: RECORD header (time, kind, channel, length) + data
+#	kind OPEN: a device is recorded on channel, data is json {"devId", "ip", "version"}
+#	kind IN:   data received from the device of channel (as given to onMessage)
+#	kind OUT:  data sent to the device of channel
+#	the channels are numbered again at each start of the plugin (a new OPEN record)
+
+import os
+import json
+import mmap
+import time
+import struct
+
+#######################################################################
+#
+# constant definition
+#
+#######################################################################
+MAGIC  = b'TUYACAP1'
+RECORD = struct.Struct('<dBHI')		#time, kind, channel, length
+
+OPEN   = 0
+IN     = 1
+OUT    = 2
+
+########################################################################################
+#
+# Recorder: appends the traffic of the devices to a capture file
+#
+########################################################################################
+class Recorder:
+
+	#######################################################################
+	#
+	# constructor
+	#
+	# Parameters
+	#	path:      capture file (created if needed, appended otherwise)
+	#	max_bytes: the recording stops when the file reaches max_bytes (0: no limit)
+	#
+	#######################################################################
+	def __init__(self, path, max_bytes=0):
+		self.path       = path
+		self.full       = False		#True when max_bytes is reached
+		self.__file     = open(path, "ab")
+		if(self.__file.tell() == 0):
+			self.__file.write(MAGIC)
+		self.__size     = self.__file.tell()
+		self.__max      = max_bytes
+		self.__channels = 0
+		return
+
+	#######################################################################
+	#
+	# open_channel function
+	#		declare a device (info: dict devId, ip, version) and returns its channel
+	#
+	#######################################################################
+	def open_channel(self, info, now=None):
+		channel = self.__channels
+		self.__channels += 1
+		self.record(OPEN, channel, json.dumps(info).encode('utf-8'), now)
+		return channel
+
+	#######################################################################
+	#
+	# record function
+	#
+	#######################################################################
+	def record(self, kind, channel, data, now=None):
+		if(self.full):
+			return
+		if(self.__max > 0 and self.__size + RECORD.size + len(data) > self.__max):
+			self.full = True
+			return
+		if(now is None):
+			now = time.time()
+		self.__file.write(RECORD.pack(now, kind, channel, len(data)))
+		self.__file.write(data)
+		self.__size += RECORD.size + len(data)
+
+	#######################################################################
+	#
+	# flush function
+	#
+	#######################################################################
+	def flush(self):
+		self.__file.flush()
+
+	#######################################################################
+	#
+	# close function
+	#
+	#######################################################################
+	def close(self):
+		self.__file.close()
+
+#######################################################################
+#
+# read_records
+#		memory maps the capture file path and yields (time, kind, channel, data)
+#		data is a memoryview on the file: only valid during the iteration
+#		(a truncated last record is ignored)
+#
+#######################################################################
+def read_records(path):
+
+	with open(path, "rb") as f:
+		if(os.fstat(f.fileno()).st_size <= len(MAGIC)):
+			return
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+			if(m[:len(MAGIC)] != MAGIC):
+				raise ValueError(path + " is not a capture file")
+			view = memoryview(m)
+			try:
+				pos = len(MAGIC)
+				end = len(m)
+				while(pos + RECORD.size <= end):
+					(now, kind, channel, length) = RECORD.unpack_from(m, pos)
+					pos += RECORD.size
+					if(pos + length > end):
+						break
+					with view[pos:pos + length] as data:
+						yield (now, kind, channel, data)
+					pos += length
+			finally:
+				view.release()
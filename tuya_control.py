@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# bulk control of the devices of an inventory (Python 3.7+)
+#	the operations of a device are merged in one set request, the devices are driven concurrently
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import OrderedDict
+
+import tuya_async
+import tuya_protocol
+import tuya_gateway
+
+CONCURRENCY = 64		#default max number of simultaneous devices
+RETRIES     = 2			#default number of retries of a device
+
+VALUES      = {"on": True, "true": True, "off": False, "false": False}
+
+#######################################################################
+#
+# parse_operation
+#
+# Parameter
+#	text: <device>:<dps>=<value>
+#		device: name, devId or ip of an inventory entry, or all
+#		dps:    dps id, list of dps ids separated by ';', or * for all the dps of the entry
+#		value:  on/off/true/false or a json value (e.g. 25, "auto")
+#
+# Returns a tuple (device, list of dps or None for all, value)
+#
+#######################################################################
+def parse_operation(text):
+
+	try:
+		(target, assignment) = text.rsplit(":", 1)
+		(dps, value)         = assignment.split("=", 1)
+	except ValueError:
+		raise ValueError("invalid operation " + text + " (expected <device>:<dps>=<value>)")
+
+	if(value.lower() in VALUES):
+		value = VALUES[value.lower()]
+	else:
+		try:
+			value = json.loads(value)
+		except ValueError:
+			value = value	#plain string
+
+	if(dps.strip() == "*"):
+		return (target.strip(), None, value)
+	return (target.strip(), [item.strip() for item in dps.split(";") if item.strip() != ""], value)
+
+#######################################################################
+#
+# merge_operations
+#
+# Parameters
+#	inventory:  list of the inventory entries (see README, multi device mode)
+#	operations: list of tuples returned by parse_operation
+#
+# Returns an OrderedDict devId -> (entry, dps to set), the last operation on a dps wins
+#
+#######################################################################
+def merge_operations(inventory, operations):
+
+	result = OrderedDict()
+	for (target, dps_list, value) in operations:
+		entries = [entry for entry in inventory if target in ("all", entry.get("name"), entry["devId"], entry["ip"])]
+		if(len(entries) == 0):
+			raise ValueError("unknown device " + target)
+		for entry in entries:
+			if(entry["devId"] not in result):
+				result[entry["devId"]] = (entry, OrderedDict())
+			for dps in (dps_list if dps_list is not None else str(entry["dps"]).split(";")):
+				result[entry["devId"]][1][str(dps)] = value
+
+	return result
+
+#######################################################################
+#
+# new_report
+#		returns the initial report of a device
+#
+#######################################################################
+def new_report(entry, dps):
+	return OrderedDict([("name", entry.get("name", entry["devId"])), ("devId", entry["devId"]), ("ip", entry["ip"]), ("dps", dps),
+						("ok", False), ("attempts", 0), ("latency_ms", None)])
+
+#######################################################################
+#
+# apply
+#		send the merged dps of a device (one set request per attempt on a single connection)
+#		the protocol version is the one of the inventory entry, otherwise the one of the
+#		version cache (tuya_protocol.VersionCache, None: no cache) or it is negotiated
+#
+# Returns the report of the device
+#
+#######################################################################
+async def apply(entry, dps, semaphore, timeout, retries, versions=None):
+
+	report = new_report(entry, dps)
+	try:
+		tuya_protocol.check_local_key(entry["localKey"])
+	except ValueError as e:
+		report["error"]      = str(e)
+		report["latency_ms"] = 0.0
+		return report
+	fixed  = entry.get("version") is not None
+	known  = fixed or (versions is not None and versions.get(entry["devId"]) is not None)
+	if(fixed):
+		version = float(entry["version"])
+	else:
+		version = versions.get(entry["devId"], tuya_protocol.VERSIONS[0]) if versions is not None else tuya_protocol.VERSIONS[0]
+	async with semaphore:
+		connection = tuya_async.TuyaConnection(entry["ip"], entry["devId"], entry["localKey"], version,
+												 int(entry.get("port", tuya_async.PORT)), timeout)
+		start = time.perf_counter()
+		try:
+			while(report["attempts"] <= retries):
+				report["attempts"] += 1
+				try:
+					if(not known):
+						await connection.negotiate(versions)
+						known = True
+					state = await connection.set(dps)
+				except (OSError, asyncio.TimeoutError, ValueError) as e:
+					report["error"] = type(e).__name__ + " " + str(e)
+					if(isinstance(e, ValueError) and not fixed):
+						known = False		#unreadable answer: the firmware may have changed
+					continue
+				if(all(state.get(key) == value for (key, value) in dps.items())):
+					report["ok"] = True
+					report.pop("error", None)
+					break
+				report["error"] = "not confirmed " + json.dumps(state)
+		finally:
+			report["latency_ms"] = round((time.perf_counter() - start) * 1000.0, 1)
+			await connection.close()
+
+	return report
+
+#######################################################################
+#
+# run
+#
+# Returns the list of the device reports (inventory order)
+#
+#######################################################################
+async def run(inventory, operations, concurrency=CONCURRENCY, timeout=tuya_async.TIMEOUT, retries=RETRIES, versions=None):
+
+	semaphore = asyncio.Semaphore(concurrency)
+	merged    = merge_operations(inventory, operations)
+	return await asyncio.gather(*[apply(entry, dps, semaphore, timeout, retries, versions) for (entry, dps) in merged.values()])
+
+#######################################################################
+#
+# apply_gateway
+#		send the merged dps of a device through the gateway (tuya_gateway.py)
+#
+# Returns the report of the device
+#
+#######################################################################
+async def apply_gateway(client, entry, dps, retries):
+
+	report = new_report(entry, dps)
+	start  = time.perf_counter()
+	while(report["attempts"] <= retries and not report["ok"]):
+		report["attempts"] += 1
+		answer = await client.request("set", device=entry["devId"], dps=dps)
+		report["ok"] = answer.get("ok", False)
+		if(report["ok"]):
+			report.pop("error", None)
+		else:
+			report["error"] = answer.get("error", "")
+	report["latency_ms"] = round((time.perf_counter() - start) * 1000.0, 1)
+	return report
+
+#######################################################################
+#
+# run_gateway
+#		same as run through the gateway of address (the inventory is the one of the gateway)
+#
+# Returns the list of the device reports (inventory order)
+#
+#######################################################################
+async def run_gateway(address, operations, retries=RETRIES):
+
+	client = tuya_gateway.GatewayClient(address)
+	try:
+		merged = merge_operations((await client.request("list"))["devices"], operations)
+		return await asyncio.gather(*[apply_gateway(client, entry, dps, retries) for (entry, dps) in merged.values()])
+	finally:
+		await client.close()
+
+#######################################################################
+#
+# main
+#
+#######################################################################
+def main(argv):
+
+	parser = argparse.ArgumentParser(description="Bulk control of the Tuya devices of an inventory")
+	parser.add_argument("--inventory",                                       help="json inventory (see README, multi device mode)")
+	parser.add_argument("--gateway",     metavar="SOCKET",                   help="send the operations through the gateway (tuya_gateway.py) instead of connecting the devices")
+	parser.add_argument("--file",                                            help="file of operations (one per line, # for comments)")
+	parser.add_argument("--concurrency", type=int,   default=CONCURRENCY,    help="max number of simultaneous devices (default " + str(CONCURRENCY) + ")")
+	parser.add_argument("--timeout",     type=float, default=tuya_async.TIMEOUT, help="timeout of a request (seconds, default " + str(tuya_async.TIMEOUT) + ")")
+	parser.add_argument("--retries",     type=int,   default=RETRIES,        help="retries of a device (default " + str(RETRIES) + ")")
+	parser.add_argument("--versions",    default=tuya_protocol.VERSION_CACHE, help="cache of the protocol versions of the devices without version in the inventory (default " + tuya_protocol.VERSION_CACHE + ", shared with the plugin when run from its folder, '' to disable)")
+	parser.add_argument("--json",        action="store_true",                help="print the reports in json")
+	parser.add_argument("operations",    nargs="*",                          help="<device>:<dps>=<value> eg. Desk:1;2=off all:*=off")
+	args = parser.parse_args(argv)
+
+	if(args.inventory is None and args.gateway is None):
+		parser.error("--inventory or --gateway is required")
+	texts = list(args.operations)
+	if(args.file is not None):
+		with open(args.file) as f:
+			texts += [line.strip() for line in f if line.strip() != "" and not line.strip().startswith("#")]
+	if(len(texts) == 0):
+		parser.error("no operation")
+
+	try:
+		operations = [parse_operation(text) for text in texts]
+		start      = time.perf_counter()
+		if(args.gateway is not None):
+			reports = asyncio.run(run_gateway(args.gateway, operations, args.retries))
+		else:
+			with open(args.inventory) as f:
+				inventory = json.load(f)
+			versions = tuya_protocol.VersionCache(args.versions) if args.versions != "" else None
+			reports  = asyncio.run(run(inventory, operations, args.concurrency, args.timeout, args.retries, versions))
+		elapsed    = time.perf_counter() - start
+	except (ValueError, OSError) as e:
+		print(str(e))
+		return 1
+
+	failures = [report for report in reports if not report["ok"]]
+	if(args.json):
+		print(json.dumps(reports, indent=1))
+	else:
+		for report in reports:
+			print("%-24s %-15s %-6s %8.1f ms  %d attempt(s)  %s" % (report["name"], report["ip"], "ok" if report["ok"] else "FAILED",
+																   report["latency_ms"], report["attempts"], report.get("error", "")))
+		print("%d device(s), %d failure(s) in %.2f s" % (len(reports), len(failures), elapsed))
+	return 1 if len(failures) > 0 else 0
+
+if __name__ == "__main__":
+	exit(main(sys.argv[1:]))
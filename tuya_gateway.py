@@ -0,0 +1,724 @@
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+
+# local gateway owning the connections to the Tuya devices (Python 3.7+)
+#	one persistent session per device (heartbeats, pushes, polling), the last dps are cached
+#	the clients (plugin, tuya_control.py...) share the sessions through a Unix socket
+#	(and optionally a TCP port on localhost: the Domoticz connections do not support Unix sockets)
+#
+# Client protocol: one json object per line
+#	request: {"id": 1, "op": "list"}
+#	         {"id": 2, "op": "status", "device": "Desk", "refresh": false}	cached dps unless refresh (or not known yet)
+#	         {"id": 3, "op": "set", "device": "Desk", "dps": {"1": true}}		answered once the device confirms
+#	         {"id": 4, "op": "subscribe", "devices": ["Desk"]}				all the devices if absent
+#	answer:  {"id": 2, "ok": true, "devId": "...", "dps": {...}, "online": true}
+#	         {"id": 3, "ok": false, "devId": "...", "error": "...", "dps": {...}}
+#	event:   {"event": "dps", "devId": "...", "dps": {...}, "online": true}		(subscribers, state of the device)
+#	device: name, devId or ip of an inventory entry
+#	the sets received while a set is in flight are merged in the next set frame of the device
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+
+import tuya_protocol
+
+SOCKET      = "/tmp/tuya_gateway.sock"	#default Unix socket
+PORT        = 6668						#port of the devices
+POLL        = 60.0						#default interval of the status requests (seconds)
+HEARTBEAT   = 10.0						#default interval of the heartbeat frames (seconds)
+TIMEOUT     = 5.0						#default timeout of a request (seconds)
+BATCH       = 0.05						#default time waited for other sets before sending a set frame (seconds)
+BACKOFF_MIN = 2.0						#delay before the first reconnection (seconds)
+BACKOFF_MAX = 120.0						#max delay between two connection attempts (seconds)
+
+########################################################################################
+#
+# DeviceSession: persistent connection to a device and cache of its dps
+#	a single task writes to the device, the frames are read by a second task
+#
+########################################################################################
+class DeviceSession:
+
+	#######################################################################
+	#
+	# constructor
+	#
+	# Parameters
+	#	entry:    inventory entry (ip, devId, localKey, optional name, version, port)
+	#	listener: called with the session when the dps or the online state change
+	#	versions: tuya_protocol.VersionCache of the versions negotiated (entries without version)
+	#
+	# Raises ValueError if the local key or the version of entry is invalid
+	#
+	#######################################################################
+	def __init__(self, entry, listener=None, poll=POLL, heartbeat=HEARTBEAT, timeout=TIMEOUT, batch=BATCH, versions=None):
+		self.entry      = entry
+		self.dev_id     = entry["devId"]
+		self.name       = entry.get("name", entry["devId"])
+		self.address    = entry["ip"]
+		self.port       = int(entry.get("port", PORT))
+		self.poll       = poll
+		self.heartbeat  = heartbeat
+		self.timeout    = timeout
+		self.batch      = batch
+		self.local_key  = entry.get("localKey", "")
+		if(entry.get("version") is not None):
+			self.version = float(entry["version"])
+		else:
+			self.version = versions.get(self.dev_id, tuya_protocol.VERSIONS[0]) if versions is not None else tuya_protocol.VERSIONS[0]
+		tuya_protocol.check_local_key(self.local_key, self.version == 3.3)
+		self.encoder    = tuya_protocol.PayloadEncoder(self.dev_id, self.local_key.encode('latin1'), self.version)
+		self.decoder    = tuya_protocol.FrameDecoder(self.encoder.cipher)
+		self.dps        = {}			#last known dps
+		self.online     = False			#True when the device answered on the current connection
+		self.updated    = None			#time of the last dps received
+		self.counters   = {"sets": 0, "set_frames": 0, "status_requests": 0, "status_frames": 0, "pushes": 0, "connects": 0, "connect_errors": 0, "version_switches": 0}
+		self.__negotiate  = entry.get("version") is None and self.local_key != ""	#the version is not fixed by the inventory
+		self.__versions   = versions
+		self.__unreadable = 0			#unreadable answers in a row
+		self.__switches   = 0			#versions tried since the last readable answer
+		self.__answered   = False		#True if an answer was read on the current connection
+		self.__listener = listener
+		self.__pending  = {}			#dps to write in the next set frame
+		self.__setters  = []			#(dps, future) of the sets waiting for a confirmation
+		self.__readers  = []			#futures waiting for a status answer
+		self.__refresh  = False			#True when a status request is needed
+		self.__wake     = None			#asyncio.Event: something to send
+		self.__answer   = None			#asyncio.Event: a frame was received
+		self.__task     = None
+		return
+
+	#######################################################################
+	#
+	# start function
+	#
+	#######################################################################
+	def start(self):
+		self.__wake   = asyncio.Event()
+		self.__answer = asyncio.Event()
+		self.__task   = asyncio.ensure_future(self.__run())
+
+	#######################################################################
+	#
+	# stop function
+	#
+	#######################################################################
+	async def stop(self):
+		if(self.__task is not None):
+			self.__task.cancel()
+			try:
+				await self.__task
+			except asyncio.CancelledError:
+				pass
+			self.__task = None
+
+	#######################################################################
+	#
+	# state function
+	#		returns the state of the device (event and answer fields)
+	#
+	#######################################################################
+	def state(self):
+		return {"devId": self.dev_id, "dps": dict(self.dps), "online": self.online}
+
+	#######################################################################
+	#
+	# status function
+	#		returns the dps of the device (cached unless refresh or not known yet)
+	#
+	#######################################################################
+	async def status(self, refresh=False):
+		self.counters["status_requests"] += 1
+		if(self.online and len(self.dps) != 0 and not refresh):
+			return dict(self.dps)
+		future = asyncio.get_event_loop().create_future()
+		self.__readers.append(future)
+		self.__refresh = True
+		self.__wake.set()
+		try:
+			return await asyncio.wait_for(future, self.timeout)
+		finally:
+			if(future in self.__readers):
+				self.__readers.remove(future)
+
+	#######################################################################
+	#
+	# set function
+	#		write dps (dict dps id (str) -> value), merged with the other pending sets of the device
+	#		returns the dps of the device once they hold the values (asyncio.TimeoutError otherwise)
+	#
+	#######################################################################
+	async def set(self, dps):
+		if(self.encoder.cipher is None):
+			raise ValueError("the local key of " + self.name + " is needed to set the dps")
+		self.counters["sets"] += 1
+		for (previous, future) in self.__setters:	#last set wins: the previous values are no longer expected
+			for key in dps:
+				previous.pop(key, None)
+		waiter = (dict(dps), asyncio.get_event_loop().create_future())
+		self.__setters.append(waiter)
+		self.__pending.update(dps)
+		self.__wake.set()
+		try:
+			return await asyncio.wait_for(waiter[1], self.timeout * 2)
+		finally:
+			if(waiter in self.__setters):
+				self.__setters.remove(waiter)
+
+	#######################################################################
+	#
+	# __notify: the state of the device changed
+	#
+	#######################################################################
+	def __notify(self):
+		if(self.__listener is not None):
+			self.__listener(self)
+
+	#######################################################################
+	#
+	# __version_failure: an answer cannot be read (e.g. "data format error" of a device of the other version)
+	#	after VERSION_FAILURES answers in a row, the requests are encoded with the other version
+	#	and the sets not confirmed are sent again (status requested at once while each version is tried once)
+	#
+	#######################################################################
+	def __version_failure(self):
+		if(not self.__negotiate):
+			return
+		self.__unreadable += 1
+		if(self.__unreadable >= tuya_protocol.VERSION_FAILURES):
+			self.__unreadable = 0
+			self.__switches  += 1
+			self.version      = tuya_protocol.other_version(self.version)
+			self.encoder      = tuya_protocol.PayloadEncoder(self.dev_id, self.local_key.encode('latin1'), self.version)
+			self.counters["version_switches"] += 1
+			for (dps, future) in self.__setters:
+				if(not future.done()):
+					self.__pending.update(dps)
+		if(self.__switches < len(tuya_protocol.VERSIONS)):
+			self.__refresh = True
+			self.__wake.set()
+
+	#######################################################################
+	#
+	# __received: process a frame received from the device
+	#
+	#######################################################################
+	def __received(self, frame):
+		self.__answer.set()
+		if(not self.online):
+			self.online = True
+			self.__notify()
+		if(frame.dps is not None and frame.cmd in (tuya_protocol.DP_QUERY, tuya_protocol.CONTROL)):
+			self.__unreadable = 0
+			self.__switches   = 0
+			self.__answered   = True
+			if(self.__negotiate and self.__versions is not None):
+				self.__versions.set(self.dev_id, self.version)	#written only when it changes
+		elif(frame.dps is None and (frame.cmd == tuya_protocol.DP_QUERY or frame.retcode)):
+			self.__version_failure()
+		if(frame.dps is None):
+			if(frame.cmd == tuya_protocol.CONTROL and len(self.__setters) != 0):
+				self.__refresh = True		#set answer without dps: confirm with a status request
+				self.__wake.set()
+			return
+
+		if(frame.cmd == tuya_protocol.STATUS):
+			self.counters["pushes"] += 1
+		changed      = any(self.dps.get(key) != value for (key, value) in frame.dps.items())
+		self.dps.update(frame.dps)
+		self.updated = time.time()
+		if(changed):
+			self.__notify()
+
+		if(frame.cmd == tuya_protocol.DP_QUERY):
+			for future in self.__readers:
+				if(not future.done()):
+					future.set_result(dict(self.dps))
+			self.__readers = []
+		for (dps, future) in self.__setters:
+			if(not future.done() and all(self.dps.get(key) == value for (key, value) in dps.items())):
+				future.set_result(dict(self.dps))
+		if(frame.cmd == tuya_protocol.CONTROL and any(not future.done() for (dps, future) in self.__setters)):
+			self.__refresh = True			#set answer not confirming the values: ask the status once
+			self.__wake.set()
+
+	#######################################################################
+	#
+	# __read: read the frames of the connection until it is closed
+	#
+	#######################################################################
+	async def __read(self, reader):
+		while(True):
+			data = await reader.read(4096)
+			if(len(data) == 0):
+				raise ConnectionResetError("connection closed by " + self.address)
+			for frame in self.decoder.feed(data):
+				self.__received(frame)
+
+	#######################################################################
+	#
+	# __wait: wait for event, the end of the reader task or the timeout
+	#
+	#######################################################################
+	async def __wait(self, event, reading, timeout):
+		waiter = asyncio.ensure_future(event.wait())
+		try:
+			await asyncio.wait([waiter, reading], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+		finally:
+			waiter.cancel()
+
+	#######################################################################
+	#
+	# __write: send frames to the device until the connection is broken
+	#
+	#######################################################################
+	async def __write(self, writer, reading):
+		last_sent     = 0.0
+		last_status   = 0.0
+		last_received = time.time()
+		self.__refresh = True
+		while(True):
+			now = time.time()
+			if(self.__answer.is_set()):
+				self.__answer.clear()
+				last_received = now
+
+			if(len(self.__pending) != 0):
+				if(self.batch > 0):
+					await asyncio.sleep(self.batch)	#let the other sets join
+				(dps, self.__pending) = (self.__pending, {})
+				self.counters["set_frames"] += 1
+				self.__answer.clear()
+				writer.write(self.encoder.set(dps))
+				last_sent = time.time()
+				#one set in flight: the sets received meanwhile are merged in the next frame
+				await self.__wait(self.__answer, reading, self.timeout)
+				if(reading.done()):
+					return
+				continue
+			if(last_sent > last_received and now - last_received > 3 * self.heartbeat):
+				raise asyncio.TimeoutError("no answer from " + self.address)
+			if(self.__refresh or now - last_status >= self.poll):
+				self.__refresh = False
+				self.counters["status_frames"] += 1
+				writer.write(self.encoder.status())
+				last_sent = last_status = now
+			elif(now - last_sent >= self.heartbeat):
+				writer.write(self.encoder.heartbeat())
+				last_sent = now
+
+			self.__wake.clear()
+			delay = max(0.0, min(last_sent + self.heartbeat, last_status + self.poll) - time.time())
+			await self.__wait(self.__wake, reading, delay)
+			if(reading.done()):
+				return
+
+	#######################################################################
+	#
+	# __run: connect, drive the connection and reconnect (exponential backoff with jitter)
+	#
+	#######################################################################
+	async def __run(self):
+		delay = BACKOFF_MIN
+		while(True):
+			try:
+				(reader, writer) = await asyncio.wait_for(asyncio.open_connection(self.address, self.port), self.timeout)
+			except (OSError, asyncio.TimeoutError) as e:
+				self.counters["connect_errors"] += 1
+				await asyncio.sleep(random.uniform(delay / 2, delay))
+				delay = min(delay * 2, BACKOFF_MAX)
+				continue
+
+			self.counters["connects"] += 1
+			self.decoder.reset()
+			self.__answered = False
+			reading = asyncio.ensure_future(self.__read(reader))
+			try:
+				await self.__write(writer, reading)
+				await reading			#raises the error of the reader
+			except (OSError, asyncio.TimeoutError) as e:
+				if(not self.__answered):
+					self.__version_failure()	#devices ignoring the requests of the other version
+			finally:
+				reading.cancel()
+				writer.close()
+			if(self.online):
+				delay = BACKOFF_MIN
+				self.online = False
+				self.__notify()
+			await asyncio.sleep(random.uniform(delay / 2, delay))
+			delay = min(delay * 2, BACKOFF_MAX)
+
+########################################################################################
+#
+# Gateway: sessions of the inventory and client connections
+#
+########################################################################################
+class Gateway:
+
+	#######################################################################
+	#
+	# constructor
+	#		the invalid entries of inventory (local key, version) are kept in skipped: (entry, error)
+	#
+	#######################################################################
+	def __init__(self, inventory, poll=POLL, heartbeat=HEARTBEAT, timeout=TIMEOUT, batch=BATCH, versions=None):
+		self.sessions      = []
+		self.skipped       = []
+		for entry in inventory:
+			try:
+				self.sessions.append(DeviceSession(entry, self.__changed, poll, heartbeat, timeout, batch, versions))
+			except ValueError as e:
+				self.skipped.append((entry, str(e)))
+		self.__subscribers = {}			#writer -> set of devId (None: all)
+		self.__servers     = []
+		return
+
+	#######################################################################
+	#
+	# find function
+	#		returns the session of a device (name, devId or ip)
+	#
+	#######################################################################
+	def find(self, device):
+		for session in self.sessions:
+			if(device in (session.dev_id, session.name, session.address)):
+				return session
+		raise ValueError("unknown device " + str(device))
+
+	#######################################################################
+	#
+	# start function
+	#		start the sessions and listen on the Unix socket (and on 127.0.0.1:port if port)
+	#
+	#######################################################################
+	async def start(self, path=SOCKET, port=0):
+		for session in self.sessions:
+			session.start()
+		if(path):
+			if(os.path.exists(path)):
+				os.unlink(path)		#stale socket of a previous run
+			self.__servers.append(await asyncio.start_unix_server(self.__client, path))
+		if(port):
+			self.__servers.append(await asyncio.start_server(self.__client, "127.0.0.1", port))
+
+	#######################################################################
+	#
+	# stop function
+	#
+	#######################################################################
+	async def stop(self):
+		for server in self.__servers:
+			server.close()
+		for session in self.sessions:
+			await session.stop()
+
+	#######################################################################
+	#
+	# __send: one json object per line
+	#
+	#######################################################################
+	def __send(self, writer, message):
+		if(not writer.is_closing()):
+			writer.write(json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n')
+
+	#######################################################################
+	#
+	# __changed: state of a device changed, notify the subscribers
+	#
+	#######################################################################
+	def __changed(self, session):
+		for (writer, devices) in list(self.__subscribers.items()):
+			if(devices is None or session.dev_id in devices):
+				self.__changed_for(writer, session)
+
+	#######################################################################
+	#
+	# __execute: process a request, returns the answer
+	#
+	#######################################################################
+	async def __execute(self, request, writer):
+		op = request.get("op")
+		if(op == "list"):
+			devices = []
+			for session in self.sessions:
+				entry = dict((key, value) for (key, value) in session.entry.items() if key != "localKey")
+				entry.update({"version": session.version, "state": dict(session.dps), "online": session.online, "counters": dict(session.counters)})
+				devices.append(entry)
+			return {"devices": devices}
+
+		if(op == "subscribe"):
+			devices = request.get("devices")
+			devices = None if devices is None else set(self.find(device).dev_id for device in devices)
+			self.__subscribers[writer] = devices
+			for session in self.sessions:	#current state of the devices
+				if(devices is None or session.dev_id in devices):
+					self.__changed_for(writer, session)
+			return {}
+
+		session = self.find(request.get("device"))
+		result  = session.state()
+		try:
+			if(op == "status"):
+				result["dps"] = await session.status(bool(request.get("refresh", False)))
+			elif(op == "set"):
+				if(not isinstance(request.get("dps"), dict) or len(request["dps"]) == 0):
+					raise ValueError("set without dps")
+				result["dps"] = await session.set(dict((str(key), value) for (key, value) in request["dps"].items()))
+			else:
+				raise ValueError("unknown op " + str(op))
+		except asyncio.TimeoutError:
+			result = session.state()
+			result["ok"]    = False
+			result["error"] = ("not confirmed by " if session.online else "no answer from ") + session.name
+		return result
+
+	#######################################################################
+	#
+	# __changed_for: event of a session for a single subscriber
+	#
+	#######################################################################
+	def __changed_for(self, writer, session):
+		event = session.state()
+		event["event"] = "dps"
+		self.__send(writer, event)
+
+	#######################################################################
+	#
+	# __answer: process a request and send the answer
+	#
+	#######################################################################
+	async def __answer(self, request, writer):
+		try:
+			answer = await self.__execute(request, writer)
+			answer.setdefault("ok", True)
+		except (ValueError, TypeError, KeyError) as e:
+			answer = {"ok": False, "error": str(e)}
+		if("id" in request):
+			answer["id"] = request["id"]
+		self.__send(writer, answer)
+
+	#######################################################################
+	#
+	# __client: connection of a client (requests processed concurrently)
+	#
+	#######################################################################
+	async def __client(self, reader, writer):
+		tasks = set()
+		try:
+			while(True):
+				line = await reader.readline()
+				if(len(line) == 0):
+					break
+				if(line.strip() == b''):
+					continue
+				try:
+					request = json.loads(line.decode('utf-8'))
+					if(not isinstance(request, dict)):
+						raise ValueError("a request is a json object")
+				except ValueError as e:
+					self.__send(writer, {"ok": False, "error": "invalid request: " + str(e)})
+					continue
+				task = asyncio.ensure_future(self.__answer(request, writer))
+				tasks.add(task)
+				task.add_done_callback(tasks.discard)
+		except (OSError, asyncio.IncompleteReadError, ValueError):
+			pass
+		finally:
+			self.__subscribers.pop(writer, None)
+			for task in tasks:
+				task.cancel()
+			writer.close()
+
+########################################################################################
+#
+# GatewayClient: asyncio client of the gateway (helper scripts)
+#
+########################################################################################
+class GatewayClient:
+
+	#######################################################################
+	#
+	# constructor
+	#		address: path of the Unix socket or host:port
+	#
+	#######################################################################
+	def __init__(self, address=SOCKET):
+		self.address   = address
+		self.events    = None			#asyncio.Queue of the events (subscribe)
+		self.__reader  = None
+		self.__writer  = None
+		self.__waiters = {}				#id -> future
+		self.__next_id = 1
+		self.__task    = None
+		return
+
+	#######################################################################
+	#
+	# open function
+	#
+	#######################################################################
+	async def open(self):
+		if(":" in self.address and not os.path.exists(self.address)):
+			(host, port) = self.address.rsplit(":", 1)
+			(self.__reader, self.__writer) = await asyncio.open_connection(host, int(port))
+		else:
+			(self.__reader, self.__writer) = await asyncio.open_unix_connection(self.address)
+		self.events = asyncio.Queue()
+		self.__task = asyncio.ensure_future(self.__read())
+
+	#######################################################################
+	#
+	# close function
+	#
+	#######################################################################
+	async def close(self):
+		if(self.__task is not None):
+			self.__task.cancel()
+			self.__task = None
+		if(self.__writer is not None):
+			self.__writer.close()
+			self.__writer = None
+
+	#######################################################################
+	#
+	# __read: dispatch the answers and the events
+	#
+	#######################################################################
+	async def __read(self):
+		try:
+			while(True):
+				line = await self.__reader.readline()
+				if(len(line) == 0):
+					break
+				message = json.loads(line.decode('utf-8'))
+				future  = self.__waiters.pop(message.get("id"), None)
+				if(future is not None and not future.done()):
+					future.set_result(message)
+				elif("event" in message):
+					self.events.put_nowait(message)
+		finally:
+			for future in self.__waiters.values():
+				if(not future.done()):
+					future.set_exception(ConnectionResetError("connection to the gateway closed"))
+			self.__waiters = {}
+
+	#######################################################################
+	#
+	# request function
+	#		op and its fields (device, dps, refresh...), returns the answer
+	#
+	#######################################################################
+	async def request(self, op, **fields):
+		if(self.__writer is None):
+			await self.open()
+		request = dict(fields, op=op, id=self.__next_id)
+		self.__next_id += 1
+		future  = asyncio.get_event_loop().create_future()
+		self.__waiters[request["id"]] = future
+		self.__writer.write(json.dumps(request).encode('utf-8') + b'\n')
+		return await future
+
+#######################################################################
+#
+# main
+#
+#######################################################################
+async def serve(args):
+	with open(args.inventory) as f:
+		inventory = json.load(f)
+	versions = tuya_protocol.VersionCache(args.versions) if args.versions != "" else None
+	gateway  = Gateway(inventory, args.poll, args.heartbeat, args.timeout, args.batch, versions)
+	for (entry, error) in gateway.skipped:
+		print("skipped " + str(entry.get("name", entry.get("devId"))) + ": " + error, file=sys.stderr)
+	await gateway.start(args.socket, args.port)
+	print("gateway of " + str(len(gateway.sessions)) + " device(s) on " + args.socket + ("" if not args.port else " and 127.0.0.1:" + str(args.port)))
+	try:
+		await asyncio.Event().wait()	#until interrupted
+	finally:
+		await gateway.stop()
+
+async def query(args):
+	client = GatewayClient(args.socket)
+	try:
+		fields = {}
+		if(args.device is not None):
+			fields["device"] = args.device
+		if(args.dps is not None):
+			fields["dps"] = json.loads(args.dps)
+		if(args.refresh):
+			fields["refresh"] = True
+		answer = await client.request(args.op, **fields)
+		print(json.dumps(answer, indent=1))
+		if(args.op == "subscribe"):
+			while(True):
+				print(json.dumps(await client.events.get()))
+		return 0 if answer.get("ok") else 1
+	finally:
+		await client.close()
+
+def main(argv):
+	parser     = argparse.ArgumentParser(description="Local gateway of the Tuya devices of an inventory")
+	commands   = parser.add_subparsers(dest="command")
+	server     = commands.add_parser("serve", help="run the gateway")
+	server.add_argument("--inventory", required=True,                 help="json inventory (see README, multi device mode)")
+	server.add_argument("--socket",    default=SOCKET,                help="Unix socket of the clients (default " + SOCKET + ")")
+	server.add_argument("--port",      type=int,   default=0,         help="also listen on 127.0.0.1:PORT (plugin option gateway=127.0.0.1:PORT)")
+	server.add_argument("--poll",      type=float, default=POLL,      help="interval of the status requests (seconds, default " + str(POLL) + ")")
+	server.add_argument("--heartbeat", type=float, default=HEARTBEAT, help="interval of the heartbeat frames (seconds, default " + str(HEARTBEAT) + ")")
+	server.add_argument("--timeout",   type=float, default=TIMEOUT,   help="timeout of a request (seconds, default " + str(TIMEOUT) + ")")
+	server.add_argument("--batch",     type=float, default=BATCH,     help="time waited for other sets before a set frame (seconds, default " + str(BATCH) + ")")
+	server.add_argument("--versions",  default=tuya_protocol.VERSION_CACHE, help="cache of the protocol versions of the devices without version in the inventory (default " + tuya_protocol.VERSION_CACHE + ", '' to disable)")
+	client     = commands.add_parser("query", help="send a request to the gateway and print the answer")
+	client.add_argument("--socket",    default=SOCKET,                help="Unix socket or host:port of the gateway (default " + SOCKET + ")")
+	client.add_argument("--refresh",   action="store_true",           help="status: ask the device instead of the cache")
+	client.add_argument("op",          choices=("list", "status", "set", "subscribe"))
+	client.add_argument("device",      nargs="?",                     help="name, devId or ip")
+	client.add_argument("dps",         nargs="?",                     help="set: json dps eg. '{\"1\": true}'")
+	args = parser.parse_args(argv)
+
+	try:
+		if(args.command == "serve"):
+			asyncio.run(serve(args))
+		elif(args.command == "query"):
+			return asyncio.run(query(args))
+		else:
+			parser.print_help()
+			return 1
+	except KeyboardInterrupt:
+		pass
+	return 0
+
+if __name__ == "__main__":
+	exit(main(sys.argv[1:]))
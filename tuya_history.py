@@ -0,0 +1,411 @@
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+
+# history of the state transitions of the sockets (no Domoticz dependency)
+#	one append-only file per device of fixed size records, read through mmap:
+#	the counts are done on strided copies of the record fields (no Python object per record),
+#	only on_time and records unpack the records (of a single dps)
+#
+# File layout:
+#	HEADER (MAGIC, record size), then RECORD: time, dps, old state, new state, source
+#	states: 1 On, 0 Off, -1 unknown (first state seen)
+#
+# usage: tuya_history.py <history file>... [--since 7d] [--until 1d] [--dps 3] [--last 20]
+
+import os
+import sys
+import mmap
+import time
+import struct
+import argparse
+
+#######################################################################
+#
+# constant definition
+#
+#######################################################################
+MAGIC   = b'TUYAHST1'
+HEADER  = struct.Struct('<8sII')		#magic, record size, reserved
+RECORD  = struct.Struct('<dBbbB4x')		#time, dps, old, new, source (16 bytes)
+MAX_DPS = 255			#highest dps id of a record (one byte)
+
+COMMAND = 0		#transition requested by a command of the plugin
+POLL    = 1		#transition seen in a status answer
+PUSH    = 2		#transition pushed by the device (e.g. button pressed)
+SOURCES = ("command", "poll", "push")
+
+UNKNOWN = -1
+
+#translation of the old, new and source fields into digits (see HistoryFile.__codes)
+_OLD_CODES    = bytes([1, 2] + [0] * 254)		#0 -> 1, 1 -> 2, -1 (0xff) -> 0
+_NEW_CODES    = bytes([0, 1] + [0] * 254)
+_SOURCE_CODES = bytes([0, 1, 2] + [0] * 253)
+
+#offsets of the fields in a record
+TIME_OFFSET = 0
+DPS_OFFSET  = 8
+NEW_OFFSET  = 10
+
+#######################################################################
+#
+# state_value: True/False/None -> 1/0/-1
+#
+#######################################################################
+def state_value(state):
+	if(state is None):
+		return UNKNOWN
+	return 1 if state else 0
+
+########################################################################################
+#
+# HistoryWriter: appends the transitions of a device
+#
+########################################################################################
+class HistoryWriter:
+
+	#######################################################################
+	#
+	# constructor
+	#		path: history file (created if needed, appended otherwise)
+	#
+	#######################################################################
+	def __init__(self, path):
+		self.path   = path
+		self.__file = open(path, "ab")
+		if(self.__file.tell() == 0):
+			self.__file.write(HEADER.pack(MAGIC, RECORD.size, 0))
+		elif((self.__file.tell() - HEADER.size) % RECORD.size != 0):
+			#truncated record (e.g. power loss): the following records are aligned again
+			self.__file.truncate(self.__file.tell() - (self.__file.tell() - HEADER.size) % RECORD.size)
+			self.__file.seek(0, os.SEEK_END)
+		return
+
+	#######################################################################
+	#
+	# append function
+	#		old, new: True/False/None (unknown)
+	#
+	#######################################################################
+	def append(self, now, dps_id, old, new, source):
+		self.__file.write(RECORD.pack(now, int(dps_id), state_value(old), state_value(new), source))
+
+	#######################################################################
+	#
+	# flush function
+	#
+	#######################################################################
+	def flush(self):
+		self.__file.flush()
+
+	#######################################################################
+	#
+	# close function
+	#
+	#######################################################################
+	def close(self):
+		self.__file.close()
+
+########################################################################################
+#
+# HistoryFile: memory mapped history (read only)
+#	the records are in time order (append-only), the time ranges are found by bisection
+#
+########################################################################################
+class HistoryFile:
+
+	#######################################################################
+	#
+	# constructor
+	#
+	#######################################################################
+	def __init__(self, path):
+		self.path   = path
+		self.__file = open(path, "rb")
+		size        = os.fstat(self.__file.fileno()).st_size
+		self.__map  = None
+		self.__size = 0			#number of records
+		if(size < HEADER.size):
+			return
+		self.__map  = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+		(magic, record_size, reserved) = HEADER.unpack_from(self.__map, 0)
+		if(magic != MAGIC or record_size != RECORD.size):
+			self.close()
+			raise ValueError(path + " is not a history file")
+		self.__size = (size - HEADER.size) // RECORD.size
+		return
+
+	def __len__(self):
+		return self.__size
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	#######################################################################
+	#
+	# close function
+	#
+	#######################################################################
+	def close(self):
+		if(self.__map is not None):
+			self.__map.close()
+			self.__map = None
+		self.__file.close()
+
+	#######################################################################
+	#
+	# record function
+	#		returns the record index: (time, dps, old, new, source)
+	#
+	#######################################################################
+	def record(self, index):
+		return RECORD.unpack_from(self.__map, HEADER.size + index * RECORD.size)
+
+	#######################################################################
+	#
+	# time function
+	#		returns the time of the record index
+	#
+	#######################################################################
+	def time(self, index):
+		return struct.unpack_from('<d', self.__map, HEADER.size + index * RECORD.size + TIME_OFFSET)[0]
+
+	#######################################################################
+	#
+	# bisect function
+	#		returns the index of the first record at or after when
+	#
+	#######################################################################
+	def bisect(self, when):
+		(low, high) = (0, self.__size)
+		while(low < high):
+			middle = (low + high) // 2
+			if(self.time(middle) < when):
+				low = middle + 1
+			else:
+				high = middle
+		return low
+
+	#######################################################################
+	#
+	# range function
+	#		returns the indexes (first, end) of the records between start and end (times, None: no limit)
+	#
+	#######################################################################
+	def range(self, start=None, end=None):
+		first = 0 if start is None else self.bisect(start)
+		last  = self.__size if end is None else self.bisect(end)
+		return (first, max(first, last))
+
+	#######################################################################
+	#
+	# __field: strided copy of a one byte field of the records first..last
+	#
+	#######################################################################
+	def __field(self, first, last, offset):
+		begin = HEADER.size + first * RECORD.size + offset
+		return self.__map[begin:HEADER.size + last * RECORD.size:RECORD.size]
+
+	#######################################################################
+	#
+	# __codes: one byte per record of first..last combining its fields
+	#		code = ((dps matches * 3 + old + 1) * 2 + new) * 3 + source
+	#		(built with translate and long integer arithmetic: no Python object per record)
+	#
+	#######################################################################
+	def __codes(self, first, last, dps):
+		count = last - first
+		if(count <= 0):
+			return b''
+		match = bytearray(256)
+		match[dps] = 1
+		code  = int.from_bytes(self.__field(first, last, DPS_OFFSET).translate(match), 'little') * 3
+		code += int.from_bytes(self.__field(first, last, DPS_OFFSET + 1).translate(_OLD_CODES), 'little')
+		code  = code * 2 + int.from_bytes(self.__field(first, last, NEW_OFFSET).translate(_NEW_CODES), 'little')
+		code  = code * 3 + int.from_bytes(self.__field(first, last, NEW_OFFSET + 1).translate(_SOURCE_CODES), 'little')
+		return code.to_bytes(count, 'little')
+
+	#######################################################################
+	#
+	# code function: code of a record of dps (see __codes)
+	#
+	#######################################################################
+	@staticmethod
+	def code(old, new, source):
+		return ((3 + old + 1) * 2 + new) * 3 + source
+
+	#######################################################################
+	#
+	# count function
+	#		returns the number of records between start and end (times)
+	#		of dps (None: all) to the state new (True/False, None: all)
+	#
+	#######################################################################
+	def count(self, start=None, end=None, dps=None, new=None):
+		(first, last) = self.range(start, end)
+		if(dps is None and new is None):
+			return last - first
+		if(new is None):
+			return self.__field(first, last, DPS_OFFSET).count(bytes((dps,)))
+		if(dps is None):
+			return self.__field(first, last, NEW_OFFSET).count(bytes((state_value(new) & 0xff,)))
+		codes = self.__codes(first, last, dps)
+		return sum(codes.count(bytes((self.code(old, state_value(new), source),))) for old in (UNKNOWN, 0, 1) for source in range(len(SOURCES)))
+
+	#######################################################################
+	#
+	# dps function
+	#		returns the sorted list of the dps of the records between start and end
+	#
+	#######################################################################
+	def dps(self, start=None, end=None):
+		(first, last) = self.range(start, end)
+		return sorted(set(self.__field(first, last, DPS_OFFSET)))
+
+	#######################################################################
+	#
+	# records function
+	#		yields the records between start and end (times) of dps (None: all)
+	#
+	#######################################################################
+	def records(self, start=None, end=None, dps=None):
+		(first, last) = self.range(start, end)
+		if(dps is None):
+			for index in range(first, last):
+				yield self.record(index)
+			return
+		#only the records of dps are unpacked
+		field = self.__field(first, last, DPS_OFFSET)
+		value = bytes((dps,))
+		index = field.find(value)
+		while(index != -1):
+			yield self.record(first + index)
+			index = field.find(value, index + 1)
+
+	#######################################################################
+	#
+	# summary function
+	#		returns a dict dps -> dict transitions, on, off and the counts per source
+	#		of the records between start and end (times)
+	#
+	#######################################################################
+	def summary(self, start=None, end=None):
+		(first, last) = self.range(start, end)
+		result = {}
+		for dps in self.dps(start, end):
+			codes = self.__codes(first, last, dps)
+			entry = dict.fromkeys(("transitions", "on", "off") + SOURCES, 0)
+			for old in (UNKNOWN, 0, 1):
+				for new in (0, 1):
+					for source in range(len(SOURCES)):
+						count = codes.count(bytes((self.code(old, new, source),)))
+						entry["transitions"]     += count
+						entry["on" if new else "off"] += count
+						entry[SOURCES[source]]   += count
+			result[dps] = entry
+		return result
+
+	#######################################################################
+	#
+	# on_time function
+	#		returns the time (seconds) spent on by dps between start and end (times, end None: now)
+	#		(only the records of dps are unpacked)
+	#
+	#######################################################################
+	def on_time(self, dps, start=None, end=None):
+		if(end is None):
+			end = time.time()
+		(total, since, first) = (0.0, None, True)
+		for (when, dps_id, old, new, source) in self.records(start, end, dps):
+			if(first and old == 1 and start is not None):
+				since = start				#on at the beginning of the range
+			first = False
+			if(new == 1 and since is None):
+				since = when
+			elif(new != 1 and since is not None):
+				total += when - since
+				since  = None
+		if(since is not None):
+			total += end - since
+		return total
+
+#######################################################################
+#
+# parse_duration: "90", "90s", "15m", "12h", "7d" -> seconds
+#
+#######################################################################
+def parse_duration(value):
+	units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+	if(value[-1:] in units):
+		return float(value[:-1]) * units[value[-1]]
+	return float(value)
+
+#######################################################################
+#
+# main
+#
+#######################################################################
+def main(argv):
+	parser = argparse.ArgumentParser(description="State transitions of the sockets recorded by the plugin (option history)")
+	parser.add_argument("files",   nargs="+",             help="history files (tuya_history_DEVID.bin in the plugin folder)")
+	parser.add_argument("--since",                        help="only the transitions of the last period (e.g. 7d, 12h, 30m)")
+	parser.add_argument("--until",                        help="only the transitions older than the period (e.g. 1d)")
+	parser.add_argument("--dps",   type=int,              help="only this dps")
+	parser.add_argument("--last",  type=int, default=0,   help="also print the last N transitions")
+	args = parser.parse_args(argv)
+
+	now   = time.time()
+	start = now - parse_duration(args.since) if args.since else None
+	end   = now - parse_duration(args.until) if args.until else now
+	for path in args.files:
+		try:
+			history = HistoryFile(path)
+		except (OSError, ValueError) as e:
+			print(path + ": " + str(e))
+			continue
+		with history:
+			print(path + ": " + str(len(history)) + " records, " + str(history.count(start, end)) + " in the range")
+			print("  %5s %11s %8s %8s %8s %8s %8s" % ("dps", "transitions", "on", "off", "command", "poll", "push"))
+			for (dps, entry) in sorted(history.summary(start, end).items()):
+				if(args.dps is not None and dps != args.dps):
+					continue
+				print("  %5d %11d %8d %8d %8d %8d %8d" % (dps, entry["transitions"], entry["on"], entry["off"], entry["command"], entry["poll"], entry["push"]))
+			if(args.dps is not None):
+				print("  dps " + str(args.dps) + " on for %.2f h" % (history.on_time(args.dps, start, end) / 3600))
+			if(args.last > 0):
+				(first, last) = history.range(start, end)
+				records = list(history.records(start, end, args.dps)) if args.dps is not None else [history.record(index) for index in range(max(first, last - args.last), last)]
+				for (when, dps, old, new, source) in records[-args.last:]:
+					print("  %s dps %3d %2d -> %2d %s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(when)), dps, old, new, SOURCES[source] if source < len(SOURCES) else str(source)))
+	return 0
+
+if __name__ == "__main__":
+	exit(main(sys.argv[1:]))
@@ -0,0 +1,266 @@
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+
+# OpenMetrics (Prometheus) exporter of the performance counters (no Domoticz dependency)
+#	a HTTP server thread renders the DeviceStats at each scrape: the Domoticz callbacks only
+#	update the counters, histograms and gauges as before (no work per scrape in the plugin thread)
+#
+# usage: plugin option metrics=port or metrics=address:port (default address 127.0.0.1)
+#	curl http://127.0.0.1:9469/metrics
+
+import time
+import threading
+import socketserver
+import http.server
+
+import tuya_stats
+
+#######################################################################
+#
+# constant definition
+#
+#######################################################################
+OPENMETRICS = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS  = "text/plain; version=0.0.4; charset=utf-8"
+
+#######################################################################
+#
+# _label: escaped label value
+#
+#######################################################################
+def _label(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+#######################################################################
+#
+# _number: sample value
+#
+#######################################################################
+def _number(value):
+	if(isinstance(value, bool)):
+		return "1" if value else "0"
+	if(isinstance(value, float)):
+		return repr(value)
+	return str(value)
+
+########################################################################################
+#
+# MetricsWriter: text exposition of the metric families
+#	openmetrics: True for the OpenMetrics format, False for the Prometheus text format 0.0.4
+#
+########################################################################################
+class MetricsWriter:
+
+	#######################################################################
+	#
+	# constructor
+	#
+	#######################################################################
+	def __init__(self, openmetrics=True):
+		self.__openmetrics = openmetrics
+		self.__lines       = []
+		return
+
+	#######################################################################
+	#
+	# family function
+	#		metric family header (kind: counter, gauge or histogram)
+	#
+	#######################################################################
+	def family(self, name, kind, help):
+		if(kind == "counter" and not self.__openmetrics):
+			name += "_total"
+		self.__lines.append("# TYPE " + name + " " + kind)
+		self.__lines.append("# HELP " + name + " " + help)
+
+	#######################################################################
+	#
+	# sample function
+	#		labels: list of (name, value)
+	#
+	#######################################################################
+	def sample(self, name, labels, value):
+		if(len(labels) != 0):
+			name += "{" + ",".join(key + '="' + _label(label) + '"' for (key, label) in labels) + "}"
+		self.__lines.append(name + " " + _number(value))
+
+	#######################################################################
+	#
+	# histogram function
+	#		samples of a tuya_stats.LatencyHistogram (seconds)
+	#
+	#######################################################################
+	def histogram(self, name, labels, histogram):
+		counts = list(histogram.counts)		#copy: the plugin thread may add a sample meanwhile
+		total  = histogram.total
+		seen   = 0
+		for (bound, count) in zip(histogram.BOUNDS, counts):
+			seen += count
+			self.sample(name + "_bucket", labels + [("le", repr(float(bound)))], seen)
+		seen += counts[-1]
+		self.sample(name + "_bucket", labels + [("le", "+Inf")], seen)
+		self.sample(name + "_count", labels, seen)
+		self.sample(name + "_sum", labels, float(total))
+
+	#######################################################################
+	#
+	# text function
+	#		returns the exposition (bytes)
+	#
+	#######################################################################
+	def text(self):
+		if(self.__openmetrics):
+			self.__lines.append("# EOF")
+		return ("\n".join(self.__lines) + "\n").encode('utf-8')
+
+#######################################################################
+#
+# render: exposition of the plugin and device metrics
+#
+# Parameters
+#	exporter:    MetricsExporter (devices, heartbeat, started)
+#	openmetrics: True for the OpenMetrics format, False for the Prometheus text format 0.0.4
+#
+#######################################################################
+def render(exporter, openmetrics=True):
+	writer  = MetricsWriter(openmetrics)
+	devices = list(exporter.devices)
+	
+	writer.family("tuya_plugin_start_time_seconds", "gauge", "Start time of the plugin")
+	writer.sample("tuya_plugin_start_time_seconds", [], float(exporter.started))
+	writer.family("tuya_plugin_devices", "gauge", "Number of Tuya devices")
+	writer.sample("tuya_plugin_devices", [], len(devices))
+	writer.family("tuya_plugin_heartbeat_seconds", "histogram", "Duration of the onHeartbeat callback")
+	writer.histogram("tuya_plugin_heartbeat_seconds", [], exporter.heartbeat)
+	
+	writer.family("tuya_device_connected", "gauge", "1 if the connection to the device (or to the gateway) is open")
+	for stats in devices:
+		writer.sample("tuya_device_connected", [("device", stats.name)], stats.connected)
+	writer.family("tuya_device_reachable", "gauge", "0 when the device is declared unreachable (Domoticz units TimedOut)")
+	for stats in devices:
+		writer.sample("tuya_device_reachable", [("device", stats.name)], stats.reachable)
+	writer.family("tuya_device_last_answer_time_seconds", "gauge", "Time of the last answer of the device (0: none)")
+	for stats in devices:
+		writer.sample("tuya_device_last_answer_time_seconds", [("device", stats.name)], float(stats.last_answer))
+	
+	for counter in tuya_stats.DeviceStats.COUNTERS:
+		writer.family("tuya_device_" + counter, "counter", counter.replace("_", " ").capitalize() + " (see tuya_stats.DeviceStats)")
+		for stats in devices:
+			writer.sample("tuya_device_" + counter + "_total", [("device", stats.name)], stats.counters.get(counter, 0))
+	
+	for (name, help) in (("rtt",      "Request sent to answer received"),
+						 ("confirm",  "Command received to state confirmed by the device"),
+						 ("send_lag", "Poll due at a heartbeat to request sent")):
+		writer.family("tuya_device_" + name + "_seconds", "histogram", help)
+		for stats in devices:
+			writer.histogram("tuya_device_" + name + "_seconds", [("device", stats.name)], getattr(stats, name))
+	
+	return writer.text()
+
+########################################################################################
+#
+# _Handler: GET /metrics
+#
+########################################################################################
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+	def do_GET(self):
+		if(self.path.split("?")[0] not in ("/metrics", "/")):
+			self.send_error(404)
+			return
+		openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+		try:
+			body = render(self.server.exporter, openmetrics)
+		except Exception as e:		#never kill the server thread
+			self.send_error(500, str(e))
+			return
+		self.send_response(200)
+		self.send_header("Content-Type", OPENMETRICS if openmetrics else PROMETHEUS)
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		return		#no output in the Domoticz log
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+	daemon_threads      = True
+	allow_reuse_address = True
+
+########################################################################################
+#
+# MetricsExporter: HTTP server thread of the metrics
+#	devices:   list of the tuya_stats.DeviceStats exported
+#	heartbeat: tuya_stats.CallbackHistogram of the onHeartbeat durations (filled by the plugin)
+#
+########################################################################################
+class MetricsExporter:
+
+	#######################################################################
+	#
+	# constructor
+	#
+	#######################################################################
+	def __init__(self, address, port):
+		self.address   = address
+		self.port      = port
+		self.devices   = []
+		self.heartbeat = tuya_stats.CallbackHistogram()
+		self.started   = time.time()
+		self.__server  = None
+		self.__thread  = None
+		return
+
+	#######################################################################
+	#
+	# start function
+	#		raises OSError if the port cannot be bound
+	#
+	#######################################################################
+	def start(self):
+		self.__server          = _Server((self.address, self.port), _Handler)
+		self.__server.exporter = self
+		self.port              = self.__server.server_address[1]
+		self.__thread          = threading.Thread(target=self.__server.serve_forever, name="tuya_metrics", daemon=True)
+		self.__thread.start()
+
+	#######################################################################
+	#
+	# stop function
+	#		the thread must be stopped before the plugin is unloaded (onStop)
+	#
+	#######################################################################
+	def stop(self):
+		if(self.__server is None):
+			return
+		self.__server.shutdown()
+		self.__server.server_close()
+		self.__thread.join(5)
+		self.__server = None
+		self.__thread = None
@@ -0,0 +1,654 @@
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+# Tuya LAN protocol helpers (framing only, no Domoticz dependency)
+#
+# Frame layout (all integers big endian):
+#	prefix (0x000055AA) | seq | cmd | length | [retcode] payload | crc32 | suffix (0x0000AA55)
+#	length counts everything after the length field (payload + crc + suffix)
+#	retcode is only present in the frames sent by the device
+
+import os
+import json
+import time
+import tempfile
+import base64
+import struct
+import binascii
+from hashlib import md5
+from collections import namedtuple, OrderedDict
+
+AES   = None		#PyCrypto / PyCryptodome AES module (imported at the first use, see load_backend)
+pyaes = None		#pure python fallback https://github.com/ricmoo/pyaes
+
+#######################################################################
+#
+# constant definition
+#
+#######################################################################
+PREFIX       = 0x000055AA
+SUFFIX       = 0x0000AA55
+PREFIX_BYTES = b'\x00\x00\x55\xaa'
+
+HEADER       = struct.Struct('>4I')	#prefix, seq, cmd, length
+FOOTER       = struct.Struct('>2I')	#crc, suffix
+
+#command types
+UDP          = 0		#3.1 broadcast
+CONTROL      = 7		#set
+STATUS       = 8		#unsolicited status push
+HEART_BEAT   = 9
+DP_QUERY     = 10		#status
+UDP_NEW      = 19		#3.3 broadcast
+
+PROTOCOL_31  = b'3.1'
+PROTOCOL_33  = b'3.3'
+
+MAX_FRAME    = 4096		#larger length fields are considered as garbage
+
+BLOCK_SIZE   = 16		#AES block size
+SET_CACHE    = 32		#number of set payloads kept by PayloadEncoder
+
+UDP_KEY      = md5(b'yGAdlopoPVldABfn').digest()	#key of the 3.3 broadcasts (port 6667)
+UDP_PORTS    = (6666, 6667)							#broadcast ports: 3.1 clear text, 3.3 encrypted
+
+VERSIONS         = (3.1, 3.3)		#protocol versions, in the order they are tried
+VERSION_CACHE    = "tuya_versions.json"	#default file of the negotiated versions (devId -> version)
+VERSION_FAILURES = 2				#unreadable answers before the other version is tried
+
+#######################################################################
+#
+# TuyaFrame: a complete frame received from a device
+#	cmd:     command type
+#	seq:     sequence number
+#	retcode: return code (None if absent)
+#	dps:     dict of the dps (None if the frame does not hold any dps)
+#
+#######################################################################
+TuyaFrame = namedtuple('TuyaFrame', 'cmd seq retcode dps')
+
+#######################################################################
+#
+# decode_json
+#
+# Parameter
+#	payload: frame payload (retcode removed)
+#	cipher:  pytuya.AESCipher like object (None if not available)
+#
+# Returns the decoded json object (dict) or None
+#
+#######################################################################
+def decode_json(payload, cipher=None):
+
+	if(len(payload) == 0):
+		return None
+
+	try:
+		if(payload[:1] == b'{'):							#3.1 clear text
+			result = bytes(payload)
+		elif(cipher is None):
+			return None
+		elif(payload[:3] == PROTOCOL_31):					#3.1 encrypted: version + md5 + base64
+			result = cipher.decrypt(bytes(payload[19:]))
+		elif(payload[:3] == PROTOCOL_33):					#3.3 with header: version + 12 bytes
+			result = cipher.decrypt(bytes(payload[15:]), False)
+		else:												#3.3 without header
+			result = cipher.decrypt(bytes(payload), False)
+
+		if not isinstance(result, str):
+			result = result.decode()
+
+		result = json.loads(result)
+
+	except (ValueError, TypeError, IndexError, UnicodeDecodeError) as e:
+		return None
+
+	if not isinstance(result, dict):
+		return None
+	return result
+
+#######################################################################
+#
+# decode_payload
+#
+# Parameter
+#	payload: frame payload (retcode removed)
+#	cipher:  pytuya.AESCipher like object (None if not available)
+#
+# Returns the dict of the dps or None
+#
+#######################################################################
+def decode_payload(payload, cipher=None):
+
+	result = decode_json(payload, cipher)
+	if(result is None or not isinstance(result.get('dps'), dict)):
+		return None
+	return result['dps']
+
+#######################################################################
+#
+# split_frame
+#
+# Parameter
+#	data: exactly one frame (e.g. an UDP datagram)
+#
+# Returns a tuple (cmd, seq, retcode, payload) or None if data is not a valid frame
+#
+#######################################################################
+def split_frame(data):
+
+	if(len(data) < HEADER.size + FOOTER.size):
+		return None
+
+	(prefix, seq, cmd, length) = HEADER.unpack_from(data, 0)
+	(crc, suffix)              = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+	if(prefix != PREFIX or suffix != SUFFIX or HEADER.size + length != len(data)):
+		return None
+	if(crc != binascii.crc32(data[:-FOOTER.size]) & 0xffffffff):
+		return None
+
+	payload = data[HEADER.size:-FOOTER.size]
+	retcode = None
+	if(len(payload) >= 4 and payload[:3] == b'\x00\x00\x00'):
+		retcode = payload[3]
+		payload = payload[4:]
+	return (cmd, seq, retcode, payload)
+
+########################################################################################
+#
+# FrameDecoder: incremental decoder (one per connection)
+#	feed() accepts any chunk of the TCP stream and returns the complete frames
+#	partial frames are kept until the next chunk, garbage is skipped
+#
+########################################################################################
+class FrameDecoder:
+
+	#######################################################################
+	#
+	# constructor
+	#
+	#######################################################################
+	def __init__(self, cipher=None, max_frame=MAX_FRAME):
+		self.__buffer    = bytearray()	#pending bytes
+		self.__cipher    = cipher		#used for encrypted payloads
+		self.__max_frame = max_frame	#max value accepted for the length field
+		self.crc_errors  = 0			#number of frames dropped because of a bad crc
+		self.skipped     = 0			#number of garbage bytes skipped
+		return
+
+	#######################################################################
+	#
+	# reset function
+	#		drop the pending bytes (e.g. after a reconnection)
+	#
+	#######################################################################
+	def reset(self):
+		del self.__buffer[:]
+
+	#######################################################################
+	#
+	# pending function
+	#		returns the number of buffered bytes
+	#
+	#######################################################################
+	def pending(self):
+		return len(self.__buffer)
+
+	#######################################################################
+	#
+	# feed function
+	#
+	# Parameter
+	#	data: bytes received from the device
+	#
+	# Returns the list of complete TuyaFrame
+	#
+	#######################################################################
+	def feed(self, data):
+
+		buffer = self.__buffer
+		buffer += data
+		frames = []
+		pos    = 0
+		end    = len(buffer)
+
+		with memoryview(buffer) as view:
+			while(True):
+
+				start = buffer.find(PREFIX_BYTES, pos)
+				if(start == -1):
+					#keep the last 3 bytes: they may be the beginning of a prefix
+					self.skipped += max(0, end - 3 - pos)
+					pos = max(pos, end - 3)
+					break
+
+				self.skipped += start - pos
+				pos = start
+
+				if(end - pos < HEADER.size):
+					break
+
+				(prefix, seq, cmd, length) = HEADER.unpack_from(buffer, pos)
+				if(length < FOOTER.size or length > self.__max_frame):
+					pos += 1	#not a real header: resync
+					self.skipped += 1
+					continue
+
+				frame_end = pos + HEADER.size + length
+				if(frame_end > end):
+					break		#incomplete frame: wait for more data
+
+				(crc, suffix) = FOOTER.unpack_from(buffer, frame_end - FOOTER.size)
+				if(suffix != SUFFIX or crc != binascii.crc32(view[pos:frame_end - FOOTER.size]) & 0xffffffff):
+					self.crc_errors += 1
+					pos += 1
+					continue
+
+				start   = pos + HEADER.size
+				retcode = None
+				if(frame_end - FOOTER.size - start >= 4 and buffer[start:start + 3] == b'\x00\x00\x00'):
+					retcode = buffer[start + 3]
+					start  += 4
+
+				with view[start:frame_end - FOOTER.size] as payload:
+					frames.append(TuyaFrame(cmd, seq, retcode, decode_payload(payload, self.__cipher)))
+				pos = frame_end
+
+		del buffer[:pos]
+		return frames
+
+#######################################################################
+#
+# encode_frame
+#
+# Parameters
+#	cmd:     command type
+#	payload: bytes
+#	seq:     sequence number
+#	retcode: return code (None for the frames sent to a device)
+#
+# Returns the complete frame (bytes)
+#
+#######################################################################
+def encode_frame(cmd, payload, seq=0, retcode=None):
+
+	if(retcode is not None):
+		payload = struct.pack('>I', retcode) + payload
+
+	buffer = HEADER.pack(PREFIX, seq, cmd, len(payload) + FOOTER.size) + payload
+	return buffer + FOOTER.pack(binascii.crc32(buffer) & 0xffffffff, SUFFIX)
+
+#######################################################################
+#
+# load_backend
+#		import the crypto backend (once, at the first cipher creation:
+#		the plugin starts without paying the import)
+#
+#######################################################################
+def load_backend():
+
+	global AES, pyaes
+	if(AES is not None or pyaes is not None):
+		return
+	try:
+		from Crypto.Cipher import AES as module
+		AES = module
+	except ImportError:
+		try:
+			import pyaes as module
+			pyaes = module
+		except ImportError:
+			raise ImportError("pycrypto, pycryptodome or pyaes is needed")
+
+########################################################################################
+#
+# AESCipher: same interface as pytuya.AESCipher
+#	but the AES object (key schedule) is created once and reused
+#
+########################################################################################
+class AESCipher:
+
+	#######################################################################
+	#
+	# constructor
+	#
+	#######################################################################
+	def __init__(self, key):
+		load_backend()
+		if(AES is not None):
+			self.__aes = AES.new(key, AES.MODE_ECB)
+		else:
+			self.__aes = pyaes.AESModeOfOperationECB(key)
+		return
+
+	#######################################################################
+	#
+	# encrypt_blocks function
+	#		data: bytes (length multiple of BLOCK_SIZE)
+	#
+	#######################################################################
+	def encrypt_blocks(self, data):
+		if(AES is not None):
+			return self.__aes.encrypt(bytes(data))
+		return b''.join(self.__aes.encrypt(bytes(data[i:i + BLOCK_SIZE])) for i in range(0, len(data), BLOCK_SIZE))
+
+	#######################################################################
+	#
+	# decrypt_blocks function
+	#		data: bytes (length multiple of BLOCK_SIZE)
+	#
+	#######################################################################
+	def decrypt_blocks(self, data):
+		if(AES is not None):
+			return self.__aes.decrypt(bytes(data))
+		return b''.join(self.__aes.decrypt(bytes(data[i:i + BLOCK_SIZE])) for i in range(0, len(data), BLOCK_SIZE))
+
+	#######################################################################
+	#
+	# encrypt function (PKCS#7 padding)
+	#
+	#######################################################################
+	def encrypt(self, raw, use_base64=True):
+		result = self.encrypt_blocks(pad(raw))
+		if(use_base64):
+			return base64.b64encode(result)
+		return result
+
+	#######################################################################
+	#
+	# decrypt function
+	#		returns a str
+	#
+	#######################################################################
+	def decrypt(self, enc, use_base64=True):
+		if(use_base64):
+			enc = base64.b64decode(enc)
+		raw = self.decrypt_blocks(enc)
+		return raw[:-raw[-1]].decode('utf-8')
+
+# PKCS#7 padding
+def pad(raw):
+	padnum = BLOCK_SIZE - len(raw) % BLOCK_SIZE
+	return raw + bytes((padnum,)) * padnum
+
+########################################################################################
+#
+# PayloadEncoder: builds the frames sent to a device (same bytes as pytuya.generate_payload)
+#	- the status frame never changes: built once
+#	- the set frames are kept in a bounded LRU cache (key: dps),
+#	  the timestamp is patched in the plain text and, the cipher being ECB,
+#	  only the blocks holding the timestamp are encrypted again
+#
+########################################################################################
+class PayloadEncoder:
+
+	#######################################################################
+	#
+	# constructor
+	#
+	# Parameters
+	#	dev_id:    devID of the device
+	#	local_key: local key (bytes)
+	#	version:   protocol version (3.1 or 3.3)
+	#
+	#######################################################################
+	def __init__(self, dev_id, local_key, version=3.1, cache_size=SET_CACHE):
+		if(not local_key and version == 3.3):
+			raise ValueError("the local key is needed for the protocol 3.3")
+		self.cipher       = AESCipher(local_key) if local_key else None	#None: only 3.1 status frames
+		self.__dev_id     = dev_id
+		self.__local_key  = local_key
+		self.__version    = version
+		self.__cache_size = cache_size
+		self.__sets       = OrderedDict()	#dps items -> [plain text, cipher text, ts offset, ts length]
+
+		payload = self.__dumps({"gwId": dev_id, "devId": dev_id})
+		if(version == 3.3):
+			payload = self.cipher.encrypt(payload, False)
+		self.__status_payload = payload
+		self.__status    = encode_frame(DP_QUERY, payload)
+		self.__heartbeat = encode_frame(HEART_BEAT, self.cipher.encrypt(b'{}', False) if version == 3.3 else b'{}')
+		return
+
+	#######################################################################
+	#
+	# __dumps: json without spaces (the device does not answer otherwise)
+	#
+	#######################################################################
+	def __dumps(self, data):
+		return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+	#######################################################################
+	#
+	# __build_set
+	#		returns the cache entry of dps for a timestamp of ts_len digits
+	#
+	#######################################################################
+	def __build_set(self, dps, ts_len):
+		mark  = b'#' * ts_len
+		plain = bytearray(pad(self.__dumps({"devId": self.__dev_id, "uid": self.__dev_id, "t": mark.decode(), "dps": dps})))
+		return [plain, bytearray(self.cipher.encrypt_blocks(plain)), plain.find(mark), ts_len]
+
+	#######################################################################
+	#
+	# status function
+	#		returns the status frame (sequence number seq)
+	#
+	#######################################################################
+	def status(self, seq=0):
+		if(seq == 0):
+			return self.__status
+		return encode_frame(DP_QUERY, self.__status_payload, seq)
+
+	#######################################################################
+	#
+	# heartbeat function
+	#		returns the heartbeat frame (keeps the connection open)
+	#
+	#######################################################################
+	def heartbeat(self):
+		return self.__heartbeat
+
+	#######################################################################
+	#
+	# set function
+	#		returns the set frame of dps (dict dps id (str) -> value, sequence number seq)
+	#
+	#######################################################################
+	def set(self, dps, now=None, seq=0):
+
+		if(now is None):
+			now = time.time()
+		if(self.cipher is None):
+			raise ValueError("the local key is needed for the set frames")
+		ts  = str(int(now)).encode()
+		key = tuple(dps.items())
+
+		entry = self.__sets.get(key)
+		if(entry is None or entry[3] != len(ts)):
+			entry = self.__build_set(dps, len(ts))
+			self.__sets[key] = entry
+			if(len(self.__sets) > self.__cache_size):
+				self.__sets.popitem(last=False)
+		else:
+			self.__sets.move_to_end(key)
+
+		(plain, crypted, offset, ts_len) = entry
+		plain[offset:offset + ts_len] = ts
+		first = offset - offset % BLOCK_SIZE
+		last  = offset + ts_len + (-(offset + ts_len)) % BLOCK_SIZE
+		crypted[first:last] = self.cipher.encrypt_blocks(plain[first:last])
+
+		return encode_frame(CONTROL, wrap_crypted(bytes(crypted), self.__local_key, self.__version), seq)
+
+#######################################################################
+#
+# wrap_crypted
+#
+# Parameters
+#	crypted:   encrypted json (bytes)
+#	local_key: local key (bytes)
+#	version:   protocol version (3.1 or 3.3)
+#
+# Returns the payload of a set (or push) frame:
+#	3.1: version + md5 + base64
+#	3.3: version + 12 bytes header + encrypted json
+#
+#######################################################################
+def wrap_crypted(crypted, local_key, version):
+
+	if(version == 3.3):
+		return PROTOCOL_33 + b'\0' * 12 + crypted
+
+	payload = base64.b64encode(crypted)
+	digest  = md5(b'data=' + payload + b'||lpv=' + PROTOCOL_31 + b'||' + local_key).hexdigest()
+	return PROTOCOL_31 + digest[8:24].encode('latin1') + payload
+
+#######################################################################
+#
+# payload_version
+#		returns the protocol version of a payload sent to a device (3.1 or 3.3, None if empty)
+#		3.1: clear json (status, heartbeat) or version + md5 + base64 (set)
+#		3.3: encrypted json (status, heartbeat) or version + 12 bytes header + encrypted json (set)
+#
+#######################################################################
+def payload_version(payload):
+
+	if(len(payload) == 0):
+		return None
+	if(payload[:1] == b'{' or payload[:3] == PROTOCOL_31):
+		return 3.1
+	return 3.3
+
+#######################################################################
+#
+# other_version
+#		returns the next protocol version to try after version
+#
+#######################################################################
+def other_version(version):
+	return VERSIONS[(VERSIONS.index(version) + 1) % len(VERSIONS)] if version in VERSIONS else VERSIONS[0]
+
+#######################################################################
+#
+# check_local_key
+#		raises ValueError if local_key (str) cannot encrypt the frames
+#		(an empty key is only accepted when not required: 3.1 status frames)
+#
+#######################################################################
+def check_local_key(local_key, required=True):
+
+	if(not isinstance(local_key, str)):
+		raise ValueError("invalid local key " + repr(local_key) + " (16 characters expected)")
+	if(local_key == ""):
+		if(required):
+			raise ValueError("the local key is needed (16 characters)")
+		return
+	if(len(local_key.encode('latin1')) not in (16, 24, 32)):
+		raise ValueError("invalid local key " + repr(local_key) + " (16 characters expected)")
+
+########################################################################################
+#
+# VersionCache: protocol versions negotiated with the devices (json file devId -> version)
+#	shared by the plugin and the helper scripts, written only when a version changes
+#
+########################################################################################
+class VersionCache:
+
+	#######################################################################
+	#
+	# constructor
+	#		path: json file (created at the first set)
+	#
+	#######################################################################
+	def __init__(self, path):
+		self.path       = path
+		self.__versions = self.__load()
+		return
+
+	#######################################################################
+	#
+	# __load: returns the content of the file (empty dict if missing or invalid, invalid entries are dropped)
+	#
+	#######################################################################
+	def __load(self):
+		try:
+			with open(self.path) as f:
+				versions = json.load(f)
+		except (OSError, ValueError):
+			return {}
+		if(not isinstance(versions, dict)):
+			return {}
+		result = {}
+		for (dev_id, version) in versions.items():
+			try:
+				version = float(version)
+			except (TypeError, ValueError):
+				continue	#e.g. edited by hand
+			if(version in VERSIONS):
+				result[dev_id] = version
+		return result
+
+	#######################################################################
+	#
+	# get function
+	#		returns the version of dev_id (default if unknown)
+	#
+	#######################################################################
+	def get(self, dev_id, default=None):
+		return self.__versions.get(dev_id, default)
+
+	#######################################################################
+	#
+	# set function
+	#		records the version of dev_id (the file is read again to keep the versions written by other processes)
+	#		the file is replaced by a temporary file of its own (the plugin, the gateway and the helper
+	#		scripts may write it at the same time)
+	#		returns False if the file cannot be written
+	#
+	#######################################################################
+	def set(self, dev_id, version):
+		if(self.__versions.get(dev_id) == version):
+			return True
+		self.__versions = self.__load()
+		self.__versions[dev_id] = version
+		temporary = None
+		try:
+			try:
+				mode = os.stat(self.path).st_mode & 0o777
+			except OSError:
+				mode = 0o644		#mkstemp creates the file readable by its owner only
+			(handle, temporary) = tempfile.mkstemp(".tmp", os.path.basename(self.path) + ".", os.path.dirname(self.path) or ".")
+			with os.fdopen(handle, "w") as f:
+				json.dump(self.__versions, f, indent=1, sort_keys=True)
+			os.chmod(temporary, mode)
+			os.replace(temporary, self.path)
+		except OSError:
+			if(temporary is not None and os.path.exists(temporary)):
+				os.unlink(temporary)
+			return False
+		return True
@@ -0,0 +1,356 @@
+########################################################################################
+# 	Domoticz Tuya Smart Plug Python Plugin                                             #
+#                                                                                      #
+# 	MIT License                                                                        #
+#                                                                                      #
+#	Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#	Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#	of this software and associated documentation files (the "Software"), to deal      #
+#	in the Software without restriction, including without limitation the rights       #
+#	to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#	copies of the Software, and to permit persons to whom the Software is              #
+#	furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#	The above copyright notice and this permission notice shall be included in all     #
+#	copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#	THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#	IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#	FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#	AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#	LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#	OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#	SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# performance counters and latency histograms of the plugin (no Domoticz dependency)
+
+import io
+import time
+import bisect
+
+########################################################################################
+#
+# LatencyHistogram: exponential buckets from 1 ms to 32 s
+#	percentiles are approximated by the upper bound of their bucket (capped by max)
+#
+########################################################################################
+class LatencyHistogram:
+
+	#######################################################################
+	#
+	# constant definition
+	#
+	#######################################################################
+	BOUNDS = tuple(0.001 * 2 ** i for i in range(16))	#upper bounds of the buckets (seconds)
+
+	#######################################################################
+	#
+	# constructor
+	#
+	#######################################################################
+	def __init__(self):
+		self.counts = [0] * (len(self.BOUNDS) + 1)		#last bucket: over 32 s
+		self.count  = 0
+		self.total  = 0.0
+		self.max    = 0.0
+		return
+
+	#######################################################################
+	#
+	# add function
+	#		seconds: a latency sample
+	#
+	#######################################################################
+	def add(self, seconds):
+		self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+		self.count += 1
+		self.total += seconds
+		if(seconds > self.max):
+			self.max = seconds
+
+	#######################################################################
+	#
+	# percentile function
+	#		ratio: 0..1, returns seconds
+	#
+	#######################################################################
+	def percentile(self, ratio):
+		if(self.count == 0):
+			return 0.0
+		rank = ratio * self.count
+		seen = 0
+		for (index, count) in enumerate(self.counts):
+			seen += count
+			if(seen >= rank and count != 0):
+				if(index == len(self.BOUNDS)):
+					return self.max
+				return min(self.BOUNDS[index], self.max)
+		return self.max
+
+	#######################################################################
+	#
+	# to_dict function
+	#		returns count, mean, p50, p95 and max (milliseconds)
+	#
+	#######################################################################
+	def to_dict(self):
+		return {"count": self.count,
+				"mean":  round(self.total / self.count * 1000, 1) if self.count else 0.0,
+				"p50":   round(self.percentile(0.50) * 1000, 1),
+				"p95":   round(self.percentile(0.95) * 1000, 1),
+				"max":   round(self.max * 1000, 1)}
+
+########################################################################################
+#
+# DeviceStats: counters and histograms of a Tuya device
+#	rtt:      request sent -> answer received
+#	confirm:  command received (onCommand) -> state confirmed by the device
+#	send_lag: poll due (heartbeat) -> request sent (queued behind a request or a connection)
+#	gauges written by the plugin and read by the metrics exporter (tuya_metrics.py)
+#
+########################################################################################
+class DeviceStats:
+
+	#######################################################################
+	#
+	# constant definition
+	#
+	#######################################################################
+	COUNTERS = ("status_requests",		#status requests sent
+				"set_requests",			#set requests sent
+				"answers",				#answers matched with a request
+				"decode_failures",		#status answers without readable dps
+				"crc_errors",			#frames dropped by the decoder
+				"mismatch_retries",		#commands sent again (state != command)
+				"timeouts",				#requests without answer before their deadline
+				"refused_commands",		#commands abandoned (never applied by the device)
+				"connects",				#successful connections
+				"connect_errors",		#failed connections
+				"circuit_opens",		#devices declared unreachable (units TimedOut)
+				"pushes",				#unsolicited status updates
+				"heartbeats",			#heartbeat frames sent (push mode)
+				"version_switches")		#protocol versions tried after unreadable answers
+
+	#######################################################################
+	#
+	# constructor
+	#
+	#######################################################################
+	def __init__(self, name):
+		self.name     = name
+		self.counters = dict.fromkeys(self.COUNTERS, 0)
+		self.rtt      = LatencyHistogram()
+		self.confirm  = LatencyHistogram()
+		self.send_lag = LatencyHistogram()
+		self.connected   = False		#connection to the device (or to the gateway) open
+		self.reachable   = True			#False when the device is declared unreachable (units TimedOut)
+		self.last_answer = 0.0			#time of the last answer
+		return
+
+	#######################################################################
+	#
+	# count function
+	#
+	#######################################################################
+	def count(self, counter, value=1):
+		self.counters[counter] += value
+
+	#######################################################################
+	#
+	# to_dict function
+	#
+	#######################################################################
+	def to_dict(self):
+		result = dict(self.counters)
+		result["rtt_ms"]     = self.rtt.to_dict()
+		result["confirm_ms"] = self.confirm.to_dict()
+		result["send_lag_ms"] = self.send_lag.to_dict()
+		return result
+
+	#######################################################################
+	#
+	# summary function
+	#		returns a one line summary (Domoticz text device)
+	#
+	#######################################################################
+	def summary(self):
+		rtt = self.rtt.to_dict()
+		return ("rtt p50/p95/max " + str(rtt["p50"]) + "/" + str(rtt["p95"]) + "/" + str(rtt["max"]) + " ms"
+				+ ", confirm p95 " + str(self.confirm.to_dict()["p95"]) + " ms"
+				+ ", requests " + str(self.counters["status_requests"] + self.counters["set_requests"])
+				+ ", decode errors " + str(self.counters["decode_failures"] + self.counters["crc_errors"])
+				+ ", retries " + str(self.counters["mismatch_retries"])
+				+ ", connects " + str(self.counters["connects"]) + "/" + str(self.counters["connects"] + self.counters["connect_errors"]))
+
+########################################################################################
+#
+# CallbackHistogram: exponential buckets from 10 us to 20 s (duration of a callback)
+#
+########################################################################################
+class CallbackHistogram(LatencyHistogram):
+
+	BOUNDS = tuple(0.00001 * 2 ** i for i in range(22))
+
+########################################################################################
+#
+# CallbackProfiler: time spent in the Domoticz callbacks
+#	call() times each callback, report() returns the ranked summary of the period
+#	optional: cProfile during a sampling window at the beginning of each period (cpu_window seconds)
+#	          and tracemalloc (memory=True) for the top allocations
+#	          (imported only when used: they are not loaded at each start of the plugin)
+#
+########################################################################################
+class CallbackProfiler:
+
+	#######################################################################
+	#
+	# constant definition
+	#
+	#######################################################################
+	TOP = 10		#number of functions / allocations in the summary
+
+	#######################################################################
+	#
+	# constructor
+	#
+	# Parameters
+	#	period:     interval of the summaries (seconds)
+	#	cpu_window: duration of the cProfile sampling at the beginning of each period (seconds, 0: disabled)
+	#	memory:     True to trace the memory allocations (tracemalloc)
+	#	now:        current time
+	#
+	#######################################################################
+	def __init__(self, period, cpu_window=0, memory=False, now=None):
+		if(now is None):
+			now = time.time()
+		self.period       = period
+		self.__cpu_window = cpu_window
+		self.__memory     = False
+		if(memory):
+			import tracemalloc
+			self.__memory = not tracemalloc.is_tracing()	#do not stop a tracing started by someone else
+		self.__timings    = {}			#callback name -> CallbackHistogram
+		self.__start      = now			#beginning of the period
+		self.__busy       = 0.0			#time spent in the callbacks during the period (perf_counter)
+		self.__profile    = None		#cProfile.Profile of the sampling window
+		self.__window_end = 0
+		self.__cpu_stats  = None		#cProfile.Profile of the ended sampling window
+		self.__snapshot   = None		#tracemalloc snapshot of the previous summary
+		if(self.__memory):
+			tracemalloc.start()
+		self.__sample(now)
+		return
+
+	#######################################################################
+	#
+	# __sample: starts a cProfile sampling window
+	#
+	#######################################################################
+	def __sample(self, now):
+		if(self.__cpu_window > 0):
+			import cProfile
+			self.__profile    = cProfile.Profile()
+			self.__window_end = now + self.__cpu_window
+
+	#######################################################################
+	#
+	# call function
+	#		calls function(*args) and records its duration under name
+	#
+	#######################################################################
+	def call(self, name, function, *args):
+		profile = self.__profile
+		start   = time.perf_counter()
+		try:
+			if(profile is not None):
+				return profile.runcall(function, *args)
+			return function(*args)
+		finally:
+			elapsed = time.perf_counter() - start
+			self.__busy += elapsed
+			histogram = self.__timings.get(name)
+			if(histogram is None):
+				histogram = self.__timings[name] = CallbackHistogram()
+			histogram.add(elapsed)
+
+	#######################################################################
+	#
+	# tick function
+	#		ends the sampling window (call it periodically, e.g. at each heartbeat)
+	#		returns the summary lines when the period is over, None otherwise
+	#
+	#######################################################################
+	def tick(self, now):
+		if(self.__profile is not None and now >= self.__window_end):
+			self.__cpu_stats = self.__profile
+			self.__profile   = None
+		if(now - self.__start < self.period):
+			return None
+		lines = self.report(now)
+		self.__timings = {}
+		self.__start   = now
+		self.__busy    = 0.0
+		self.__sample(now)
+		return lines
+
+	#######################################################################
+	#
+	# report function
+	#		returns the summary of the current period (list of lines)
+	#
+	#######################################################################
+	def report(self, now):
+		elapsed = max(now - self.__start, 0.001)
+		lines   = ["Profile of the last " + str(int(elapsed)) + " s: " + str(round(self.__busy * 1000, 1)) + " ms in callbacks ("
+				   + str(round(self.__busy / elapsed * 100, 2)) + "% of the plugin thread)"]
+		ranked  = sorted(self.__timings.items(), key=lambda item: item[1].total, reverse=True)
+		for (name, histogram) in ranked:
+			lines.append("  %-12s calls %6d total %9.1f ms mean %7.3f ms p95 %7.3f ms max %7.3f ms" % (name, histogram.count, histogram.total * 1000,
+						 histogram.total / histogram.count * 1000, histogram.percentile(0.95) * 1000, histogram.max * 1000))
+
+		#cProfile: hotspots of the sampling window
+		profile = self.__profile if self.__profile is not None else self.__cpu_stats
+		self.__cpu_stats = None
+		if(profile is not None):
+			import pstats
+			try:
+				stream = io.StringIO()
+				stats  = pstats.Stats(profile, stream=stream)
+			except TypeError:
+				stats  = None	#no call profiled during the window
+			if(stats is not None):
+				lines.append("  hotspots (own time, first " + str(int(self.__cpu_window)) + " s of the period):")
+				entries = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:self.TOP]
+				for ((filename, line, function), (primitive, calls, own, cumulative, callers)) in entries:
+					lines.append("    %8.3f ms own %8.3f ms cumulative %7d calls  %s:%d(%s)" % (own * 1000, cumulative * 1000, calls,
+								 filename.split("/")[-1], line, function))
+
+		#tracemalloc: growth since the previous summary
+		if(self.__memory):
+			import tracemalloc
+			snapshot = tracemalloc.take_snapshot()
+			(current, peak) = tracemalloc.get_traced_memory()
+			lines.append("  memory: current " + str(current // 1024) + " KB, peak " + str(peak // 1024) + " KB")
+			if(self.__snapshot is not None):
+				for stat in snapshot.compare_to(self.__snapshot, "lineno")[:self.TOP]:
+					frame = stat.traceback[0]
+					lines.append("    %+8d B %6d blocks  %s:%d" % (stat.size_diff, stat.count, frame.filename.split("/")[-1], frame.lineno))
+			self.__snapshot = snapshot
+		return lines
+
+	#######################################################################
+	#
+	# close function
+	#
+	#######################################################################
+	def close(self):
+		if(self.__memory):
+			import tracemalloc
+			tracemalloc.stop()
+			self.__memory   = False
+			self.__snapshot = None
+		self.__profile = None